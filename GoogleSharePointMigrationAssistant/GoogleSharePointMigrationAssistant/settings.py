@@ -80,7 +80,15 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': 'redis://localhost:6379',
-    }
+    },
+    # Graph browse lookups (sites, document libraries, folders) shared by all
+    # users of a tenant; see m365_util.graph_lookup
+    'graph_lookups': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+        'KEY_PREFIX': 'graph-lookup',
+        'TIMEOUT': int(os.environ.get('GRAPH_LOOKUP_CACHE_TTL', 300)),
+    },
 }
 
 # Asynchronous task management with Celery 
@@ -89,13 +97,41 @@ CELERY_RESULT_BACKEND = "redis://localhost:6379"
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# SQLite serializes every write, so Celery workers saving scan results lock
+# out the web tier under load. Production should set DB_ENGINE=postgresql;
+# SQLite remains the default for local development.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get('DB_NAME', 'go365migrator'),
+            "USER": os.environ.get('DB_USER', 'go365migrator'),
+            "PASSWORD": os.environ.get('DB_PASSWORD', ''),
+            "HOST": os.environ.get('DB_HOST', 'localhost'),
+            "PORT": os.environ.get('DB_PORT', '5432'),
+            # Persistent connections, reused across requests and Celery tasks
+            "CONN_MAX_AGE": int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+            "CONN_HEALTH_CHECKS": True,
+            # Server-side cursors break under PgBouncer transaction pooling
+            "DISABLE_SERVER_SIDE_CURSORS": os.environ.get('DB_POOLER', '') == 'pgbouncer',
+            "OPTIONS": {
+                "connect_timeout": int(os.environ.get('DB_CONNECT_TIMEOUT', 10)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                # wait for the write lock rather than raising "database is locked"
+                "timeout": int(os.environ.get('DB_SQLITE_TIMEOUT', 20)),
+            },
+        }
     }
-}
 
 LOGGING = {
     'version': 1,
@@ -160,7 +196,13 @@ AAD_CLIENT_SCOPES = [
     "Files.ReadWrite.All",
     "Sites.Manage.All",
 ]
-GRAPH_API_URL = 'https://graph.microsoft.com/v1.0'
+# Overridable so that benchmarks can point the app at local stand-in servers
+GRAPH_API_URL = os.environ.get('GRAPH_API_URL', 'https://graph.microsoft.com/v1.0')
+GOOGLE_DRIVE_API_URL = os.environ.get('GOOGLE_DRIVE_API_URL', 'https://www.googleapis.com/drive/v3')
+
+# Source picker: folders per page and how long listed pages are cached (seconds)
+GOOGLE_DRIVE_BROWSE_PAGE_SIZE = 100
+GOOGLE_DRIVE_BROWSE_CACHE_TTL = int(os.environ.get('GOOGLE_DRIVE_BROWSE_CACHE_TTL', 300))
 
 GCP_CLIENT_SCOPES = [
     "https://www.googleapis.com/auth/userinfo.profile",
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Migration, AdministrationSettings
+from .models import Profile, Migration, MigrationFile, AdministrationSettings
 # Register your models here.
-for x in [Profile, Migration,AdministrationSettings]:
+for x in [Profile, Migration, MigrationFile, AdministrationSettings]:
     admin.site.register(x)
\ No newline at end of file
@@ -0,0 +1,107 @@
+""" Destination index benchmark: seconds and folders/sec to index a destination
+tree (RemoteFolderCache.build_remote_path_index) at several listing
+concurrencies, against the Graph stub. Some folders hold more children than
+fit on one Graph page, so every page must be followed for the index to be
+complete.
+
+Run with
+
+    python manage.py test web.benchmarks.bench_destination_index
+
+Environment variables:
+    BENCHMARK_NUM_FOLDERS       folders in the destination tree (default 200)
+    BENCHMARK_FILES_PER_FOLDER  files in each folder (default 20)
+    BENCHMARK_LATENCY_MS        per-request latency of the stub (default 20)
+    BENCHMARK_CONCURRENCY       comma-separated DESTINATION_LIST_THREADS values (default 1,4,16)
+    BENCHMARK_OUTPUT            write the results as JSON to this path
+"""
+import json
+import os
+import shutil
+import time
+from unittest import mock
+from django.test import TestCase, override_settings
+from ..models import Migration, User, AdministrationSettings
+from ..plumbing.graphutil import GraphUtil
+from ..plumbing.sharepoint import SharePointUploader
+from ..tests.conf import TARGET_EXAMPLE, GOOGLE_FOLDER_SOURCE
+from .harness import reset_rate_limits
+from .mockservers import GraphStub
+
+BASE = 'benchmark-destination'
+# files in each of the first few folders; more than a page of 999
+LARGE_FOLDER_FILES = 1200
+
+
+def build_destination_tree(graph: GraphStub = None, parent_id: str = '', num_folders: int = 0,
+                           files_per_folder: int = 0):
+    """ A tree of num_folders folders under parent_id, four subfolders per
+    folder. Return the number of files. """
+    folder_ids = [graph._add_item(parent_id, BASE, {'folder': {}})['id']]
+    for i in range(1, num_folders):
+        folder_ids.append(graph._add_item(folder_ids[(i - 1) // 4], f'folder {i}', {'folder': {}})['id'])
+    num_files = 0
+    for i, folder_id in enumerate(folder_ids):
+        count = LARGE_FOLDER_FILES if i < 2 else files_per_folder
+        for j in range(count):
+            graph._add_item(folder_id, f'file {j}.txt', {'file': {'hashes': {}}}, size=j)
+        num_files += count
+    return folder_ids[0], num_files
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class DestinationIndexBenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdministrationSettings(require_idp_login=False).save()
+        cls.user = User.objects.create_user(
+            username='benchmark', email='benchmark@go365migrator.com', password='fakepass')
+
+    def test_index_scales_with_concurrency(self):
+        migration = Migration.objects.create(
+            user=self.user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        num_folders = int(os.environ.get('BENCHMARK_NUM_FOLDERS', 200))
+        graph = GraphStub(
+            existing_folders={migration.target_folder_id: migration.target_folder_name},
+            latency=float(os.environ.get('BENCHMARK_LATENCY_MS', 20)) / 1000)
+        base_folder_id, num_files = build_destination_tree(
+            graph, migration.target_folder_id, num_folders,
+            int(os.environ.get('BENCHMARK_FILES_PER_FOLDER', 20)))
+        concurrencies = [int(c) for c in os.environ.get('BENCHMARK_CONCURRENCY', '1,4,16').split(',')]
+        token = {'access_token': 'benchmark-graph-token', 'expires_in': 3600}
+        results = []
+        with graph, override_settings(GRAPH_API_URL=graph.base_url), \
+                mock.patch('web.plumbing.graphutil.get_token_from_cache', return_value=token):
+            uploader = SharePointUploader(migration=migration)
+            uploader.disable_logging()
+            self.addCleanup(shutil.rmtree, uploader.log_folder_path, ignore_errors=True)
+            for concurrency in concurrencies:
+                graph.reset_counters()
+                reset_rate_limits(GraphUtil.graph_get)
+                with mock.patch('web.plumbing.remotefolders.DESTINATION_LIST_THREADS', concurrency):
+                    start = time.perf_counter()
+                    index = uploader.build_remote_path_index(BASE, base_folder_id)
+                    elapsed = time.perf_counter() - start
+                metrics = {
+                    'concurrency': concurrency,
+                    'folders': num_folders,
+                    'files': len(index),
+                    'seconds': round(elapsed, 3),
+                    'folders_per_sec': round(num_folders / elapsed, 2),
+                    'list_calls': graph.calls['list_children'],
+                }
+                results.append(metrics)
+                print(
+                    f"\nconcurrency {concurrency:>3}: {metrics['files']} files in {num_folders} folders "
+                    f"in {metrics['seconds']}s, {metrics['folders_per_sec']} folders/s, "
+                    f"{metrics['list_calls']} list calls")
+                self.assertEqual(num_files, len(index))
+        if len(results) > 1:
+            print(f"\nconcurrency {results[-1]['concurrency']} / {results[0]['concurrency']} folders/s: "
+                  f"{round(results[-1]['folders_per_sec'] / results[0]['folders_per_sec'], 2)}x")
+        output = os.environ.get('BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
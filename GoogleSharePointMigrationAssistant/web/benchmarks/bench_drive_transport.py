@@ -0,0 +1,99 @@
+""" Drive transport benchmark: files/sec downloading many small files with the
+pooled transports (PooledAuthorizedHttp for API calls, PooledAuthorizedSession
+for content; one keep-alive connection per download thread) against a new
+connection per request, as GoogleToSharePoint used to do. The Drive stub adds a per-connection
+delay standing in for the TCP + TLS handshake to www.googleapis.com.
+
+Run with
+
+    python manage.py test web.benchmarks.bench_drive_transport
+
+Environment variables:
+    BENCHMARK_NUM_FILES           files in the generated Drive tree (default 500)
+    BENCHMARK_LATENCY_MS          per-request latency of the stub (default 20)
+    BENCHMARK_CONNECT_LATENCY_MS  per-connection latency of the stub (default 60)
+    BENCHMARK_OUTPUT              write the results as JSON to this path
+"""
+import json
+import os
+from django.test import TestCase, override_settings
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import HttpRequest, build_http
+from ..models import Migration, User, AdministrationSettings
+from ..plumbing.googleservice import PooledAuthorizedSession, build_drive_service
+from ..tests.conf import TARGET_EXAMPLE, GOOGLE_FOLDER_SOURCE
+from .harness import TransferBenchmark, stub_backends
+from .mockservers import DriveStub, GraphStub
+
+TRANSPORTS = ['per-request', 'pooled']
+
+
+class PerRequestSession:
+    """ Stands in for PooledAuthorizedSession with a new session (and so a new
+    connection) for every download """
+
+    def __init__(self, credentials=None):
+        self.credentials = credentials
+
+    def get(self, *args, **kwargs):
+        return PooledAuthorizedSession(self.credentials, pool_size=1).get(*args, **kwargs)
+
+
+def use_per_request_transport(downloader=None):
+    """ Give downloader a fresh connection per request, as before pooling """
+    def build_request(http=None, *args, **kwargs):
+        return HttpRequest(AuthorizedHttp(downloader.creds, http=build_http()), *args, **kwargs)
+    downloader.build_request = build_request
+    downloader.service = build_drive_service(downloader.creds, request_builder=build_request)
+    downloader.media_session = PerRequestSession(downloader.creds)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class DriveTransportBenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        AdministrationSettings(require_idp_login=False).save()
+        cls.user = User.objects.create_user(
+            username='benchmark', email='benchmark@go365migrator.com', password='fakepass')
+
+    def _run(self, transport: str = 'pooled'):
+        migration = Migration.objects.create(
+            user=self.user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        drive = DriveStub(
+            root_id=migration.source_id,
+            num_files=int(os.environ.get('BENCHMARK_NUM_FILES', 500)),
+            size_distribution='small',
+            latency=float(os.environ.get('BENCHMARK_LATENCY_MS', 20)) / 1000,
+            connect_latency=float(os.environ.get('BENCHMARK_CONNECT_LATENCY_MS', 60)) / 1000)
+        graph = GraphStub(existing_folders={migration.target_folder_id: migration.target_folder_name})
+        with stub_backends(drive, graph):
+            benchmark = TransferBenchmark(
+                migration=migration, drive=drive, graph=graph, engine='threads',
+                local_temp_dir=f'benchmark-transport-{transport}')
+            try:
+                benchmark.scan()
+                if transport == 'per-request':
+                    use_per_request_transport(benchmark.downloader)
+                metrics = benchmark.download()
+            finally:
+                benchmark.cleanup()
+        metrics['transport'] = transport
+        print(
+            f"\n{transport:>12}: {metrics['files']} files in {metrics['seconds']}s, "
+            f"{metrics['files_per_sec']} files/s, {metrics['drive']['connections']} connections, "
+            f"{metrics['drive']['calls']} requests")
+        self.assertEqual(0, metrics['files_failed'])
+        return metrics
+
+    def test_small_file_downloads(self):
+        results = {transport: self._run(transport) for transport in TRANSPORTS}
+        pooled, per_request = results['pooled'], results['per-request']
+        print(f"\npooled / per-request files/s: {round(pooled['files_per_sec'] / per_request['files_per_sec'], 2)}x")
+        self.assertGreaterEqual(per_request['drive']['connections'], per_request['files'])
+        self.assertLess(pooled['drive']['connections'], pooled['files'])
+        output = os.environ.get('BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as f:
+                json.dump(list(results.values()), f, indent=2)
@@ -0,0 +1,104 @@
+""" Scheduling benchmark: simulated makespan of the threads engine's batch
+pipeline (download a batch on MAX_DOWNLOAD_THREADS threads, then upload it on
+MAX_UPLOAD_THREADS threads) for each TransferScheduler policy over synthetic
+file size distributions. Transfer time per file is a fixed per-request cost
+plus size over a per-connection bandwidth (downloads of blobs above
+SEGMENTED_DOWNLOAD_THRESHOLD use SEGMENTED_DOWNLOAD_SEGMENTS connections);
+no servers are started.
+
+    python manage.py test web.benchmarks.bench_scheduling
+
+Environment variables:
+    BENCHMARK_NUM_FILES        files per distribution (default 2000)
+    BENCHMARK_MBPS             per-connection bandwidth in MB/s (default 20)
+    BENCHMARK_REQUEST_MS       fixed cost per file transfer (default 150)
+    BENCHMARK_OUTPUT           write the results as JSON to this path
+"""
+import heapq
+import json
+import os
+import random
+from django.test import SimpleTestCase
+from ..plumbing.constants import (
+    FILE_BATCH_SIZE, MAX_DOWNLOAD_THREADS, MAX_UPLOAD_THREADS, SEGMENTED_DOWNLOAD_SEGMENTS,
+    SEGMENTED_DOWNLOAD_THRESHOLD
+)
+from ..plumbing.scheduling import SCHEDULING_POLICIES, TransferScheduler, get_file_size
+from .mockservers import MB, SIZE_DISTRIBUTIONS
+
+
+def _heavy_tail(rng):
+    """ Pareto sizes: a handful of files hold most of the bytes """
+    return min(int(32 * 1024 * rng.paretovariate(0.9)), 2048 * MB)
+
+
+DISTRIBUTIONS = {**SIZE_DISTRIBUTIONS, 'heavy-tail': _heavy_tail}
+
+
+def transfer_seconds(size: int = 0, request_seconds: float = 0, bytes_per_second: float = 1,
+                     download: bool = False):
+    connections = SEGMENTED_DOWNLOAD_SEGMENTS if download and size >= SEGMENTED_DOWNLOAD_THRESHOLD else 1
+    return request_seconds + size / bytes_per_second / connections
+
+
+def phase_makespan(durations: list = [], num_threads: int = 1):
+    """ Time for num_threads workers to run durations, each worker taking the
+    next one as soon as it is free (ThreadPoolExecutor's behaviour) """
+    workers = [0.0] * min(num_threads, len(durations))
+    heapq.heapify(workers)
+    for duration in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + duration)
+    return max(workers, default=0.0)
+
+
+def simulate(files: list = [], policy: str = 'listing', request_seconds: float = 0, bytes_per_second: float = 1):
+    """ Return (makespan, first_batch_seconds, num_batches) for files under policy """
+    scheduler = TransferScheduler(files, policy=policy, batch_size=FILE_BATCH_SIZE)
+    makespan, first_batch, num_batches = 0.0, None, 0
+    while len(scheduler):
+        sizes = [get_file_size(f) for f in scheduler.next_batch()]
+        downloads = [transfer_seconds(size, request_seconds, bytes_per_second, download=True) for size in sizes]
+        uploads = [transfer_seconds(size, request_seconds, bytes_per_second) for size in sizes]
+        batch_seconds = (phase_makespan(downloads, MAX_DOWNLOAD_THREADS)
+                         + phase_makespan(uploads, MAX_UPLOAD_THREADS))
+        makespan += batch_seconds
+        num_batches += 1
+        if first_batch is None:
+            first_batch = batch_seconds
+    return makespan, first_batch, num_batches
+
+
+class SchedulingBenchmarkTestCase(SimpleTestCase):
+    def test_makespan_by_policy(self):
+        num_files = int(os.environ.get('BENCHMARK_NUM_FILES', 2000))
+        bytes_per_second = float(os.environ.get('BENCHMARK_MBPS', 20)) * MB
+        request_seconds = float(os.environ.get('BENCHMARK_REQUEST_MS', 150)) / 1000
+        results = []
+        for name, distribution in DISTRIBUTIONS.items():
+            rng = random.Random(0)
+            files = [{'id': f'file-{i}', 'size': str(distribution(rng))} for i in range(num_files)]
+            # lower bound: all work spread perfectly over the download and upload threads
+            sizes = [get_file_size(f) for f in files]
+            lower_bound = (
+                sum(transfer_seconds(size, request_seconds, bytes_per_second, download=True) for size in sizes)
+                / MAX_DOWNLOAD_THREADS
+                + sum(transfer_seconds(size, request_seconds, bytes_per_second) for size in sizes)
+                / MAX_UPLOAD_THREADS)
+            listing = None
+            for policy in SCHEDULING_POLICIES:
+                makespan, first_batch, num_batches = simulate(
+                    files, policy=policy, request_seconds=request_seconds, bytes_per_second=bytes_per_second)
+                listing = listing or makespan
+                results.append({
+                    'distribution': name, 'policy': policy, 'makespan_seconds': round(makespan, 1),
+                    'first_batch_seconds': round(first_batch, 1), 'batches': num_batches,
+                    'efficiency': round(lower_bound / makespan, 3), 'vs_listing': round(listing / makespan, 2)})
+                print(
+                    f"\n{name:>10} {policy:>14}: makespan {makespan:9.1f}s, first batch {first_batch:7.1f}s, "
+                    f"{num_batches:4} batches, efficiency {lower_bound / makespan:.0%}, "
+                    f"{listing / makespan:.2f}x vs listing")
+                self.assertLessEqual(lower_bound, makespan + 1e-6)
+        output = os.environ.get('BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
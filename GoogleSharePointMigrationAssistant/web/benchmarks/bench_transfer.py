@@ -0,0 +1,158 @@
+""" Transfer benchmarks: scan() and migrate() of generated Drive trees through
+both transfer engines, against the local Drive and Graph stubs.
+
+Each scenario also runs scan_and_migrate(), which transfers files as the scan
+finds them, on a fresh migration.
+
+Not collected by `manage.py test` (the module is not named test*.py); run with
+
+    python manage.py test web.benchmarks.bench_transfer
+
+Environment variables:
+    BENCHMARK_SCENARIOS   comma-separated subset of SCENARIOS (default: all)
+    BENCHMARK_ENGINES     comma-separated subset of 'threads,asyncio'
+    BENCHMARK_SCALE       multiply every scenario's file count (default 1)
+    BENCHMARK_LATENCY_MS  per-request latency of both stubs (default 5)
+    BENCHMARK_OUTPUT      write the results as JSON to this path
+    BENCHMARK_BASELINE    compare against results previously written by BENCHMARK_OUTPUT
+    BENCHMARK_TOLERANCE   allowed relative regression vs. the baseline (default 0.25)
+"""
+import json
+import os
+from django.test import TestCase, override_settings
+from ..models import Migration, User, AdministrationSettings
+from ..tests.conf import TARGET_EXAMPLE, GOOGLE_FOLDER_SOURCE
+from .harness import TransferBenchmark, stub_backends
+from .mockservers import DriveStub, GraphStub
+
+SCENARIOS = {
+    'small-files': {'num_files': 300, 'size_distribution': 'small'},
+    'mixed': {'num_files': 150, 'size_distribution': 'mixed'},
+    'large-files': {'num_files': 6, 'size_distribution': 'large', 'google_docs_fraction': 0},
+    # a third of the blobs repeat another's content; each distinct blob is downloaded once
+    'duplicates': {'num_files': 150, 'size_distribution': 'mixed', 'duplicate_fraction': 0.3},
+    'drive-throttled': {'num_files': 150, 'size_distribution': 'small', 'drive_throttle_rate': 0.02},
+    # the threads engine's graph_* helpers do not retry on 429
+    'graph-throttled': {'num_files': 150, 'size_distribution': 'small', 'graph_throttle_rate': 0.02,
+                        'engines': ['asyncio']},
+}
+ENGINES = ['threads', 'asyncio']
+# scenarios whose results must be complete for the numbers to mean anything
+UNTHROTTLED = ['small-files', 'mixed', 'large-files', 'duplicates']
+# throttled scenarios that both engines retry through: no file may be lost
+RETRIED = ['drive-throttled']
+# metric: True if higher is better
+COMPARED_METRICS = {'files_per_sec': True, 'api_calls_per_file': False}
+
+
+def _env_list(name: str = '', default: list = []):
+    value = os.environ.get(name)
+    return [v.strip() for v in value.split(',') if v.strip()] if value else list(default)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class TransferBenchmarkTestCase(TestCase):
+    results = []
+
+    @classmethod
+    def setUpTestData(cls):
+        AdministrationSettings(require_idp_login=False).save()
+        cls.user = User.objects.create_user(
+            username='benchmark', email='benchmark@go365migrator.com', password='fakepass')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        output = os.environ.get('BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as f:
+                json.dump(cls.results, f, indent=2)
+
+    def _run(self, scenario: str = '', engine: str = 'threads', scan_and_migrate: bool = False):
+        config = dict(SCENARIOS[scenario])
+        latency = float(os.environ.get('BENCHMARK_LATENCY_MS', 5)) / 1000
+        migration = Migration.objects.create(
+            user=self.user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        drive = DriveStub(
+            root_id=migration.source_id,
+            num_files=int(config['num_files'] * float(os.environ.get('BENCHMARK_SCALE', 1))),
+            size_distribution=config['size_distribution'],
+            google_docs_fraction=config.get('google_docs_fraction', 0.1),
+            duplicate_fraction=config.get('duplicate_fraction', 0),
+            latency=latency,
+            throttle_rate=config.get('drive_throttle_rate', 0))
+        graph = GraphStub(
+            existing_folders={migration.target_folder_id: migration.target_folder_name},
+            latency=latency,
+            throttle_rate=config.get('graph_throttle_rate', 0))
+        with stub_backends(drive, graph):
+            benchmark = TransferBenchmark(
+                migration=migration, drive=drive, graph=graph, engine=engine,
+                local_temp_dir=f'benchmark-{scenario}-{engine}')
+            try:
+                if scan_and_migrate:
+                    scan = migrate = benchmark.scan_and_migrate()
+                    rescan = benchmark.rescan()
+                    phases = [scan, rescan]
+                else:
+                    scan = benchmark.scan()
+                    migrate = benchmark.migrate()
+                    rescan = benchmark.rescan()
+                    phases = [scan, migrate, rescan]
+            finally:
+                benchmark.cleanup()
+        expected_files = sum(1 for f in drive.files.values() if f['mimeType'] != 'application/vnd.google-apps.folder')
+        for metrics in phases:
+            metrics['scenario'] = scenario
+            self.results.append(metrics)
+            print(
+                f"\n{scenario:>16} {engine:>8} {metrics['phase']:>12}: "
+                f"{metrics['files']} files in {metrics['seconds']}s, "
+                f"{metrics['files_per_sec']} files/s, {metrics.get('mb_per_sec', '-')} MB/s, "
+                f"{metrics['api_calls_per_file']} calls/file, peak RSS {metrics['peak_rss_mb']}MB")
+        if scenario in UNTHROTTLED:
+            self.assertEqual(expected_files, scan['files'])
+            self.assertEqual(expected_files, migrate['files_uploaded'])
+            self.assertEqual(drive.total_bytes, migrate['bytes_uploaded'])
+            self.assertEqual(0, rescan['files'])
+            self.assertEqual(expected_files, rescan['transfer_plan']['unchanged'])
+        if scenario in UNTHROTTLED + RETRIED:
+            self.assertEqual(0, migrate['files_failed'])
+            self.assertEqual(0, rescan['transfer_plan']['new'])
+        for metrics in phases:
+            self._compare_to_baseline(metrics)
+
+    def _compare_to_baseline(self, metrics: dict = {}):
+        path = os.environ.get('BENCHMARK_BASELINE')
+        if not path:
+            return
+        with open(path) as f:
+            baseline = next((
+                b for b in json.load(f) if all(
+                    b.get(k) == metrics[k] for k in ['scenario', 'engine', 'phase', 'files'])), None)
+        if baseline is None:
+            return
+        tolerance = float(os.environ.get('BENCHMARK_TOLERANCE', 0.25))
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if baseline.get(metric) is None or metrics.get(metric) is None:
+                continue
+            if higher_is_better:
+                self.assertGreaterEqual(
+                    metrics[metric], baseline[metric] * (1 - tolerance),
+                    f'{metric} regressed for {metrics["scenario"]}/{metrics["engine"]}/{metrics["phase"]}')
+            else:
+                self.assertLessEqual(
+                    metrics[metric], baseline[metric] * (1 + tolerance),
+                    f'{metric} regressed for {metrics["scenario"]}/{metrics["engine"]}/{metrics["phase"]}')
+
+    def test_transfer_scenarios(self):
+        for scenario in _env_list('BENCHMARK_SCENARIOS', SCENARIOS):
+            for engine in _env_list('BENCHMARK_ENGINES', ENGINES):
+                if engine not in SCENARIOS[scenario].get('engines', ENGINES):
+                    continue
+                with self.subTest(scenario=scenario, engine=engine):
+                    self._run(scenario=scenario, engine=engine)
+                with self.subTest(scenario=scenario, engine=engine, scan_and_migrate=True):
+                    self._run(scenario=scenario, engine=engine, scan_and_migrate=True)
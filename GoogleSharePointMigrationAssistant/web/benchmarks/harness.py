@@ -0,0 +1,211 @@
+""" Run GoogleToSharePoint.scan() / migrate() against the local Drive and Graph
+stubs and measure files/sec, MB/sec, API calls per file and peak RSS. """
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+from django.test import override_settings
+from ratelimit.decorators import RateLimitDecorator
+from ..models import Migration
+from ..plumbing.constants import EXPORT_CACHE_MAX_BYTES
+from ..plumbing.exportcache import ExportCache
+from ..plumbing.googletosharepoint import GoogleToSharePoint
+from ..plumbing.graphutil import GraphUtil
+from ..plumbing.sharepoint import SharePointUploader
+from .mockservers import MB, DriveStub, GraphStub
+
+# seconds slept by the plumbing before retrying a throttled request
+BENCHMARK_RETRY_SLEEP_SECONDS = 0.1
+
+
+def rss_bytes():
+    """ Current resident set size of this process """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # not Linux; fall back to the lifetime peak
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSSSampler:
+    """ Sample RSS on a background thread while the with-block runs """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_bytes = self.peak_bytes = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+
+def reset_rate_limits(*functions):
+    """ Clear the call counts of @limits-decorated functions so one benchmark
+    run does not inherit the rate limit window consumed by the previous one """
+    for function in functions:
+        while function is not None:
+            for cell in function.__closure__ or ():
+                if isinstance(cell.cell_contents, RateLimitDecorator):
+                    limiter = cell.cell_contents
+                    with limiter.lock:
+                        limiter.num_calls = 0
+                        limiter.last_reset = limiter.clock()
+            function = getattr(function, '__wrapped__', None)
+
+
+@contextmanager
+def stub_backends(drive: DriveStub = None, graph: GraphStub = None):
+    """ Start the stubs and point the plumbing at them: API base URLs,
+    Microsoft token lookups and retry sleeps """
+    with ExitStack() as stack:
+        stack.enter_context(drive)
+        stack.enter_context(graph)
+        stack.enter_context(override_settings(
+            GOOGLE_DRIVE_API_URL=f'{drive.url}/drive/v3', GRAPH_API_URL=graph.base_url))
+        # per-request client logging would dominate the measurements
+        logging.disable(logging.WARNING)
+        stack.callback(logging.disable, logging.NOTSET)
+        token = {'access_token': 'benchmark-graph-token', 'expires_in': 3600}
+        for module in ['graphutil', 'sharepoint', 'onedrive', 'asynctransfer']:
+            stack.enter_context(mock.patch(
+                f'web.plumbing.{module}.get_token_from_cache', return_value=token))
+        for module, constant in [
+            ('googletosharepoint', 'GOOGLE_DRIVE_SLEEP_RETRY_SECONDS'),
+            ('graphutil', 'GRAPH_SLEEP_RETRY_SECONDS'),
+            ('asynctransfer', 'GOOGLE_DRIVE_SLEEP_RETRY_SECONDS'),
+            ('asynctransfer', 'GRAPH_SLEEP_RETRY_SECONDS'),
+        ]:
+            stack.enter_context(mock.patch(
+                f'web.plumbing.{module}.{constant}', BENCHMARK_RETRY_SLEEP_SECONDS))
+        yield drive, graph
+
+
+class TransferBenchmark:
+    """ One scan + migrate of a migration against running stubs with one engine """
+
+    def __init__(self, migration: Migration = None, drive: DriveStub = None, graph: GraphStub = None,
+                 engine: str = 'threads', local_temp_dir: str = 'benchmark'):
+        self.migration = migration
+        self.drive = drive
+        self.graph = graph
+        self.engine = engine
+        self.uploader = SharePointUploader(migration=migration, use_multithreading=True)
+        self.downloader = GoogleToSharePoint(
+            uploader=self.uploader,
+            local_temp_dir=local_temp_dir,
+            migration=migration,
+            auth_method='oauth',
+            google_credentials={'token': 'benchmark-google-token'},
+            engine=engine
+        )
+        # exports are cached per benchmark, not in the shared cache folder
+        self.downloader.export_cache = ExportCache(
+            path=tempfile.mkdtemp(prefix='benchmark-export-cache-'), max_bytes=EXPORT_CACHE_MAX_BYTES)
+        # logging to the console would dominate the measurements
+        self.uploader.disable_logging()
+        self.downloader.disable_logging()
+
+    def cleanup(self):
+        shutil.rmtree(self.downloader.local_temp_dir, ignore_errors=True)
+        shutil.rmtree(self.downloader.log_folder_path, ignore_errors=True)
+        shutil.rmtree(self.downloader.export_cache.path, ignore_errors=True)
+
+    def _measure(self, phase: str = '', run=None, num_files: int = 0):
+        self.drive.reset_counters()
+        self.graph.reset_counters()
+        reset_rate_limits(
+            GoogleToSharePoint.getlist, GoogleToSharePoint.download_file,
+            GoogleToSharePoint.handle_google_suite_filetypes,
+            GoogleToSharePoint.count_migratable_files_in_folder,
+            GraphUtil.graph_get, GraphUtil.graph_put, GraphUtil.graph_post)
+        with PeakRSSSampler() as rss:
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+        num_files = num_files if num_files else len(result or [])
+        api_calls = self.drive.total_calls + self.graph.total_calls
+        return result, {
+            'phase': phase,
+            'engine': self.engine,
+            'files': num_files,
+            'seconds': round(elapsed, 3),
+            'files_per_sec': round(num_files / elapsed, 2) if elapsed else None,
+            'api_calls': api_calls,
+            'api_calls_per_file': round(api_calls / num_files, 2) if num_files else None,
+            'peak_rss_mb': round(rss.peak_bytes / MB, 1),
+            'rss_growth_mb': round((rss.peak_bytes - rss.start_bytes) / MB, 1),
+            'drive': self.drive.stats(),
+            'graph': self.graph.stats(),
+            'latency_breakdown': self.downloader.tracer.breakdown(),
+        }
+
+    def scan(self):
+        """ Time scan(); returns metrics where files are the migratable files found """
+        def run():
+            self.downloader.scan()
+            return self.downloader._get_scanned_files_list()
+        self.files_list, metrics = self._measure(phase='scan', run=run)
+        return metrics
+
+    def rescan(self):
+        """ Time a second scan() after migrate(); with nothing changed at the
+        source the transfer plan has nothing to transfer """
+        metrics = self.scan()
+        metrics['phase'] = 'rescan'
+        metrics['transfer_plan'] = self.downloader.transfer_plan.summary()
+        return metrics
+
+    def migrate(self):
+        """ Time migrate() of the scanned files; bytes are those received by Graph """
+        num_files = len(self.files_list)
+        _, metrics = self._measure(
+            phase='migrate', run=self.downloader.migrate, num_files=num_files)
+        return self._add_transfer_metrics(metrics)
+
+    def scan_and_migrate(self):
+        """ Time scan_and_migrate(), which transfers the files as the scan
+        finds them; files are the migratable files found """
+        def run():
+            self.downloader.scan_and_migrate()
+            return self.downloader._get_scanned_files_list()
+        self.files_list, metrics = self._measure(phase='scan+migrate', run=run)
+        return self._add_transfer_metrics(metrics)
+
+    def _add_transfer_metrics(self, metrics: dict = {}):
+        uploaded = self.graph.bytes_received
+        metrics['mb_per_sec'] = round(uploaded / MB / metrics['seconds'], 2) if metrics['seconds'] else None
+        metrics['bytes_uploaded'] = uploaded
+        metrics['bytes_downloaded'] = self.drive.bytes_sent
+        metrics['files_uploaded'] = sum(1 for item in self.graph.items.values() if 'file' in item)
+        metrics['files_failed'] = self.downloader.num_files_failed_to_download + self.uploader._num_failed
+        metrics['folder_create_calls'] = self.graph.calls['create_folder']
+        return metrics
+
+    def download(self):
+        """ Time downloading the scanned files from Drive only (no upload) """
+        _, metrics = self._measure(
+            phase='download', run=lambda: self.downloader._download_file_batch(self.files_list),
+            num_files=len(self.files_list))
+        downloaded = self.drive.bytes_sent
+        metrics['mb_per_sec'] = round(downloaded / MB / metrics['seconds'], 2) if metrics['seconds'] else None
+        metrics['bytes_downloaded'] = downloaded
+        metrics['files_failed'] = self.downloader.num_files_failed_to_download
+        return metrics
@@ -0,0 +1,611 @@
+""" Local stand-ins for the Google Drive v3 and Microsoft Graph endpoints used
+by the migration plumbing. Each stub is a real HTTP server on 127.0.0.1 so
+that the whole client stack (googleapiclient/httplib2, requests, httpx) is
+exercised, with configurable latency, throttling and file size distribution.
+Every request is counted by operation so benchmarks can report API calls per file. """
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+from ..plumbing.contenthash import QuickXorHash
+
+KB = 1024
+MB = 1024 * 1024
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+GOOGLE_DOC_MIMETYPES = {
+    'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+# deterministic file content; byte i of every file is PATTERN[i % len(PATTERN)]
+PATTERN = bytes(range(256)) * 256
+# modifiedTime of every source file, before any upload to the Graph stub
+SOURCE_MODIFIED_TIME = '2023-01-01T00:00:00.000Z'
+
+
+def _small(rng):
+    return rng.randint(1 * KB, 64 * KB)
+
+
+def _mixed(rng):
+    """ Roughly the shape of a departmental share: mostly office documents,
+    some media and a few large archives """
+    roll = rng.random()
+    if roll < 0.80:
+        return rng.randint(1 * KB, 256 * KB)
+    if roll < 0.97:
+        return rng.randint(256 * KB, 4 * MB)
+    return rng.randint(4 * MB, 16 * MB)
+
+
+def _large(rng):
+    return rng.randint(8 * MB, 32 * MB)
+
+
+SIZE_DISTRIBUTIONS = {
+    'small': _small,
+    'mixed': _mixed,
+    'large': _large,
+}
+
+
+def get_size_distribution(name: str = 'small'):
+    """ Return a function rng -> size in bytes. name is a key of
+    SIZE_DISTRIBUTIONS or a fixed size in bytes, e.g. '1048576' """
+    if name in SIZE_DISTRIBUTIONS:
+        return SIZE_DISTRIBUTIONS[name]
+    size = int(name)
+    return lambda rng: size
+
+
+class StubServer:
+    """ Base class: a threaded HTTP server with per-operation request counters,
+    injected latency and probabilistic throttling. Subclasses implement route(). """
+    name = 'stub'
+
+    def __init__(self, latency: float = 0, latency_jitter: float = 0,
+                 throttle_rate: float = 0, retry_after: int = 1, seed: int = 0,
+                 connect_latency: float = 0):
+        self.latency = latency
+        # added once per new connection, standing in for the TCP + TLS handshake
+        self.connect_latency = connect_latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._server = None
+        self.reset_counters()
+
+    ### LIFECYCLE ###
+
+    def start(self):
+        stub = self
+
+        class Handler(_StubRequestHandler):
+            pass
+        Handler.stub = stub
+
+        class Server(ThreadingHTTPServer):
+            # the listen() backlog, set before the constructor binds: the
+            # asyncio engine opens up to ASYNC_MAX_IN_FLIGHT_REQUESTS connections
+            request_queue_size = 1024
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    ### COUNTERS ###
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = Counter()
+            self.connections = 0
+            self.throttled = 0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def count(self, operation: str = '', bytes_sent: int = 0, bytes_received: int = 0):
+        with self._lock:
+            self.calls[operation] += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def stats(self):
+        return {
+            'calls': self.total_calls,
+            'calls_by_operation': dict(sorted(self.calls.items())),
+            'connections': self.connections,
+            'throttled': self.throttled,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+
+    ### REQUEST HANDLING ###
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+
+    def delay(self):
+        if self.latency or self.latency_jitter:
+            with self._lock:
+                jitter = self._rng.uniform(0, self.latency_jitter)
+            time.sleep(self.latency + jitter)
+
+    def should_throttle(self):
+        if not self.throttle_rate:
+            return False
+        with self._lock:
+            throttle = self._rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        return throttle
+
+    def route(self, method: str = 'GET', path: str = '', query: dict = {}, headers=None, body: bytes = b''):
+        """ Return (status, headers dict, payload) where payload is a dict
+        (sent as JSON), bytes, or a (start, end) range of pattern bytes """
+        raise NotImplementedError
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.stub.connected()
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        self.stub.delay()
+        try:
+            status, headers, payload = self.stub.route(
+                method=self.command, path=unquote(url.path), query=query,
+                headers=self.headers, body=body)
+        except Exception as e:
+            status, headers, payload = 500, {}, {'error': {'code': 'stubError', 'message': repr(e)}}
+        if isinstance(payload, dict):
+            payload = json.dumps(payload).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, str(v))
+        if isinstance(payload, tuple):
+            start, end = payload
+            self.send_header('Content-Length', str(end - start))
+            self.end_headers()
+            while start < end:
+                offset = start % len(PATTERN)
+                piece = PATTERN[offset:offset + min(end - start, len(PATTERN) - offset)]
+                self.wfile.write(piece)
+                start += len(piece)
+        else:
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+class DriveStub(StubServer):
+    """ Google Drive v3: files.list (paginated, with fields projection),
+    files.get alt=media (with Range support), files.export, and the
+    exportLinks download URLs of Google-native files """
+    name = 'drive'
+
+    def __init__(self, root_id: str = '', num_files: int = 100, files_per_folder: int = 50,
+                 folders_per_folder: int = 4, size_distribution: str = 'small',
+                 google_docs_fraction: float = 0.1, duplicate_fraction: float = 0, seed: int = 0, **kwargs):
+        super().__init__(seed=seed, **kwargs)
+        self.root_id = root_id
+        self.num_files = num_files
+        self.files_per_folder = files_per_folder
+        self.folders_per_folder = folders_per_folder
+        self.size_distribution = get_size_distribution(size_distribution)
+        self.google_docs_fraction = google_docs_fraction
+        # blobs whose content repeats an earlier blob's; content is a pattern by
+        # offset, so the same size is the same content and md5Checksum
+        self.duplicate_fraction = duplicate_fraction
+        self.seed = seed
+
+    def start(self):
+        super().start()
+        # exportLinks point back at this server, so build the tree once the port is known
+        self._build_tree()
+        return self
+
+    def _build_tree(self):
+        """ Lay out num_files files breadth-first, files_per_folder per folder """
+        rng = random.Random(self.seed)
+        self.children = {}
+        self.files = {}
+        self.content_sizes = {}
+        self._md5_checksums = {}
+        pending, remaining, next_id = [self.root_id], self.num_files, 0
+        while pending and remaining > 0:
+            folder_id = pending.pop(0)
+            children = self.children.setdefault(folder_id, [])
+            for _ in range(min(self.files_per_folder, remaining)):
+                next_id += 1
+                children.append(self._make_file(rng, f'file-{next_id}'))
+                remaining -= 1
+            if remaining > 0:
+                for i in range(self.folders_per_folder):
+                    next_id += 1
+                    folder = {'kind': 'drive#file', 'id': f'folder-{next_id}',
+                              'name': f'Folder {next_id}', 'mimeType': FOLDER_MIMETYPE}
+                    children.append(folder)
+                    self.files[folder['id']] = folder
+                    pending.append(folder['id'])
+        self.total_bytes = sum(self.content_sizes.values())
+
+    def _make_file(self, rng, file_id):
+        if rng.random() < self.google_docs_fraction:
+            mime_type = rng.choice(list(GOOGLE_DOC_MIMETYPES))
+            # native files have no size; their export size is what gets transferred
+            file = {'kind': 'drive#file', 'id': file_id, 'name': f'Document {file_id}',
+                    'mimeType': mime_type, 'exportLinks': {
+                        export: f'{self.url}/export/{file_id}?{urlencode({"mimeType": export})}'
+                        for export in GOOGLE_DOC_MIMETYPES.values()}}
+            self.content_sizes[file_id] = rng.randint(8 * KB, 128 * KB)
+        else:
+            blob_sizes = [int(f['size']) for f in self.files.values() if 'size' in f]
+            if blob_sizes and rng.random() < self.duplicate_fraction:
+                size = rng.choice(blob_sizes)
+            else:
+                size = self.size_distribution(rng)
+            file = {'kind': 'drive#file', 'id': file_id, 'name': f'{file_id}.bin',
+                    'mimeType': 'application/octet-stream', 'size': str(size)}
+            self.content_sizes[file_id] = size
+        file['modifiedTime'] = SOURCE_MODIFIED_TIME
+        self.files[file_id] = file
+        return file
+
+    def _throttled(self):
+        message = 'Rate Limit Exceeded'
+        return 403, {}, {'error': {
+            'code': 403, 'message': message,
+            'errors': [{'domain': 'usageLimits', 'reason': 'rateLimitExceeded', 'message': message}]}}
+
+    def _project(self, file: dict = {}, fields: str = None):
+        """ Apply the files(...) part of a fields parameter """
+        if fields is None:
+            wanted = ['kind', 'id', 'name', 'mimeType']
+        else:
+            match = re.search(r'files\(([^)]*)\)', fields)
+            if not match:
+                return dict(file)
+            wanted = [f.strip() for f in match.group(1).split(',')]
+        projected = {k: v for k, v in file.items() if k in wanted}
+        if 'md5Checksum' in wanted and 'size' in file:
+            projected['md5Checksum'] = self.content_md5(file['id'])
+        return projected
+
+    def content_md5(self, file_id: str = ''):
+        """ md5Checksum of a blob's pattern content, computed on first request """
+        with self._lock:
+            checksum = self._md5_checksums.get(file_id)
+        if checksum is None:
+            md5, start, end = hashlib.md5(), 0, self.content_sizes[file_id]
+            while start < end:
+                piece = PATTERN[:min(end - start, len(PATTERN))]
+                md5.update(piece)
+                start += len(piece)
+            checksum = md5.hexdigest()
+            with self._lock:
+                self._md5_checksums[file_id] = checksum
+        return checksum
+
+    def _list(self, query: dict = {}):
+        q = query.get('q', '')
+        parent = re.search(r"'([^']+)' in parents", q)
+        children = self.children.get(parent.group(1), []) if parent else []
+        mime_filter = re.search(r"mimeType\s*(!?=)\s*'([^']+)'", q)
+        if mime_filter:
+            op, mime_type = mime_filter.groups()
+            children = [c for c in children if (c['mimeType'] == mime_type) == (op == '=')]
+        page_size = min(int(query.get('pageSize') or 100), 1000)
+        start = int(query.get('pageToken') or 0)
+        fields = query.get('fields')
+        response = {'kind': 'drive#fileList', 'files': [
+            self._project(f, fields) for f in children[start:start + page_size]]}
+        # the API only returns nextPageToken when fields asks for it (or is absent)
+        if start + page_size < len(children) and (fields is None or 'nextPageToken' in fields):
+            response['nextPageToken'] = str(start + page_size)
+        return 200, {}, response
+
+    def _content(self, file_id: str = '', headers=None):
+        size = self.content_sizes[file_id]
+        range_header = headers.get('Range') if headers else None
+        if range_header:
+            start, _, end = range_header.replace('bytes=', '').partition('-')
+            start, end = int(start), min(int(end) + 1 if end else size, size)
+            return 206, {'Content-Range': f'bytes {start}-{end - 1}/{size}'}, (start, end)
+        return 200, {}, (0, size)
+
+    def route(self, method='GET', path='', query={}, headers=None, body=b''):
+        if self.should_throttle():
+            self.count('throttled')
+            return self._throttled()
+        if path == '/drive/v3/files':
+            self.count('files.list')
+            return self._list(query)
+        match = re.match(r'^/drive/v3/files/([^/]+)(/export)?$', path)
+        if match and match.group(1) in self.files:
+            file_id, export = match.groups()
+            if export:
+                self.count('export_media', bytes_sent=self.content_sizes[file_id])
+                return self._content(file_id)
+            if query.get('alt') == 'media':
+                status, response_headers, payload = self._content(file_id, headers)
+                self.count('get_media', bytes_sent=payload[1] - payload[0])
+                return status, response_headers, payload
+            self.count('files.get')
+            return 200, {}, self._project(self.files[file_id], query.get('fields'))
+        match = re.match(r'^/export/([^/]+)$', path)
+        if match and match.group(1) in self.files:
+            self.count('export_link', bytes_sent=self.content_sizes[match.group(1)])
+            return self._content(match.group(1))
+        self.count('not_found')
+        return 404, {}, {'error': {'code': 404, 'message': f'File not found: {path}'}}
+
+
+class GraphStub(StubServer):
+    """ Microsoft Graph drive API: children (list with $filter/$top/$select/nextLink,
+    folder create), simple upload, createUploadSession and chunk PUTs, $batch
+    and delta. Serves /sites/{id}/drives/{id}, /drives/{id}, /users/{id}/drive
+    and /me/drive as one in-memory drive. """
+    name = 'graph'
+    DRIVE_PREFIX = re.compile(
+        r'^/v1\.0/(?:sites/[^/]+/drives/[^/]+|drives/[^/]+|users/[^/]+/drive|me/drive)(?=/)')
+    ITEM_PATH = re.compile(r'^/(?:root|items/([^/:]+))(.*)$')
+    MAX_BATCH_REQUESTS = 20
+    DEFAULT_PAGE_SIZE = 200
+
+    def __init__(self, existing_folders: dict = {}, **kwargs):
+        """ existing_folders: {item id: name} of folders already in the drive root,
+        e.g. the migration's target folder """
+        super().__init__(**kwargs)
+        self.items = {'root': {'id': 'root', 'name': 'root', 'folder': {}}}
+        self.children = {'root': {}}
+        self.upload_sessions = {}
+        self._next_id = 0
+        for item_id, name in existing_folders.items():
+            self._add_item('root', name, {'folder': {}}, item_id=item_id)
+
+    @property
+    def base_url(self):
+        """ Value for settings.GRAPH_API_URL """
+        return f'{self.url}/v1.0'
+
+    ### DRIVE ITEMS ###
+
+    def _add_item(self, parent_id: str = '', name: str = '', facet: dict = {}, size: int = 0, item_id: str = ''):
+        with self._lock:
+            if not item_id:
+                self._next_id += 1
+                item_id = f'item-{self._next_id}'
+            item = {'id': item_id, 'name': name, 'size': size,
+                    'lastModifiedDateTime': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+                    'parentReference': {'id': parent_id}, **facet}
+            if 'folder' in item:
+                item['folder'] = {'childCount': 0}
+                self.children.setdefault(item_id, {})
+            old_id = self.children[parent_id].get(name.lower())
+            if old_id:
+                self.items.pop(old_id, None)
+            self.children[parent_id][name.lower()] = item_id
+            self.items[item_id] = item
+            return item
+
+    def _resolve_name(self, parent_id: str = '', name: str = '', conflict_behavior: str = 'fail'):
+        """ Return the name to create, or None if conflict_behavior is 'fail' and name exists """
+        existing = self.children[parent_id]
+        if name.lower() not in existing or conflict_behavior == 'replace':
+            return name
+        if conflict_behavior == 'fail':
+            return None
+        stem, dot, ext = name.rpartition('.') if '.' in name else (name, '', '')
+        i = 1
+        while f'{stem} {i}{dot}{ext}'.lower() in existing:
+            i += 1
+        return f'{stem} {i}{dot}{ext}'
+
+    def _list_children(self, item_id: str = '', path: str = '', query: dict = {}):
+        children = [self.items[i] for i in list(self.children.get(item_id, {}).values()) if i in self.items]
+        name_filter = re.match(r"^name eq '(.*)'$", query.get('$filter', ''))
+        if name_filter:
+            name = name_filter.group(1).replace("''", "'").lower()
+            children = [c for c in children if c['name'].lower() == name]
+        if query.get('$select'):
+            fields = query['$select'].split(',')
+            children = [{k: v for k, v in c.items() if k in fields} for c in children]
+        return self._page(children, path, query)
+
+    def _page(self, values: list = [], path: str = '', query: dict = {}, delta: bool = False):
+        top = int(query.get('$top') or self.DEFAULT_PAGE_SIZE)
+        start = int(query.get('$skiptoken') or 0)
+        response = {'value': values[start:start + top]}
+        if start + top < len(values):
+            next_query = {k: v for k, v in query.items() if k != '$skiptoken'}
+            next_query['$skiptoken'] = start + top
+            response['@odata.nextLink'] = f'{self.url}{path}?{urlencode(next_query)}'
+        elif delta:
+            response['@odata.deltaLink'] = f'{self.url}{path}?token=latest'
+        return 200, {}, response
+
+    def _descendants(self, item_id: str = ''):
+        values, pending = [], [item_id]
+        while pending:
+            for child_id in self.children.get(pending.pop(0), {}).values():
+                child = self.items.get(child_id)
+                if child:
+                    values.append(child)
+                    if 'folder' in child:
+                        pending.append(child_id)
+        return values
+
+    def _conflict(self, name: str = ''):
+        return 409, {}, {'error': {'code': 'nameAlreadyExists', 'message': f'Name already exists: {name}'}}
+
+    ### ROUTING ###
+
+    def route(self, method='GET', path='', query={}, headers=None, body=b''):
+        match = re.match(r'^/upload/([^/]+)$', path)
+        if match:
+            # pre-authenticated upload URLs are not throttled
+            return self._upload_chunk(match.group(1), headers, body)
+        if self.should_throttle():
+            self.count('throttled')
+            return 429, {'Retry-After': self.retry_after}, {'error': {
+                'code': 'activityLimitReached', 'message': 'The request has been throttled'}}
+        if path == '/v1.0/$batch' and method == 'POST':
+            return self._batch(body)
+        return self._route_drive(method, path, query, headers, body)
+
+    def _route_drive(self, method='GET', path='', query={}, headers=None, body=b''):
+        prefix = self.DRIVE_PREFIX.match(path)
+        match = self.ITEM_PATH.match(path[prefix.end():]) if prefix else None
+        item_id = (match.group(1) or 'root') if match else None
+        if item_id not in self.items:
+            self.count('not_found')
+            return 404, {}, {'error': {'code': 'itemNotFound', 'message': path}}
+        tail = match.group(2)
+        if tail == '/children' and method == 'GET':
+            self.count('list_children')
+            return self._list_children(item_id, path, query)
+        if tail == '/children' and method == 'POST':
+            self.count('create_folder')
+            data = json.loads(body or b'{}')
+            with self._lock:
+                name = self._resolve_name(
+                    item_id, data['name'], data.get('@microsoft.graph.conflictBehavior', 'fail'))
+                if name is None:
+                    return self._conflict(data['name'])
+                return 201, {}, self._add_item(item_id, name, {'folder': {}})
+        if tail in ['/delta', '/delta()'] and method == 'GET':
+            self.count('delta')
+            if query.get('token') == 'latest':
+                return 200, {}, {'value': [], '@odata.deltaLink': f'{self.url}{path}?token=latest'}
+            return self._page(self._descendants(item_id), path, query, delta=True)
+        if tail == '' and method == 'DELETE':
+            self.count('delete_item')
+            with self._lock:
+                item = self.items.pop(item_id, None)
+                if item is None:
+                    return 404, {}, {'error': {'code': 'itemNotFound', 'message': item_id}}
+                self.children[item['parentReference']['id']].pop(item['name'].lower(), None)
+            return 204, {}, b''
+        if tail == '' and method == 'GET':
+            self.count('get_item')
+            return 200, {}, self.items[item_id]
+        upload = re.match(r'^:/([^/:]+):/(content|createUploadSession)$', tail)
+        if upload and upload.group(2) == 'content' and method == 'PUT':
+            self.count('put_content', bytes_received=len(body))
+            with self._lock:
+                name = self._resolve_name(
+                    item_id, upload.group(1), query.get('@microsoft.graph.conflictBehavior', 'replace'))
+                if name is None:
+                    return self._conflict(upload.group(1))
+                return 201, {}, self._add_item(
+                    item_id, name, {'file': {'hashes': {'quickXorHash': QuickXorHash(body).b64digest()}}},
+                    size=len(body))
+        if upload and upload.group(2) == 'createUploadSession' and method == 'POST':
+            self.count('create_upload_session')
+            data = json.loads(body or b'{}').get('item', {})
+            conflict_behavior = data.get('@microsoft.graph.conflictBehavior', 'replace')
+            with self._lock:
+                name = self._resolve_name(item_id, upload.group(1), conflict_behavior)
+                if name is None:
+                    return self._conflict(upload.group(1))
+                self._next_id += 1
+                session_id = f'session-{self._next_id}'
+                self.upload_sessions[session_id] = {
+                    'parent_id': item_id, 'name': name, 'received': 0, 'hash': QuickXorHash()}
+            return 200, {}, {'uploadUrl': f'{self.url}/upload/{session_id}',
+                             'expirationDateTime': '2099-01-01T00:00:00Z'}
+        self.count('not_found')
+        return 404, {}, {'error': {'code': 'invalidRequest', 'message': f'{method} {path}'}}
+
+    def _upload_chunk(self, session_id: str = '', headers=None, body: bytes = b''):
+        self.count('upload_chunk', bytes_received=len(body))
+        session = self.upload_sessions.get(session_id)
+        content_range = re.match(r'^bytes (\d+)-(\d+)/(\d+)$', headers.get('Content-Range', '')) if headers else None
+        if session is None or content_range is None:
+            return 404, {}, {'error': {'code': 'itemNotFound', 'message': 'Upload session not found'}}
+        start, end, total = map(int, content_range.groups())
+        if start != session['received'] or end - start + 1 != len(body):
+            return 416, {}, {'error': {'code': 'invalidRange', 'message': 'Unexpected range'},
+                             'nextExpectedRanges': [f'{session["received"]}-']}
+        session['received'] += len(body)
+        session['hash'].update(body)
+        if session['received'] < total:
+            return 202, {}, {'nextExpectedRanges': [f'{session["received"]}-'],
+                             'expirationDateTime': '2099-01-01T00:00:00Z'}
+        del self.upload_sessions[session_id]
+        return 201, {}, self._add_item(
+            session['parent_id'], session['name'],
+            {'file': {'hashes': {'quickXorHash': session['hash'].b64digest()}}}, size=total)
+
+    def _batch(self, body: bytes = b''):
+        self.count('batch')
+        requests = json.loads(body or b'{}').get('requests', [])
+        if len(requests) > self.MAX_BATCH_REQUESTS:
+            return 400, {}, {'error': {'code': 'invalidRequest', 'message': 'Too many requests in batch'}}
+        responses = []
+        for request in requests:
+            url = urlsplit(request['url'])
+            query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+            sub_body = request.get('body')
+            if isinstance(sub_body, (dict, list)):
+                sub_body = json.dumps(sub_body).encode()
+            elif isinstance(sub_body, str):
+                sub_body = sub_body.encode()
+            if self.should_throttle():
+                self.count('throttled')
+                status, sub_headers, payload = 429, {'Retry-After': self.retry_after}, {'error': {
+                    'code': 'activityLimitReached', 'message': 'The request has been throttled'}}
+            else:
+                status, sub_headers, payload = self._route_drive(
+                    request.get('method', 'GET'), f'/v1.0/{unquote(url.path).lstrip("/")}',
+                    query, request.get('headers', {}), sub_body or b'')
+            responses.append({'id': request.get('id'), 'status': status,
+                              'headers': sub_headers, 'body': payload})
+        return 200, {}, {'responses': responses}
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0010_alter_administrationsettings_google_oauth_json_credentials_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('google_id', models.CharField(max_length=128)),
+                ('name', models.TextField()),
+                ('mime_type', models.CharField(max_length=128)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('parent_folder_local_path', models.TextField(blank=True, default='')),
+                ('export_links', models.JSONField(blank=True, default=dict, null=True)),
+                ('migratable', models.BooleanField(db_index=True, default=True)),
+                ('migration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='web.migration')),
+            ],
+            options={
+                'verbose_name': 'Migration File',
+                'verbose_name_plural': 'Migration Files',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0011_migrationfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationfile',
+            name='md5_checksum',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.3 on 2026-10-19 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0012_migrationfile_md5_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationfile',
+            name='destination_item_id',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='migrationfile',
+            name='modified_time',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='migrationfile',
+            name='quick_xor_hash',
+            field=models.CharField(blank=True, default='', max_length=28),
+        ),
+        migrations.AddField(
+            model_name='migrationfile',
+            name='transfer_status',
+            field=models.CharField(choices=[('new', 'New'), ('changed', 'Changed'), ('unchanged', 'Unchanged')], db_index=True, default='new', max_length=16),
+        ),
+    ]
@@ -166,10 +166,104 @@ class Migration(models.Model):
     def target_site_id(self):
         return self.target["details"]["site"]["id"]
 
-    @property 
+    @property
     def job_status(self):
         return self.state.capitalize()
 
+    @property
+    def migratable_files(self):
+        return self.files.filter(migratable=True)
+
+    @property
+    def unmigratable_files(self):
+        return self.files.filter(migratable=False)
+
+    @property
+    def files_to_transfer(self):
+        """ Migratable files that the last scan found new or changed """
+        return self.migratable_files.exclude(transfer_status=MigrationFile.TRANSFER_STATUS.UNCHANGED)
+
+    def set_state(self, state):
+        """ Update only the state column so that frequent state changes
+        do not rewrite the (potentially large) JSON columns of the row """
+        self.state = state
+        self.save(update_fields=['state', 'lastmod'])
+
+
+class MigrationFile(models.Model):
+    """ One Google Drive file found by a scan of a migration's source. Stored
+    in its own table (rather than in Migration.source_data_scan_result) so that
+    scan results are written with bulk inserts and state updates on the
+    migration row stay cheap """
+    class Meta:
+        verbose_name = 'Migration File'
+        verbose_name_plural = 'Migration Files'
+
+    class TRANSFER_STATUS(models.TextChoices):
+        NEW = 'new'
+        CHANGED = 'changed'
+        UNCHANGED = 'unchanged'
+
+    migration = models.ForeignKey(
+        Migration, on_delete=models.CASCADE, related_name='files')
+    google_id = models.CharField(max_length=128)
+    name = models.TextField()
+    mime_type = models.CharField(max_length=128)
+    size = models.BigIntegerField(blank=True, null=True)
+    # Drive's md5Checksum of the content; blank for Google-native files
+    md5_checksum = models.CharField(max_length=32, blank=True, default='')
+    parent_folder_local_path = models.TextField(blank=True, default='')
+    export_links = models.JSONField(default=dict, blank=True, null=True)
+    migratable = models.BooleanField(default=True, db_index=True)
+    # Drive's modifiedTime (RFC 3339)
+    modified_time = models.CharField(max_length=40, blank=True, default='')
+    # compared with the destination by the scan; see plumbing/transferplan.py
+    transfer_status = models.CharField(
+        max_length=16, choices=TRANSFER_STATUS.choices, default=TRANSFER_STATUS.NEW, db_index=True)
+    # the stale destination copy that a changed file replaces
+    destination_item_id = models.CharField(max_length=128, blank=True, default='')
+    # quickXorHash of the content as last transferred
+    quick_xor_hash = models.CharField(max_length=28, blank=True, default='')
+
+    @classmethod
+    def from_drive_file(cls, migration: Migration = None, file: dict = {}, migratable: bool = True):
+        """ Build an (unsaved) instance from a Drive API file resource """
+        return cls(
+            migration=migration,
+            google_id=file['id'],
+            name=file['name'],
+            mime_type=file['mimeType'],
+            size=int(file['size']) if 'size' in file else None,
+            md5_checksum=file.get('md5Checksum', ''),
+            parent_folder_local_path=file.get('parent_folder_local_path', ''),
+            export_links=file.get('exportLinks', {}),
+            migratable=migratable,
+            modified_time=file.get('modifiedTime', ''),
+            transfer_status=file.get('transfer_status', cls.TRANSFER_STATUS.NEW),
+            destination_item_id=file.get('destination_item_id', ''),
+            quick_xor_hash=file.get('quick_xor_hash', '')
+        )
+
+    def to_drive_file(self):
+        """ Inverse of from_drive_file; the dict format used by the plumbing """
+        file = {
+            'id': self.google_id,
+            'name': self.name,
+            'mimeType': self.mime_type,
+            'parent_folder_local_path': self.parent_folder_local_path,
+        }
+        if self.size is not None:
+            file['size'] = str(self.size)
+        if self.md5_checksum:
+            file['md5Checksum'] = self.md5_checksum
+        if self.export_links:
+            file['exportLinks'] = self.export_links
+        if self.modified_time:
+            file['modifiedTime'] = self.modified_time
+        if self.destination_item_id:
+            file['destination_item_id'] = self.destination_item_id
+        return file
+
 
 class AdministrationSettings(models.Model):
     class Meta:
@@ -0,0 +1,642 @@
+""" asyncio transfer engine. Alternative to the ThreadPoolExecutor pipeline in
+GoogleToSharePoint: Drive and Graph requests are coroutines on one event loop
+using httpx, so thousands of requests can be in flight on a few OS threads.
+Selected with GoogleToSharePoint(engine='asyncio') or TRANSFER_ENGINE=asyncio. """
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from urllib.parse import quote
+import httpx
+from django.conf import settings
+from google.auth.transport.requests import Request
+from .constants import (
+    DEFAULT_PAGESIZE, GOOGLE_DRIVE_SLEEP_RETRY_SECONDS, GRAPH_SLEEP_RETRY_SECONDS,
+    MAX_GOOGLE_DRIVE_QUERIES_PER_ONE_HUNDRED_SECONDS, ONE_HUNDRED_SECONDS,
+    MAX_GRAPH_REQUESTS_PER_MINUTE, ONE_MINUTE, ASYNC_MAX_IN_FLIGHT_REQUESTS,
+    ASYNC_MAX_CONCURRENT_TRANSFERS, ASYNC_MAX_CONCURRENT_LARGE_TRANSFERS,
+    ASYNC_MAX_RETRIES, GRAPH_UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE, SMALL_FILE_FAST_PATH,
+    PRECREATE_FOLDERS, VERIFY_UPLOADS, DEDUPLICATE
+)
+from .contenthash import ContentHasher, verify_quick_xor_hash
+from .dedup import group_duplicates
+from .manifest import FileManifest
+from .naming import normalize_name
+from .scanstream import ScanStream
+from .m365_util import get_token_from_cache
+from .tracing import current_span, get_url_attribute, traced
+
+FOUR_MB = 1024 * 1024 * 4
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class AsyncRateLimiter:
+    """ asyncio counterpart of ratelimit's @limits: allow at most `calls`
+    acquisitions in any sliding window of `period` seconds """
+
+    def __init__(self, calls: int = 0, period: int = 0):
+        self.calls = calls
+        self.period = period
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.period:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.calls:
+                    self._timestamps.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._timestamps[0]))
+
+
+class AsyncTransferEngine:
+    """ Runs GoogleToSharePoint.scan() / migrate() work on an event loop. Uses the
+    downloader's credentials, counters and logging, and the uploader's target. """
+
+    def __init__(self, downloader=None, transport: httpx.AsyncBaseTransport = None):
+        self.downloader = downloader
+        self.uploader = downloader.uploader
+        # span names match the threads engine so breakdowns are comparable
+        self.tracer = downloader.tracer
+        # allow tests and benchmarks to swap in a mock transport
+        self.transport = transport
+        self._graph_token = None
+        self._graph_token_expires = 0
+        self._remote_folder_ids = {}
+        self._hash_mismatches = []
+        self._duplicates = {}
+        self._transferred_hashes = {}
+
+    def scan(self):
+        """ Return the flattened list of migratable files in the migration source
+        that the transfer plan finds new or changed """
+        # the database is used from this thread only, outside the loop
+        transferred = self.downloader._get_transferred_hashes()
+        return asyncio.run(self._run(self._scan(transferred)))
+
+    def migrate(self, files_list: list = []):
+        """ Download each file and upload it to the destination """
+        response = asyncio.run(self._run(self._migrate(files_list)))
+        self.downloader._record_transferred_hashes(self._transferred_hashes)
+        return response
+
+    def scan_and_migrate(self, transferred: dict = {}):
+        """ Transfer the files to transfer as the scan finds them (see
+        scanstream.py). Return the ScanStream. """
+        stream = asyncio.run(self._run(self._scan_and_migrate(transferred)))
+        self.downloader._record_transferred_hashes(self._transferred_hashes)
+        return stream
+
+    async def _run(self, coroutine):
+        """ Create the loop-bound client, locks and limiters, then run coroutine """
+        self._in_flight = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT_REQUESTS)
+        self._large_transfers = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_LARGE_TRANSFERS)
+        self._google_limiter = AsyncRateLimiter(
+            calls=MAX_GOOGLE_DRIVE_QUERIES_PER_ONE_HUNDRED_SECONDS, period=ONE_HUNDRED_SECONDS)
+        self._graph_limiter = AsyncRateLimiter(
+            calls=MAX_GRAPH_REQUESTS_PER_MINUTE, period=ONE_MINUTE)
+        self._google_token_lock = asyncio.Lock()
+        self._graph_token_lock = asyncio.Lock()
+        self._remote_folder_locks = {}
+        async with httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_IN_FLIGHT_REQUESTS,
+                max_keepalive_connections=ASYNC_MAX_IN_FLIGHT_REQUESTS)
+        ) as client:
+            self.client = client
+            return await coroutine
+
+    ### AUTH ###
+
+    async def _google_headers(self):
+        creds = self.downloader.creds
+        if not creds.valid:
+            async with self._google_token_lock:
+                if not creds.valid:
+                    await asyncio.to_thread(creds.refresh, Request())
+        return {'Authorization': f'Bearer {creds.token}'}
+
+    async def _graph_headers(self):
+        if self._graph_token is None or time.monotonic() >= self._graph_token_expires:
+            async with self._graph_token_lock:
+                if self._graph_token is None or time.monotonic() >= self._graph_token_expires:
+                    token = await asyncio.to_thread(
+                        get_token_from_cache, m365_token_cache=self.uploader.m365_token_cache)
+                    self._graph_token = token['access_token']
+                    # refresh a minute before MSAL considers the token expired
+                    self._graph_token_expires = time.monotonic() + max(
+                        int(token.get('expires_in', 0)) - 60, 0)
+        return {'Authorization': f'Bearer {self._graph_token}'}
+
+    ### HTTP ###
+
+    def _should_retry(self, response):
+        if response.status_code in RETRY_STATUS_CODES:
+            return True
+        # Drive reports rate limiting as 403 rateLimitExceeded / userRateLimitExceeded
+        return response.status_code == 403 and 'ateLimitExceeded' in response.text
+
+    async def _request(self, api: str = 'graph', method: str = 'GET', url: str = '', headers: dict = {},
+                       authorize: bool = True, **kwargs):
+        """ Send a request to 'google' or 'graph', respecting that API's rate limit
+        and retrying throttled requests and connection errors. Pre-authenticated
+        URLs (upload sessions) are sent with authorize=False: without the auth
+        header, and outside the API's rate limit. """
+        limiter, get_auth_headers, sleep_seconds = (
+            (self._google_limiter, self._google_headers, GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
+            if api == 'google' else
+            (self._graph_limiter, self._graph_headers, GRAPH_SLEEP_RETRY_SECONDS)
+        )
+        response = None
+        with self.tracer.span(f'{api}_{method.lower()}', url=get_url_attribute(url)) as span:
+            for attempt in range(ASYNC_MAX_RETRIES + 1):
+                if attempt:
+                    span.increment('retries')
+                if authorize:
+                    await limiter.acquire()
+                use_headers = {**(await get_auth_headers()), **headers} if authorize else headers
+                try:
+                    async with self._in_flight:
+                        response = await self.client.request(method, url, headers=use_headers, **kwargs)
+                except httpx.TransportError as e:
+                    self.downloader.error({'_request': {
+                        'TransportError': str(e), 'url': get_url_attribute(url), 'attempt': attempt,
+                        'sleeping_for': f'{sleep_seconds}s'}})
+                    await asyncio.sleep(sleep_seconds)
+                    continue
+                span.set_attribute('http.status_code', response.status_code)
+                if not self._should_retry(response):
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after else sleep_seconds
+                self.downloader.error({'_request': {
+                    'status_code': response.status_code, 'url': get_url_attribute(url), 'attempt': attempt,
+                    'sleeping_for': f'{delay}s'}})
+                await asyncio.sleep(delay)
+            return response
+
+    ### SCAN ###
+
+    @traced('getlist', lambda a: {'entity': 'files', 'query': a['query']})
+    async def _list_files(self, query: str = '', drive_id: str = ''):
+        """ All pages of a Drive files.list query """
+        files = []
+        params = {
+            'q': query,
+            'pageSize': DEFAULT_PAGESIZE,
+            'supportsAllDrives': 'true',
+            'includeItemsFromAllDrives': 'true',
+            'fields': 'nextPageToken,files(id,name,size,md5Checksum,modifiedTime,mimeType,exportLinks)'
+        }
+        if drive_id:
+            params.update({'driveId': drive_id, 'corpora': 'drive'})
+        while True:
+            response = await self._request(
+                api='google', url=f'{settings.GOOGLE_DRIVE_API_URL}/files', params=params)
+            if response is None or response.status_code != 200:
+                self.downloader.error({'_list_files': {
+                    'query': query,
+                    'status_code': getattr(response, 'status_code', None)}})
+                return files
+            data = response.json()
+            current_span().increment('pages')
+            files.extend(data.get('files', []))
+            if not data.get('nextPageToken'):
+                return files
+            params['pageToken'] = data['nextPageToken']
+
+    async def _crawl_folder(self, folder_id: str = '', local_path: str = '', files_list: list = [], drive_id: str = ''):
+        folder_type = self.downloader.folder_type
+        children_files, children_folders = await asyncio.gather(
+            self._list_files(
+                query=f"'{folder_id}' in parents and trashed = false and mimeType != '{folder_type}'",
+                drive_id=drive_id),
+            self._list_files(
+                query=f"'{folder_id}' in parents and trashed = false and mimeType = '{folder_type}'",
+                drive_id=drive_id)
+        )
+        self.downloader._add_scanned_files(children_files, local_path, files_list, children_folders)
+        await asyncio.gather(*[
+            self._crawl_folder(
+                folder_id=f['id'],
+                local_path=os.path.join(local_path, normalize_name(f['name'])),
+                files_list=files_list,
+                drive_id=drive_id
+            ) for f in children_folders
+        ])
+
+    async def _crawl_source(self, files_list: list = []):
+        migration = self.downloader.migration
+        if migration.source_type == 'shared_drive':
+            await self._crawl_folder(
+                folder_id=migration.source_id,
+                local_path=self.downloader.local_temp_dir,
+                files_list=files_list,
+                drive_id=migration.source_id)
+        elif migration.source_type == 'folder':
+            await self._crawl_folder(
+                folder_id=migration.source_id,
+                local_path=os.path.join(
+                    self.downloader.local_temp_dir, normalize_name(migration.source_name)),
+                files_list=files_list)
+        return files_list
+
+    async def _scan(self, transferred: dict = {}):
+        # the destination is listed off the loop while the source is crawled
+        destination_files = asyncio.create_task(asyncio.to_thread(self.downloader._get_destination_files))
+        files_list = await self._crawl_source(FileManifest())
+        return await asyncio.to_thread(
+            self.downloader._plan_transfer, files_list, transferred, await destination_files)
+
+    async def _scan_and_migrate(self, transferred: dict = {}):
+        """ Crawl the source into a ScanStream while workers transfer the
+        files it queues """
+        files = asyncio.Queue()
+
+        def put(files_to_transfer):
+            if DEDUPLICATE:
+                files_to_transfer, duplicates = group_duplicates(files_to_transfer)
+                self._duplicates.update(duplicates)
+            for f in files_to_transfer:
+                files.put_nowait(f)
+
+        # stream is only used on the loop
+        stream = ScanStream(downloader=self.downloader, transferred=transferred, put=put)
+        self.downloader.on_folder_scanned = stream.add_folder
+
+        async def plan_against_destination():
+            stream.set_destination_files(await asyncio.to_thread(self.downloader._get_destination_files))
+
+        async def scan():
+            try:
+                # the scanned files are kept by the stream's transfer plan
+                await asyncio.gather(self._crawl_source(files_list=[]), plan_against_destination())
+            finally:
+                for _ in range(ASYNC_MAX_CONCURRENT_TRANSFERS):
+                    files.put_nowait(None)
+
+        self._hash_mismatches = []
+        results = await asyncio.gather(
+            scan(), *[self._transfer_queued_files(files) for _ in range(ASYNC_MAX_CONCURRENT_TRANSFERS)],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if self._hash_mismatches:
+            self.downloader.info({'_scan_and_migrate': {'hash_mismatches_to_retransfer': len(self._hash_mismatches)}})
+            await self._transfer_files(self._hash_mismatches, attempts=1)
+        return stream
+
+    ### MIGRATE ###
+
+    def _get_download_request(self, file: dict = {}):
+        """ Return (url, params) to download a file's content, mirroring
+        GoogleToSharePoint.download_file / handle_google_suite_filetypes """
+        if 'application/vnd.google-apps' not in file['mimeType']:
+            return f'{settings.GOOGLE_DRIVE_API_URL}/files/{file["id"]}', {'alt': 'media', 'supportsAllDrives': 'true'}
+        export_mimetype = self.downloader.get_export_mimetype(file['mimeType'])
+        if export_mimetype != 'application/pdf' and self.downloader.file_too_large_for_export(file):
+            return file['exportLinks'][export_mimetype], {}
+        return f'{settings.GOOGLE_DRIVE_API_URL}/files/{file["id"]}/export', {'mimeType': export_mimetype}
+
+    @traced('_download_worker', lambda a: {'file.id': a['file']['id'], 'file.size': a['file'].get('size')})
+    async def _download(self, file: dict = {}, sink=None, hasher: ContentHasher = None):
+        """ Stream a file's content into sink, and into hasher if given. Return
+        True on success. A download cut off by a transport error resumes from
+        sink's position. """
+        url, params = self._get_download_request(file)
+        sink.seek(0)
+        sink.truncate()
+        if hasher:
+            hasher.reset()
+        for attempt in range(ASYNC_MAX_RETRIES + 1):
+            if attempt:
+                current_span().increment('retries')
+            await self._google_limiter.acquire()
+            # offsets count bytes on the wire, so ask for them uncompressed
+            headers = {**await self._google_headers(), 'Accept-Encoding': 'identity'}
+            if sink.tell():
+                headers['Range'] = f'bytes={sink.tell()}-'
+            try:
+                async with self._in_flight:
+                    async with self.client.stream('GET', url, params=params, headers=headers) as response:
+                        if response.status_code not in (200, 206):
+                            # the error body says whether a 403 is throttling
+                            await response.aread()
+                            if self._should_retry(response):
+                                self.downloader.error({'_download': {
+                                    'status_code': response.status_code, 'file_id': file['id'],
+                                    'attempt': attempt}})
+                                await asyncio.sleep(GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
+                                continue
+                            self.downloader.error({'_download': {
+                                'status_code': response.status_code, 'file_id': file['id'],
+                                'response': response.text}})
+                            return False
+                        if response.status_code == 200:
+                            # a full response: start over (it ignored Range, or nothing was written yet)
+                            sink.seek(0)
+                            sink.truncate()
+                            if hasher:
+                                hasher.reset()
+                        async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            sink.write(chunk)
+                            if hasher:
+                                hasher.update(chunk)
+                        current_span().set_attribute('bytes', sink.tell())
+                        return True
+            except httpx.TransportError as e:
+                self.downloader.error({'_download': {
+                    'TransportError': str(e), 'file_id': file['id'], 'attempt': attempt,
+                    'resume_from': sink.tell()}})
+                await asyncio.sleep(GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
+        return False
+
+    def _read_cached_export(self, export_cache_key: tuple = (), sink=None, hasher: ContentHasher = None):
+        """ Fill sink and hasher from the export cache. Return False if the
+        export is not cached. """
+        cached = self.downloader.export_cache.open(export_cache_key)
+        if cached is None:
+            return False
+        sink.seek(0)
+        sink.truncate()
+        hasher.reset()
+        with cached:
+            for chunk in iter(lambda: cached.read(DOWNLOAD_CHUNK_SIZE), b''):
+                sink.write(chunk)
+                hasher.update(chunk)
+        return True
+
+    @traced('_child_exists', lambda a: {'child.name': a['name']})
+    async def _find_remote_child(self, parent_id: str = '', name: str = ''):
+        """ Return the child drive item of parent_id with the given name, or None """
+        escaped = name.replace("'", "''")
+        response = await self._request(
+            api='graph',
+            url=f'{self._item_url(parent_id)}/children',
+            params={'$filter': f"name eq '{escaped}'"})
+        if response is not None and response.status_code == 200:
+            children = response.json().get('value', [])
+            if children:
+                return children[0]
+        return None
+
+    def _item_url(self, item_id: str = ''):
+        drive_url = self.uploader.get_drive_url()
+        return f'{drive_url}/root' if item_id == 'root' else f'{drive_url}/items/{item_id}'
+
+    async def _get_remote_folder_id(self, local_folder_path: str = ''):
+        """ Return the ID of the destination folder mirroring a local folder
+        path, creating it (and its parents) on first use """
+        if local_folder_path in self._remote_folder_ids:
+            return self._remote_folder_ids[local_folder_path]
+        lock = self._remote_folder_locks.setdefault(local_folder_path, asyncio.Lock())
+        async with lock:
+            if local_folder_path in self._remote_folder_ids:
+                return self._remote_folder_ids[local_folder_path]
+            if local_folder_path == self.downloader.local_temp_dir:
+                parent_id = self.uploader.get_upload_base_folder_id()
+            else:
+                parent_id = await self._get_remote_folder_id(os.path.dirname(local_folder_path))
+            name = os.path.basename(local_folder_path)
+            folder = await self._find_remote_child(parent_id=parent_id, name=name)
+            if folder is None:
+                with self.tracer.span('_create_folder', **{'folder.path': local_folder_path}):
+                    response = await self._request(
+                        api='graph', method='POST',
+                        url=f'{self._item_url(parent_id)}/children',
+                        headers={'Content-Type': 'application/json'},
+                        content=json.dumps({
+                            'name': name,
+                            'folder': {},
+                            '@microsoft.graph.conflictBehavior': 'fail'
+                        }))
+                if response is not None and response.status_code in [200, 201]:
+                    folder = response.json()
+                else:
+                    # 409: created concurrently by another run; look it up again
+                    folder = await self._find_remote_child(parent_id=parent_id, name=name)
+            if folder is None:
+                raise RuntimeError(f'Failed to create destination folder {local_folder_path}')
+            self._remote_folder_ids[local_folder_path] = folder['id']
+            return folder['id']
+
+    @traced('_upload_file', lambda a: {'file.name': a['file_name'], 'bytes': a['size']})
+    async def _upload(self, parent_id: str = '', file_name: str = '', source=None, size: int = 0,
+                      if_absent: bool = False, replace: bool = False):
+        """ Upload source (a file object) as file_name in parent_id. Return the drive item or None.
+        With if_absent, a small file whose name is taken is not uploaded and the
+        409 error response is returned instead; with replace, the file of that
+        name is replaced in place """
+        conflict_behavior = 'fail' if if_absent else 'replace' if replace else None
+        item_path = f'{self._item_url(parent_id)}:/{quote(file_name)}:'
+        if size < FOUR_MB:
+            source.seek(0)
+            response = await self._request(
+                api='graph', method='PUT', url=f'{item_path}/content',
+                headers={'Content-Type': 'application/octet-stream'},
+                params={'@microsoft.graph.conflictBehavior': conflict_behavior} if conflict_behavior else None,
+                content=source.read())
+            if response is not None and response.status_code in [200, 201]:
+                return response.json()
+            if if_absent and response is not None and response.status_code == 409:
+                return response.json()
+            if size == 0:
+                # an upload session has no chunk to send an empty file with
+                self.downloader.error({'_upload': {
+                    'error': 'failed to upload empty file', 'file_name': file_name, 'parent_id': parent_id,
+                    'status_code': response.status_code if response is not None else None}})
+                return None
+        response = await self._request(
+            api='graph', method='POST', url=f'{item_path}/createUploadSession',
+            headers={'Content-Type': 'application/json'},
+            content=json.dumps({'item': {'@microsoft.graph.conflictBehavior': 'replace' if replace else 'rename'}}))
+        if response is None or 'uploadUrl' not in response.json():
+            self.downloader.error({'_upload': {
+                'error': 'failed to obtain upload session', 'file_name': file_name,
+                'parent_id': parent_id}})
+            return None
+        upload_url = response.json()['uploadUrl']
+        start = 0
+        resumes = 0
+        while start < size:
+            source.seek(start)
+            chunk = source.read(GRAPH_UPLOAD_CHUNK_SIZE)
+            end = start + len(chunk)
+            response = await self._request(
+                api='graph', method='PUT', url=upload_url, authorize=False, content=chunk,
+                headers={'Content-Range': f'bytes {start}-{end - 1}/{size}'})
+            if response is not None and response.status_code in [200, 201]:
+                return response.json()
+            if response is not None and response.status_code == 202:
+                start = self._get_next_expected_offset(response.json(), default=end)
+                continue
+            self.downloader.error({'_upload': {
+                'status_code': response.status_code if response is not None else None, 'file_name': file_name,
+                'content_range': f'bytes {start}-{end - 1}/{size}', 'resumes': resumes}})
+            if resumes == ASYNC_MAX_RETRIES:
+                return None
+            # ask the session which bytes it still expects, and go on from there
+            resumes += 1
+            status = await self._request(api='graph', method='GET', url=upload_url, authorize=False)
+            if status is None or status.status_code != 200:
+                return None
+            start = self._get_next_expected_offset(status.json(), default=start)
+        self.downloader.error({'_upload': {'error': 'upload session did not complete', 'file_name': file_name}})
+        return None
+
+    def _get_next_expected_offset(self, upload_session: dict = {}, default: int = 0):
+        """ First byte still expected by an upload session, from its nextExpectedRanges """
+        ranges = upload_session.get('nextExpectedRanges') or []
+        if not ranges:
+            return default
+        return int(ranges[0].split('-')[0])
+
+    @traced('download_file', lambda a: {
+        'file.id': a['file']['id'], 'file.size': a['file'].get('size'), 'file.mime_type': a['file']['mimeType']})
+    async def _transfer_file(self, file: dict = {}):
+        """ Download one file into a spooled temp file (memory until 4MB, then disk)
+        and upload it into the matching destination folder, along with its
+        duplicates (see dedup.group_duplicates) from the same download """
+        file_name = normalize_name(file['name'])
+        is_large = int(file.get('size', 0)) >= FOUR_MB
+        copies, pending = [file], []
+        skipped, uploaded, downloaded = 0, 0, False
+        if is_large:
+            await self._large_transfers.acquire()
+        try:
+            # small blobs skip the name lookup: the upload PUT itself fails with
+            # 409 if the file is already there. Native files have no size until
+            # exported, so they are still looked up first.
+            if_absent = SMALL_FILE_FAST_PATH and 'size' in file and not is_large
+            copies = [file] + self._duplicates.get(file['id'], [])
+            for copy in copies:
+                parent_id = await self._get_remote_folder_id(copy['parent_folder_local_path'])
+                # a file changed at the source replaces its destination copy
+                if not if_absent and not copy.get('destination_item_id') and await self._find_remote_child(parent_id=parent_id, name=normalize_name(copy['name'])):
+                    self.downloader.info({'_transfer_file': {'file_already_exists': normalize_name(copy['name'])}})
+                    self.uploader.num_completed_uploads += 1
+                    skipped += 1
+                    continue
+                pending.append((copy, parent_id))
+            if not pending:
+                return
+            os.makedirs(self.downloader.local_temp_dir, exist_ok=True)
+            hasher = ContentHasher()
+            with tempfile.SpooledTemporaryFile(max_size=FOUR_MB, dir=self.downloader.local_temp_dir) as sink:
+                export_cache_key = self.downloader._get_export_cache_key(file)
+                if export_cache_key and self._read_cached_export(export_cache_key, sink, hasher):
+                    self.downloader.num_exports_from_cache += 1
+                elif not await self._download(file=file, sink=sink, hasher=hasher):
+                    self.downloader.num_files_failed_to_download += len(pending)
+                    return
+                elif export_cache_key:
+                    self.downloader._put_in_export_cache(export_cache_key, sink)
+                    sink.seek(0, os.SEEK_END)
+                if file.get('md5Checksum') and hasher.md5.hexdigest() != file['md5Checksum']:
+                    self.downloader.error({'_transfer_file': {
+                        'file_name': file_name, 'error': 'md5 mismatch', 'expected': file['md5Checksum'],
+                        'actual': hasher.md5.hexdigest()}})
+                    self.downloader.num_files_failed_to_download += len(pending)
+                    return
+                self.downloader.num_files_downloaded += len(pending)
+                downloaded = True
+                self.downloader.num_files_deduplicated += sum(copy is not file for copy, _ in pending)
+                size = sink.tell()
+                for copy, parent_id in pending:
+                    replace = bool(copy.get('destination_item_id'))
+                    item = await self._upload(
+                        parent_id=parent_id, file_name=normalize_name(copy['name']), source=sink, size=size,
+                        if_absent=if_absent and not replace, replace=replace)
+                    await self._check_upload(copy, item, hasher.quick_xor.b64digest(), size)
+                    uploaded += 1
+        except Exception as e:
+            self.downloader.error({'_transfer_file': {'file_name': file_name, 'error': str(e)}})
+            # once downloaded, the copies not uploaded yet are upload failures
+            if downloaded:
+                self.uploader._num_failed += len(pending) - uploaded
+            else:
+                self.downloader.num_files_failed_to_download += len(copies) - skipped
+        finally:
+            if is_large:
+                self._large_transfers.release()
+
+    async def _check_upload(self, file: dict = {}, item: dict = None, quick_xor_hash: str = '', size: int = 0):
+        """ Count the upload of file as item. If its quickXorHash does not
+        match the download's, it is re-transferred; a new file is deleted
+        first, a replaced one is replaced again. """
+        file_name = normalize_name(file['name'])
+        if item is None:
+            self.uploader._num_failed += 1
+        elif 'error' in item:
+            self.downloader.info({'_transfer_file': {'file_already_exists': file_name}})
+            self.uploader.num_completed_uploads += 1
+        elif VERIFY_UPLOADS and verify_quick_xor_hash(item, quick_xor_hash) is False:
+            self.downloader.error({'_transfer_file': {
+                'hash_mismatch': file_name, 'expected': quick_xor_hash,
+                'reported': item['file']['hashes']['quickXorHash']}})
+            if not file.get('destination_item_id'):
+                # remove the bad copy so that the re-transfer is not a name conflict
+                await self._request(api='graph', method='DELETE', url=self._item_url(item['id']))
+            self._hash_mismatches.append(file)
+        else:
+            self.uploader.num_completed_uploads += 1
+            self._transferred_hashes[file['id']] = quick_xor_hash
+            self.downloader.info({'_transfer_file': {
+                'uploaded': file_name, 'size': self.downloader.sizeof_fmt(size),
+                'progress': self.downloader.get_progress()}})
+
+    async def _transfer_worker(self, files):
+        for file in files:
+            await self._transfer_file(file)
+
+    async def _transfer_queued_files(self, files: asyncio.Queue = None):
+        """ Transfer the files put in files until it yields None """
+        while True:
+            file = await files.get()
+            if file is None:
+                return
+            await self._transfer_file(file)
+
+    async def _migrate(self, files_list: list = []):
+        self.uploader.set_todo_count(total_files_to_upload=len(files_list))
+        if PRECREATE_FOLDERS:
+            # create the destination tree up front; concurrent calls for a
+            # folder's children wait on its lock, so this proceeds level by level.
+            # Failures are retried when a file needs the folder.
+            await asyncio.gather(*[
+                self._get_remote_folder_id(path)
+                for path in sorted({f['parent_folder_local_path'] for f in files_list})
+            ], return_exceptions=True)
+        await self._transfer_files(files_list)
+        return True
+
+    async def _transfer_files(self, files_list: list = [], attempts: int = 2):
+        # files whose upload did not match the download get one more transfer
+        for attempt in range(attempts):
+            self._hash_mismatches = []
+            if DEDUPLICATE:
+                files_list, self._duplicates = group_duplicates(files_list)
+            # workers share one iterator so at most ASYNC_MAX_CONCURRENT_TRANSFERS
+            # files are in progress without creating a task per file up front
+            files = iter(self.downloader.get_transfer_scheduler(files_list))
+            await asyncio.gather(*[
+                self._transfer_worker(files)
+                for _ in range(min(ASYNC_MAX_CONCURRENT_TRANSFERS, len(files_list)))
+            ])
+            if not self._hash_mismatches:
+                break
+            if attempt + 1 < attempts:
+                self.downloader.info({'_migrate': {'hash_mismatches_to_retransfer': len(self._hash_mismatches)}})
+            files_list = self._hash_mismatches
+        else:
+            self.downloader.error({'_migrate': {
+                'hash_mismatch_after_retransfer': [f['name'] for f in self._hash_mismatches]}})
+            self.uploader._num_failed += len(self._hash_mismatches)
@@ -3,8 +3,14 @@ import os
 from datetime import timedelta
 from pathlib import PurePath
 import math 
+from .constants import LOG_SAMPLE_EVERY_N
+from .logutil import LogMessage, Sampler, attach_queue_listener
 
 class BaseUtil: 
+    # SpanCollector shared by the objects working on one migration; see tracing.py
+    tracer = None
+    LOG_FORMAT = "[%(prefix)s - %(filename)s:%(lineno)s - %(funcName)3s() ] %(message)s"
+
     def __init__(self, name: str = '', verbose: bool = False, username: str = '' ): 
         self.name = name
         self.verbose = verbose 
@@ -29,17 +35,19 @@ class BaseUtil:
         return "%s %s" % (s, size_name[i])
     
     def setup_logging(self):
-        """ set up self.logger for Driver logging """ 
+        """ set up self.logger for Driver logging. Records are put on a queue and
+        written to the console and the log file by a QueueListener thread, so
+        logging never blocks a transfer thread on disk I/O """ 
         self.logger = logging.getLogger(self.name)
-        format = "[%(prefix)s - %(filename)s:%(lineno)s - %(funcName)3s() ] %(message)s"
-        formatter = logging.Formatter(format)
+        self._log_sampler = Sampler()
+        formatter = logging.Formatter(self.LOG_FORMAT)
         handlerStream = logging.StreamHandler()
         handlerStream.setFormatter(formatter) 
-        self.logger.addHandler(handlerStream)  
         os.makedirs(self.log_folder_path, exist_ok=True) 
         handlerFile = logging.FileHandler(f'{self.log_folder_path}/{self.name}.log')
         handlerFile.setFormatter(formatter) 
-        self.logger.addHandler(handlerFile)  
+        # replaces the handlers of an earlier instance with the same name
+        attach_queue_listener(self.logger, [handlerStream, handlerFile])
         if self.verbose:
             self.logger.setLevel(logging.DEBUG) 
         else:
@@ -87,19 +95,34 @@ class BaseUtil:
         return num_dirs + num_files  
     
     def shutdown_logging(self):
-        logging.shutdown()
+        """ Flush queued records and close the log file (e.g. before uploading
+        it). Later records still go to the console. """
+        handlerStream = logging.StreamHandler()
+        handlerStream.setFormatter(logging.Formatter(self.LOG_FORMAT))
+        attach_queue_listener(self.logger, [handlerStream])
 
     def disable_logging(self): 
         self.logger.disabled = True 
 
     def enable_logging(self):
         self.logger.disabled = False 
+
+    def _log(self, level: int = logging.INFO, msg=None, sample: str = None, every: int = LOG_SAMPLE_EVERY_N):
+        """ msg may be a dict (rendered as redacted, size-capped JSON on the
+        listener thread) or a callable returning one, which is only called if
+        the record will be emitted. With sample, only the first and then every
+        Nth record of that event is kept. """
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample is not None and not self._log_sampler(sample, every):
+            return
+        self.logger.log(level, LogMessage(msg), extra={'prefix': self.name}, stacklevel=3)
         
-    def debug(self, msg):
-        self.logger.debug(msg, extra={'prefix': self.name}, stacklevel=2)
+    def debug(self, msg, sample: str = None):
+        self._log(logging.DEBUG, msg, sample=sample)
 
-    def info(self, msg):
-        self.logger.info(msg, extra={'prefix': self.name}, stacklevel=2)
+    def info(self, msg, sample: str = None):
+        self._log(logging.INFO, msg, sample=sample)
 
     def error(self, msg):
-        self.logger.error(msg, extra={'prefix': self.name}, stacklevel=2)
\ No newline at end of file
+        self._log(logging.ERROR, msg)
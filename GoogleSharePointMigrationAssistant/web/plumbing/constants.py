@@ -16,9 +16,74 @@ except:
 
 MAX_LIST_THREADS = 10 
 MAX_UPLOAD_THREADS = 30 
+# destination folders listed at once while the destination tree is indexed
+DESTINATION_LIST_THREADS = int(os.environ.get('MIGRATION_DESTINATION_LIST_THREADS', 16))
+GRAPH_PAGE_SIZE = 999 # children per Graph page; the default is 200
+# drive item fields of a listed child that the destination index and transfer plan use
+GRAPH_CHILDREN_SELECT = 'id,name,size,file,folder,lastModifiedDateTime'
 MAX_DOWNLOAD_THREADS = 10
-FILE_BATCH_SIZE = 100 # num files downloaded at a time before uploading to SPO then deleting 
- 
+FILE_BATCH_SIZE = 100 # num files downloaded at a time before uploading to SPO then deleting
+# Transfer order: 'listing', 'largest-first', 'smallest-first' or 'bin-pack'; see scheduling.py
+TRANSFER_SCHEDULE = os.environ.get('TRANSFER_SCHEDULE', 'largest-first')
+BATCH_BYTE_BUDGET = int(os.environ.get('MIGRATION_BATCH_BYTE_BUDGET', 1024 * 1024 * 1024)) # bin-pack batch size in bytes
+SCAN_RESULT_BULK_CREATE_BATCH_SIZE = 1000 # num scanned file rows written per INSERT
+
+# Transfer engine. 'threads' uses the ThreadPoolExecutor pipeline; 'asyncio'
+# runs downloads and uploads as coroutines on a single event loop.
+TRANSFER_ENGINE = os.environ.get('TRANSFER_ENGINE', 'threads')
+ASYNC_MAX_IN_FLIGHT_REQUESTS = 1000 # open HTTP requests across Drive and Graph
+ASYNC_MAX_CONCURRENT_TRANSFERS = 1000 # files being downloaded/uploaded at once
+ASYNC_MAX_CONCURRENT_LARGE_TRANSFERS = MAX_DOWNLOAD_THREADS # files >= 4MB, which spool to disk
+ASYNC_MAX_RETRIES = 5
+GRAPH_UPLOAD_CHUNK_SIZE = 327680 # upload session chunks must be multiples of 320 KiB
+# Files under 4 MiB are uploaded with one conflictBehavior=fail PUT (409: already
+# there) instead of a name lookup GET followed by the PUT
+SMALL_FILE_FAST_PATH = os.environ.get('MIGRATION_SMALL_FILE_FAST_PATH', 'true').lower() == 'true'
+# Create the whole destination folder tree, a level at a time, before the first upload
+PRECREATE_FOLDERS = os.environ.get('MIGRATION_PRECREATE_FOLDERS', 'true').lower() == 'true'
+# Compare the quickXorHash computed while downloading with the one Graph reports for
+# the uploaded file; mismatched files are deleted and transferred once more
+VERIFY_UPLOADS = os.environ.get('MIGRATION_VERIFY_UPLOADS', 'true').lower() == 'true'
+# Download blobs with the same md5Checksum and size once; the other copies are
+# uploaded from the downloaded one
+DEDUPLICATE = os.environ.get('MIGRATION_DEDUPLICATE', 'true').lower() == 'true'
+# Exports of Google-native files are kept on disk and reused by retries and reruns
+# while the document is unchanged; least recently used first out past the budget.
+# A budget of 0 turns the cache off
+EXPORT_CACHE_PATH = os.environ.get(
+    'MIGRATION_EXPORT_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'export-cache'))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('MIGRATION_EXPORT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Longest destination path (folders and file name) below the target folder; longer
+# file names are shortened by the scan. SharePoint allows 400 characters in all,
+# site and library included
+MAX_DESTINATION_PATH_LENGTH = int(os.environ.get('MIGRATION_MAX_PATH_LENGTH', 400))
+# Starting a scan also migrates: files are transferred as the scan finds them
+# instead of once it is complete; see scanstream.py
+SCAN_AND_MIGRATE = os.environ.get('MIGRATION_SCAN_AND_MIGRATE', 'false').lower() == 'true'
+
+# Drive downloads stream to disk; memory per download thread is bounded by the chunk size
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('MIGRATION_DOWNLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+DOWNLOAD_MAX_RETRIES = 5 # interrupted downloads resume from the bytes already written
+DOWNLOAD_TIMEOUT_SECONDS = (10, 60) # connect, read
+# blobs at least this large are fetched as SEGMENTED_DOWNLOAD_SEGMENTS parallel byte ranges
+SEGMENTED_DOWNLOAD_THRESHOLD = int(os.environ.get('MIGRATION_SEGMENTED_DOWNLOAD_THRESHOLD', 256 * 1024 * 1024))
+SEGMENTED_DOWNLOAD_SEGMENTS = int(os.environ.get('MIGRATION_SEGMENTED_DOWNLOAD_SEGMENTS', 8))
+
+# Tracing. Spans around Drive/Graph calls are summarized per migration into
+# latency-breakdown-<phase>.json in the migration log folder.
+TRACING_ENABLED = os.environ.get('MIGRATION_TRACING', 'true').lower() == 'true'
+TRACE_MAX_RECORDED_SPANS = 20000 # raw spans kept for the export; totals include all spans
+
+# Logging. Messages are rendered off-thread as capped, redacted JSON; see logutil.py
+LOG_SAMPLE_EVERY_N = int(os.environ.get('MIGRATION_LOG_SAMPLE_EVERY_N', 100)) # per-chunk/per-request debug events
+LOG_MAX_VALUE_LENGTH = 1024 # chars kept of any one string value
+LOG_MAX_LIST_ITEMS = 20 # list items / dict keys kept per container
+LOG_MAX_MESSAGE_LENGTH = 16384 # chars kept of a rendered message
+LOG_REDACTED_KEYS = frozenset([
+    'access_token', 'refresh_token', 'id_token', 'token', 'client_secret',
+    'authorization', 'password',
+])
+
 
 # google drive API rate limits
 ONE_HUNDRED_SECONDS = 100
@@ -0,0 +1,125 @@
+""" Content hashes computed while a file streams through, so that a migrated
+file can be verified without reading it again: Drive's md5Checksum for the
+download and Graph's quickXorHash (file.hashes of OneDrive for Business and
+SharePoint drive items) for the upload.
+
+quickXorHash XORs byte i of the content into a 160-bit register at bit
+(i * 11) % 160. Since 11 * 160 = 0 (mod 160), every byte whose offset has the
+same remainder mod 160 lands at the same bit, so the content can first be
+XOR-folded into 160 lanes and the register built from the lanes once, at
+digest time. The folding is done on whole chunks as Python integers: a chunk
+is XORed together 40 KiB at a time with int.from_bytes, and the result is
+halved down to 160 bytes with shifts and masks. The per-byte work is done in C,
+at about the speed of hashlib.md5, against a few MB/s for a per-byte loop.
+ref: https://learn.microsoft.com/en-us/onedrive/developer/code-snippets/quickxorhash """
+import base64
+import hashlib
+
+QUICK_XOR_WIDTH_BYTES = 20  # 160 bits
+QUICK_XOR_LANES = 160
+QUICK_XOR_SHIFT = 11
+_QUICK_XOR_MASK = (1 << 160) - 1
+# chunks are XORed together as ints of this many bytes (256 blocks), which
+# are then halved down to one block
+_FOLD_PIECE_BYTES = QUICK_XOR_LANES * 256
+_HALF_MASKS = {
+    QUICK_XOR_LANES << i: (1 << ((QUICK_XOR_LANES << i) * 8)) - 1 for i in range(8)}
+
+
+def _fold(data) -> int:
+    """ XOR of the 160-byte blocks of data (whose length is a multiple of 160),
+    as a little-endian int """
+    x = 0
+    for start in range(0, len(data), _FOLD_PIECE_BYTES):
+        x ^= int.from_bytes(data[start:start + _FOLD_PIECE_BYTES], 'little')
+    width = _FOLD_PIECE_BYTES
+    while width > QUICK_XOR_LANES:
+        width //= 2
+        x = (x & _HALF_MASKS[width]) ^ (x >> (width * 8))
+    return x
+
+
+class QuickXorHash:
+    """ hashlib-style quickXorHash. offset is the position in the file of the
+    first byte passed to update(), for hashing a byte range on its own; the
+    hashes of the ranges of a file are combined with merge(). """
+    name = 'quickXorHash'
+
+    def __init__(self, data: bytes = b'', offset: int = 0):
+        self._lanes = 0
+        # zero bytes are a no-op under XOR; they align data to its lane
+        self._pending = bytes(offset % QUICK_XOR_LANES)
+        self.length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        view = memoryview(data).cast('B')
+        self.length += len(view)
+        if self._pending:
+            head = view[:QUICK_XOR_LANES - len(self._pending)]
+            self._pending += bytes(head)
+            view = view[len(head):]
+            if len(self._pending) < QUICK_XOR_LANES:
+                return
+            self._lanes ^= int.from_bytes(self._pending, 'little')
+            self._pending = b''
+        aligned = len(view) - len(view) % QUICK_XOR_LANES
+        if aligned:
+            self._lanes ^= _fold(view[:aligned])
+        self._pending = bytes(view[aligned:])
+
+    def merge(self, other):
+        """ Add the bytes hashed by other, a QuickXorHash of a different range
+        of the same file """
+        self._lanes ^= other._lanes ^ int.from_bytes(other._pending, 'little')
+        self.length += other.length
+
+    def digest(self) -> bytes:
+        lanes = (self._lanes ^ int.from_bytes(self._pending, 'little')).to_bytes(QUICK_XOR_LANES, 'little')
+        register = 0
+        for lane, value in enumerate(lanes):
+            if value:
+                register ^= value << (lane * QUICK_XOR_SHIFT % 160)
+        register = (register & _QUICK_XOR_MASK) ^ (register >> 160)
+        digest = bytearray(register.to_bytes(QUICK_XOR_WIDTH_BYTES, 'little'))
+        for i, b in enumerate(self.length.to_bytes(8, 'little')):
+            digest[QUICK_XOR_WIDTH_BYTES - 8 + i] ^= b
+        return bytes(digest)
+
+    def b64digest(self) -> str:
+        """ The digest as Graph reports it in file.hashes.quickXorHash """
+        return base64.b64encode(self.digest()).decode()
+
+
+class ContentHasher:
+    """ md5 and quickXorHash of content streamed through update(), in one pass """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Forget everything hashed so far, e.g. when a download restarts """
+        self.md5 = hashlib.md5()
+        self.quick_xor = QuickXorHash()
+
+    def update(self, data):
+        self.md5.update(data)
+        self.quick_xor.update(data)
+
+    @property
+    def length(self):
+        return self.quick_xor.length
+
+    def hashes(self) -> dict:
+        return {'md5Checksum': self.md5.hexdigest(), 'quickXorHash': self.quick_xor.b64digest()}
+
+
+def verify_quick_xor_hash(item: dict = None, quick_xor_hash: str = ''):
+    """ Compare the quickXorHash computed on download with the file.hashes of
+    the uploaded drive item. Return True or False, or None if there is nothing
+    to compare (no hash, or a drive that does not report quickXorHash). """
+    reported = ((item or {}).get('file') or {}).get('hashes', {}).get('quickXorHash')
+    if not quick_xor_hash or not reported:
+        return None
+    return reported == quick_xor_hash
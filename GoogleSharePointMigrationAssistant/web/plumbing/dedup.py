@@ -0,0 +1,31 @@
+""" Content-addressed deduplication of scanned files. Blobs with the same Drive
+md5Checksum and size have the same content, so only the first of them (in
+scan order) is downloaded; the others are made from its local copy and
+uploaded from there. Google-native files have no md5Checksum until exported
+and are never grouped. """
+
+
+def get_content_key(file: dict = {}):
+    """ (md5Checksum, size) of a blob, or None for files without a checksum """
+    if not file.get('md5Checksum') or 'size' not in file:
+        return None
+    return file['md5Checksum'], int(file['size'])
+
+
+def group_duplicates(files_list: list = []):
+    """ Split files_list into the files to transfer and, by id of the file to
+    transfer, the duplicates to make from it:
+    (files to transfer, {file id: [duplicate files]}). The files to transfer
+    are of the type of files_list (a list or a FileManifest). """
+    first_by_key = {}
+    unique, duplicates = type(files_list)(), {}
+    for file in files_list:
+        key = get_content_key(file)
+        if key is None:
+            unique.append(file)
+        elif key in first_by_key:
+            duplicates.setdefault(first_by_key[key], []).append(file)
+        else:
+            first_by_key[key] = file['id']
+            unique.append(file)
+    return unique, duplicates
@@ -0,0 +1,154 @@
+""" On-disk cache of exported Google-native files (Docs, Sheets, Slides and
+the PDF exports of other types). An export is the slowest and most
+quota-heavy Drive request, and its result only changes when the document
+does, so exports are kept by (file id, modifiedTime, export mimetype) and
+retries and reruns copy them from disk instead of exporting again.
+
+Entries are files named by the sha256 of their key. The least recently
+used are evicted once the cache grows past its byte budget. Recency is the
+file mtime, touched on every hit, so it survives restarts. One cache is
+shared by every migration in the process (get_export_cache). """
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+STALE_TMP_SECONDS = 60 * 60
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_export_cache(path: str = '', max_bytes: int = 0):
+    """ The ExportCache for path, or None if max_bytes is 0 (disabled) """
+    if not max_bytes:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ExportCache(path=path, max_bytes=max_bytes)
+        return _caches[path]
+
+
+def get_export_cache_key(file: dict = {}, export_mimetype: str = ''):
+    """ Cache key of a Google-native file's export, or None if the file has
+    no modifiedTime to tell versions apart (scans saved before it was kept) """
+    if not file.get('modifiedTime'):
+        return None
+    return file['id'], file['modifiedTime'], export_mimetype
+
+
+class ExportCache:
+    """ Exports in the folder at path, at most max_bytes of them """
+
+    def __init__(self, path: str = '', max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # entry name: size, least recently used first
+        self._entries = OrderedDict()
+        entries = []
+        # the folder is created by the first put
+        for name in os.listdir(path) if os.path.isdir(path) else []:
+            stat = os.stat(os.path.join(path, name))
+            if name.endswith('.tmp'):
+                # an interrupted put, or one in progress in another process
+                if time.time() - stat.st_mtime > STALE_TMP_SECONDS:
+                    os.remove(os.path.join(path, name))
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+        self.size = sum(self._entries.values())
+        self._evict()
+
+    def _entry_name(self, key: tuple = ()):
+        return hashlib.sha256('\0'.join(key).encode()).hexdigest()
+
+    def _lookup(self, key: tuple = ()):
+        """ Path of the entry for key, marked as just used, or None on a miss """
+        name = self._entry_name(key)
+        entry_path = os.path.join(self.path, name)
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                try:
+                    os.utime(entry_path)
+                    self.hits += 1
+                    return entry_path
+                except FileNotFoundError:
+                    # removed by another process sharing the folder
+                    self.size -= self._entries.pop(name)
+            self.misses += 1
+            return None
+
+    def copy_to(self, key: tuple = (), dest_path: str = ''):
+        """ Copy the cached export for key to dest_path. Return True on a hit. """
+        entry_path = self._lookup(key)
+        if entry_path is None:
+            return False
+        try:
+            # hard links are safe: batch files are removed, never modified
+            try:
+                os.link(entry_path, dest_path)
+            except OSError:
+                # dest_path exists, or no hard links on this filesystem
+                shutil.copyfile(entry_path, dest_path)
+        except FileNotFoundError:
+            # evicted in the meantime
+            return False
+        return True
+
+    def open(self, key: tuple = ()):
+        """ The cached export for key opened for reading, or None on a miss """
+        entry_path = self._lookup(key)
+        if entry_path is None:
+            return None
+        try:
+            return open(entry_path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def put_fileobj(self, key: tuple = (), fileobj=None):
+        """ Store the content of fileobj (from its start) as the export for key """
+        name = self._entry_name(key)
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                fileobj.seek(0)
+                shutil.copyfileobj(fileobj, f)
+                size = f.tell()
+            if size > self.max_bytes:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, os.path.join(self.path, name))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+        self._evict()
+
+    def put_file(self, key: tuple = (), source_path: str = ''):
+        """ Store the file at source_path as the export for key """
+        with open(source_path, 'rb') as f:
+            self.put_fileobj(key, f)
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.size <= self.max_bytes or not self._entries:
+                    return
+                name, size = self._entries.popitem(last=False)
+                self.size -= size
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
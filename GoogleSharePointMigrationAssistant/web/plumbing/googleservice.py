@@ -0,0 +1,147 @@
+""" Process-wide factory for Google Drive v3 service objects. The Drive
+discovery document is read from the copy bundled with google-api-python-client
+(no network) and parsed once per process; services are then built from the
+parsed document. get_drive_service() hands out one service per credential
+per thread, since the httplib2 transport under a service is not thread-safe.
+PooledAuthorizedHttp is a transport that one service can share across the
+threads of a migration; PooledAuthorizedSession is its streaming counterpart
+for file content. """
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import httplib2
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from google.auth.transport.requests import AuthorizedSession, Request as RequestsRequest
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest, build_http
+from .constants import MAX_DOWNLOAD_THREADS
+
+MAX_SERVICES_PER_THREAD = 32
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+_services = threading.local()
+
+
+def _prime(resource=None, resource_desc: dict = None):
+    """ Create every method of every (nested) resource once. The client fills
+    in default parameters on the discovery document as methods are created;
+    doing it all up front means the shared document is never modified again. """
+    for name, desc in resource_desc.get('resources', {}).items():
+        _prime(getattr(resource, name)(), desc)
+
+
+def get_drive_discovery_document():
+    """ The parsed Drive v3 discovery document, shared by every service """
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                document = json.loads(get_static_doc('drive', 'v3'))
+                _prime(build_from_document(document, http=httplib2.Http()), document)
+                _discovery_document = document
+    return _discovery_document
+
+
+class PooledAuthorizedHttp:
+    """ httplib2-compatible transport that is safe to share between threads.
+    Each thread gets its own keep-alive httplib2.Http (with googleapiclient's
+    defaults: timeout, 308 not followed as a redirect), created on first use
+    and reused for every later request of that thread, so a worker pays for a
+    connection (and TLS handshake) once rather than per request. The credentials
+    are shared by all threads and refreshed once, under a lock, when they expire. """
+
+    def __init__(self, credentials=None):
+        self.credentials = credentials
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.num_thread_transports = 0
+
+    def _authorized_http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = AuthorizedHttp(self.credentials, http=build_http())
+            with self._lock:
+                self.num_thread_transports += 1
+        return http
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        http = self._authorized_http()
+        if not self.credentials.valid:
+            with self._lock:
+                # another thread may have refreshed while this one waited
+                if not self.credentials.valid:
+                    self.credentials.refresh(Request(http.http))
+        return http.request(uri, method=method, body=body, headers=headers, **kwargs)
+
+    def close(self):
+        """ Close this thread's connections """
+        http = getattr(self._local, 'http', None)
+        if http is not None:
+            http.close()
+            self._local.http = None
+
+
+class PooledAuthorizedSession(AuthorizedSession):
+    """ Authorized requests.Session for streaming file content, which httplib2
+    cannot do (it reads a whole response into memory). Shared by the download
+    threads of a migration: keeps up to pool_size keep-alive connections per
+    host, and refreshes the credentials once, under a lock, when they expire. """
+
+    def __init__(self, credentials=None, pool_size: int = MAX_DOWNLOAD_THREADS):
+        super().__init__(credentials)
+        self._refresh_lock = threading.Lock()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if not self.credentials.valid:
+            with self._refresh_lock:
+                if not self.credentials.valid:
+                    self.credentials.refresh(RequestsRequest())
+        return super().request(method, url, *args, **kwargs)
+
+
+def build_drive_service(credentials=None, request_builder=HttpRequest, http=None):
+    """ A new Drive service for credentials, pointed at settings.GOOGLE_DRIVE_API_URL.
+    Requests go through http if given, else a new AuthorizedHttp. """
+    return build_from_document(
+        get_drive_discovery_document(),
+        http=http or AuthorizedHttp(credentials, http=build_http()),
+        requestBuilder=request_builder,
+        client_options={'api_endpoint': f'{settings.GOOGLE_DRIVE_API_URL}/'})
+
+
+def get_credentials_key(credentials=None):
+    """ Stable identity of OAuth or service account credentials. Keyed on the
+    refresh token (not the access token), so a service whose credentials
+    refreshed themselves is still found. """
+    identity = (
+        getattr(credentials, 'service_account_email', None)
+        or getattr(credentials, 'refresh_token', None)
+        or credentials.token
+    )
+    parts = [type(credentials).__name__, identity, getattr(credentials, '_subject', None) or '']
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def get_drive_service(credentials=None):
+    """ This thread's Drive service for credentials, building it on first use.
+    Each thread keeps its MAX_SERVICES_PER_THREAD most recently used services. """
+    services = getattr(_services, 'services', None)
+    if services is None:
+        services = _services.services = OrderedDict()
+    key = (get_credentials_key(credentials), settings.GOOGLE_DRIVE_API_URL)
+    service = services.get(key)
+    if service is None:
+        service = services[key] = build_drive_service(credentials)
+        if len(services) > MAX_SERVICES_PER_THREAD:
+            services.popitem(last=False)[1].close()
+    else:
+        services.move_to_end(key)
+    return service
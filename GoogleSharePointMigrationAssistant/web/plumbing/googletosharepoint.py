@@ -1,25 +1,40 @@
 from asyncio import ALL_COMPLETED
-from google_auth_httplib2 import AuthorizedHttp
-from googleapiclient.http import MediaIoBaseDownload, HttpRequest, HttpError 
+from googleapiclient.http import HttpRequest, HttpError 
 from google.oauth2.service_account import Credentials as CredentialsSVCAccount
 from google.oauth2.credentials import Credentials as CredentialsOauth
-from googleapiclient.discovery import build 
 from ratelimit import limits, sleep_and_retry 
-from sanitize_filename import sanitize
 from concurrent.futures import wait, ThreadPoolExecutor
-import httplib2
+import itertools
 import math
+import queue
 import time 
 import shutil 
 import os
-from ..models import AdministrationSettings, Migration
+from django.db import transaction
+from ..models import AdministrationSettings, Migration, MigrationFile
 from .base import BaseUtil
 from .constants import (
     GOOGLE_DRIVE_SLEEP_RETRY_SECONDS, 
     MAX_GOOGLE_DRIVE_QUERIES_PER_ONE_HUNDRED_SECONDS,
     ONE_HUNDRED_SECONDS, DEFAULT_PAGESIZE, MAX_DOWNLOAD_THREADS,
-    MAX_LIST_THREADS
+    MAX_LIST_THREADS, SCAN_RESULT_BULK_CREATE_BATCH_SIZE, TRANSFER_ENGINE,
+    SEGMENTED_DOWNLOAD_SEGMENTS, SEGMENTED_DOWNLOAD_THRESHOLD, TRANSFER_SCHEDULE,
+    PRECREATE_FOLDERS, DEDUPLICATE, DOWNLOAD_CHUNK_SIZE, EXPORT_CACHE_PATH, EXPORT_CACHE_MAX_BYTES
 )
+from .asynctransfer import AsyncTransferEngine
+from .remotefolders import UploadRecord
+from .googleservice import PooledAuthorizedHttp, PooledAuthorizedSession, build_drive_service
+from .contenthash import ContentHasher, QuickXorHash
+from .dedup import group_duplicates
+from .exportcache import get_export_cache, get_export_cache_key
+from .manifest import FileManifest
+from .naming import NamePlan, normalize_name
+from .pathindex import PathIndex
+from .scanstream import ScanStream
+from .mediadownload import download_segments_to_file, download_to_file
+from .scheduling import TransferScheduler
+from .transferplan import TransferPlan, UNCHANGED
+from .tracing import SpanCollector, current_span, traced
 
 class GoogleToSharePoint(BaseUtil):
     def __init__(self, 
@@ -31,26 +46,44 @@ class GoogleToSharePoint(BaseUtil):
     auth_method: str = 'svc_account', # alternative is 'oauth',
     migration: Migration = None, 
     google_credentials: dict = {},
+    engine: str = TRANSFER_ENGINE, # 'threads' or 'asyncio'
+    transfer_schedule: str = TRANSFER_SCHEDULE, # see scheduling.SCHEDULING_POLICIES
     ): 
         super().__init__(name=name, verbose=verbose, username=migration.user.username)
+        self.engine = engine
+        self.transfer_schedule = transfer_schedule
         self.admin_config = AdministrationSettings.objects.first()
         self.migration = migration
         self.file_batch_size = file_batch_size
         self.scopes = ['https://www.googleapis.com/auth/drive.readonly'] 
         self.folder_type = 'application/vnd.google-apps.folder'  
         self.uploader = uploader
+        # one collector for the downloader and uploader of this migration
+        self.tracer = SpanCollector(name=f'migration-{migration.id}')
+        if uploader is not None:
+            uploader.tracer = self.tracer
         self.google_credentials = google_credentials
         self.unmigratable_files = []
         # init 
         self.num_files_already_in_destination = 0
+        self.transfer_plan = None # set by scan()
+        self.name_plan = None # set by scan()
+        # set by scan_and_migrate(): called with the scanned files of each folder
+        self.on_folder_scanned = None
+        self._deferred_hashes = None # transferred hashes held until the scan is saved
         self.local_temp_dir = os.path.join(os.path.dirname(__file__), local_temp_dir)
         self.info({'local_temp_dir': local_temp_dir})
         self.info({'self.local_temp_dir': self.local_temp_dir})
         self.num_active_downloads = 0 
         self.uploader_running = False 
         self.current_batch_downloaded = 0 
+        self.downloaded_files = [] # UploadRecords of the current batch
         self.num_files_skipped = 0 
         self.num_files_downloaded = 0 
+        self.num_files_deduplicated = 0 # made from a downloaded copy, see dedup.py
+        self._duplicates = {} # by file id, files with the same content
+        self.num_exports_from_cache = 0
+        self.export_cache = get_export_cache(path=EXPORT_CACHE_PATH, max_bytes=EXPORT_CACHE_MAX_BYTES)
         self.num_files_failed_to_download = 0 
         self.total_migratable_files = 0 
         self.num_active_downloads = 0
@@ -77,16 +110,17 @@ class GoogleToSharePoint(BaseUtil):
         elif auth_method == 'oauth':
             self.creds = self._get_google_credentials_from_session()
         try:  
+            # httplib2 is not threadsafe; the pool gives each download thread its
+            # own keep-alive connection and refreshes the shared credentials once
+            self.http = PooledAuthorizedHttp(self.creds)
             def build_request(http=None, *args, **kwargs):
-                """ 
-                Create a new Http() object for every request since  
-                httplib2 not threadsafe inherently.  
-                """
-                new_http = AuthorizedHttp(self.creds, http=httplib2.Http())
-                return HttpRequest(new_http, *args, **kwargs) 
+                return HttpRequest(self.http, *args, **kwargs) 
             self.build_request = build_request
-            authorized_http = AuthorizedHttp(self.creds, http=httplib2.Http())
-            self.service = build('drive', 'v3', requestBuilder=build_request, http=authorized_http) 
+            # built from the process-wide parsed discovery document
+            self.service = build_drive_service(self.creds, request_builder=build_request, http=self.http)
+            # file content is streamed to disk through this session, not httplib2
+            self.media_session = PooledAuthorizedSession(
+                self.creds, pool_size=MAX_DOWNLOAD_THREADS + SEGMENTED_DOWNLOAD_SEGMENTS)
             self.debug({
                 'google_drive_downloader_service': self.service.__dict__
             })
@@ -118,6 +152,14 @@ class GoogleToSharePoint(BaseUtil):
             return True
 
 
+    def get_export_mimetype(self, mimeType):
+        """ Return the O365-compatible mimetype a Google-native file is exported as """
+        return {
+            'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        }.get(mimeType, 'application/pdf')
+
     def set_file_batch_size(self, fbs):
         """ Set the file batch size. I.e., how many files to download per batch. 
         With larger files, better to use smaller batch size to not overload 
@@ -126,6 +168,7 @@ class GoogleToSharePoint(BaseUtil):
         self.file_batch_size = fbs
         self.info(f'File batch size set to {fbs}')
 
+    @traced('getlist', lambda a: {'entity': a['entity'], 'query': a['query']})
     @sleep_and_retry
     @limits(calls=MAX_GOOGLE_DRIVE_QUERIES_PER_ONE_HUNDRED_SECONDS, period=ONE_HUNDRED_SECONDS)
     def getlist(self, entity='files', query='', **kwargs):
@@ -140,6 +183,7 @@ class GoogleToSharePoint(BaseUtil):
                 _cmd = self.service.drives().list(q=query, **kwargs) 
             try:
                 entries = _cmd.execute()
+                current_span().increment('pages')
                 if result is None:
                     result = entries 
                 else: 
@@ -151,12 +195,14 @@ class GoogleToSharePoint(BaseUtil):
                     self.error(
                         f'Rate limit exceeded. Sleeping {GOOGLE_DRIVE_SLEEP_RETRY_SECONDS}'
                         f'seconds and retrying.')
+                    current_span().increment('retries')
                     time.sleep(GOOGLE_DRIVE_SLEEP_RETRY_SECONDS) 
                     result = self.getlist(entity, query, **kwargs) 
             except TimeoutError as etimeout:
                 self.error(
                     f'Timeout error when getting {entity} list: {etimeout}. '
                     f'Sleeping {GOOGLE_DRIVE_SLEEP_RETRY_SECONDS} seconds and retrying.')
+                current_span().increment('retries')
                 time.sleep(GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
                 result = self.getlist(entity, query, **kwargs)  
         return result  
@@ -186,55 +232,116 @@ class GoogleToSharePoint(BaseUtil):
             self.num_files_skipped += 1 
         else: 
             # exportable type. but is it exportable in size?    
-            if mimeType == 'application/vnd.google-apps.document':
-                if self.file_too_large_for_export(file):  
-                    key = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                    url = file['exportLinks'][key]
-                    request = url  
-                    too_large = True 
-                else:
-                    request = self.service.files().export_media(fileId=file_id, 
-                                                    mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document') 
-            elif mimeType == 'application/vnd.google-apps.spreadsheet':
-                if self.file_too_large_for_export(file):  
-                    key = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    url = file['exportLinks'][key]
-                    request = url  
-                    too_large = True  
-                else:
-                    request = self.service.files().export_media(fileId=file_id, 
-                                                    mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet') 
-            elif mimeType == 'application/vnd.google-apps.presentation':
-                if self.file_too_large_for_export(file):   
-                    key = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-                    url = file['exportLinks'][key] 
-                    request = url #self.service._http.request(url)
-                    too_large = True 
-                else:
-                    request = self.service.files().export_media(fileId=file_id, 
-                                                    mimeType='application/vnd.openxmlformats-officedocument.presentationml.presentation') 
-            else: 
+            export_mimetype = self.get_export_mimetype(mimeType)
+            if export_mimetype != 'application/pdf' and self.file_too_large_for_export(file):
+                request = file['exportLinks'][export_mimetype]
+                too_large = True
+            else:
                 # no way of handling too-large google app files that are not forms, not presentations, not spreadsheets, and not documents. 
                 # dont check size. just try exporting as PDF. 
-                request = self.service.files().export_media(fileId=file_id,  mimeType='application/pdf') 
+                request = self.service.files().export_media(fileId=file_id, mimeType=export_mimetype)
         return valid, request, file_name, too_large
 
+    @traced('download_file', lambda a: {
+        'file.id': a['file']['id'], 'file.size': a['file'].get('size'), 'file.mime_type': a['file']['mimeType']})
     @sleep_and_retry
     @limits(calls=MAX_GOOGLE_DRIVE_QUERIES_PER_ONE_HUNDRED_SECONDS, period=ONE_HUNDRED_SECONDS)
     def download_file(self, file):  
         """ Download a file. Optionally pass in parent folder drive id and parent
          folder local path if file is not in the base target_dir """ 
         valid = True  
-        too_large = self.file_too_large_for_export(file)
+        # the export size limit only applies to Google-native files (set below);
+        # other files are always downloaded with get_media regardless of size
+        too_large = False
         request = self.service.files().get_media(fileId=file['id'])
         file_name = file['name']
+        # blob size and checksum, for segmented downloads; exports have neither
+        size = int(file['size']) if 'size' in file else None
+        md5_checksum = file.get('md5Checksum', '')
+        export_cache_key = self._get_export_cache_key(file)
+        if export_cache_key and self._copy_from_export_cache(file, export_cache_key):
+            return file
         if "application/vnd.google-apps" in file['mimeType']:  
             valid, request, file_name, too_large = self.handle_google_suite_filetypes(file)
+            size, md5_checksum = None, ''
         if too_large:
             self.info(f'File {file_name} too large for export, using exportLink to download.')
         if valid: 
-            self._download_worker(file_name, dest_folder=file['parent_folder_local_path'], request=request, too_large=too_large)  
+            record = self._download_worker(
+                file_name, dest_folder=file['parent_folder_local_path'], request=request, too_large=too_large,
+                size=size, md5_checksum=md5_checksum, file_id=file['id'],
+                replaces_item_id=file.get('destination_item_id'))
+            if record is not None and export_cache_key:
+                with open(record.local_path, 'rb') as f:
+                    self._put_in_export_cache(export_cache_key, f)
+            self._copy_duplicates(file, record)
         return file 
+
+    def _get_export_cache_key(self, file: dict = {}):
+        """ Export cache key of a Google-native file, or None if it is not cached """
+        if not self.export_cache or 'application/vnd.google-apps' not in file['mimeType']:
+            return None
+        return get_export_cache_key(file, self.get_export_mimetype(file['mimeType']))
+
+    def _put_in_export_cache(self, export_cache_key: tuple = (), fileobj=None):
+        try:
+            self.export_cache.put_fileobj(export_cache_key, fileobj)
+        except Exception as e:
+            self.error({'_put_in_export_cache': {'error': str(e), 'file_id': export_cache_key[0]}})
+
+    def _copy_from_export_cache(self, file, export_cache_key):
+        """ Place the cached export of a Google-native file in the batch folder
+        and record it for upload, as _download_worker does. Return the
+        UploadRecord, or None if it is not cached. """
+        dest_folder = file['parent_folder_local_path']
+        filepath = os.path.join(dest_folder, normalize_name(file['name']))
+        try:
+            os.makedirs(dest_folder, exist_ok=True)
+            if not self.export_cache.copy_to(export_cache_key, filepath):
+                return None
+            quick_xor = QuickXorHash()
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    quick_xor.update(chunk)
+        except Exception as e:
+            self.error({'_copy_from_export_cache': {'error': str(e), 'file_id': file['id']}})
+            return None
+        self.debug({'_copy_from_export_cache': {'file_name': file['name']}})
+        record = UploadRecord(
+            filepath, dest_folder, quick_xor.length, file['id'], quick_xor.b64digest(), file.get('destination_item_id'))
+        self.downloaded_files.append(record)
+        self.num_files_downloaded += 1
+        self.num_exports_from_cache += 1
+        self.current_batch_downloaded += 1
+        return record
+
+    def _copy_duplicates(self, file, record):
+        """ Make the duplicates of file (see dedup.group_duplicates) from its
+        downloaded copy, record, for upload with the batch. If file failed to
+        download, download them one by one instead. """
+        for duplicate in self._duplicates.get(file['id'], []):
+            if record is None:
+                self.download_file(duplicate)
+                continue
+            dest_folder = duplicate['parent_folder_local_path']
+            filepath = os.path.join(dest_folder, normalize_name(duplicate['name']))
+            try:
+                os.makedirs(dest_folder, exist_ok=True)
+                if not os.path.exists(filepath):
+                    try:
+                        os.link(record.local_path, filepath)
+                    except OSError:
+                        # no hard links on this filesystem
+                        shutil.copyfile(record.local_path, filepath)
+                self.downloaded_files.append(UploadRecord(
+                    filepath, dest_folder, record.size, duplicate['id'], record.quick_xor_hash,
+                    duplicate.get('destination_item_id')))
+                self.num_files_downloaded += 1
+                self.num_files_deduplicated += 1
+                self.current_batch_downloaded += 1
+            except Exception as e:
+                self.error(e)
+                self.num_files_failed_to_download += 1
     
     def _upload_and_delete(self):  
         self.debug({'_upload_and_delete': 'beginning upload'})
@@ -243,7 +350,16 @@ class GoogleToSharePoint(BaseUtil):
             self.debug({'_upload_and_delete': f"Waiting for ({self.num_active_downloads}) active download threads to finish"})
             time.sleep(3) 
         self.uploader.set_todo_count(total_files_to_upload=self.total_migratable_files)
-        self.uploader.upload(local_folder_base_path=self.local_temp_dir)
+        # the batch's files as recorded by the download workers; no walk of local_temp_dir
+        batch_files, self.downloaded_files = self.downloaded_files, []
+        mismatched = self.uploader.upload_files(
+            files=batch_files,
+            base_path=self.local_temp_dir,
+            base_parent_id=self.uploader.get_upload_base_folder_id())
+        mismatched_ids = {record.source_id for record in mismatched}
+        self._record_transferred_hashes({
+            record.source_id: record.quick_xor_hash for record in batch_files
+            if record.source_id not in mismatched_ids and record.quick_xor_hash})
         try: 
             shutil.rmtree(self.local_temp_dir)
         except Exception as e: 
@@ -251,44 +367,58 @@ class GoogleToSharePoint(BaseUtil):
         self.debug({'_upload_and_delete': "batch upload and delete complete"})
         self.current_batch_downloaded = 0 
         self.uploader_running = False   
+        return mismatched
 
-    def _download_worker(self, file_name, dest_folder, request, too_large):   
+    @traced('_download_worker', lambda a: {'file.name': a['file_name'], 'export_link': a['too_large']})
+    def _download_worker(self, file_name, dest_folder, request, too_large, size=None, md5_checksum='', file_id=None,
+                         replaces_item_id=None):   
         try:  
             self.num_active_downloads += 1
-            file_name = sanitize(file_name)
+            file_name = normalize_name(file_name)
             os.makedirs(dest_folder, exist_ok=True)
             filepath = os.path.join(dest_folder, file_name)
             self.info({'_download_worker': f"Downloading file {file_name} ({self.num_files_downloaded + 1}/{self.total_migratable_files})"})   
-            with open(filepath, "wb") as wer:
-                if not too_large:
-                    # request is normal HttpRequest
-                    done = False
-                    try: 
-                        downloader = MediaIoBaseDownload(wer, request)  
-                        while done is False:
-                            status, done = downloader.next_chunk()
-                            if status is not None and (status.total_size is not None and status.resumable_progress is not None):
-                                self.info({
-                                    '_download_worker': "\rDownload %s (%s/%s): %d%%." % (file_name, self.sizeof_fmt(status.total_size), self.sizeof_fmt(status.resumable_progress), int(status.progress() * 100))})
-                             
-                    except HttpError as e:
-                        self.error({'_download_worker': f'error when downloading; {str(e)}'}) 
-                else:
-                    # request is URL from exportLinks
-                    self.info(
-                        {'_download_worker': f'downloading {file_name} from exportLink {request}'}) 
-                    authorized_http = AuthorizedHttp(self.creds, http=httplib2.Http()) 
-                    def postproc(response, content):
-                        return response, content
-                    request = self.build_request(http=authorized_http, uri=request, postproc=postproc)
-                    _, content = request.execute()
-                    wer.write(content)  
-                self.num_files_downloaded += 1 
-                self.current_batch_downloaded += 1  
+            if too_large:
+                # request is URL from exportLinks
+                self.info(
+                    {'_download_worker': f'downloading {file_name} from exportLink {request}'})
+                uri = request
+            else:
+                # request is a get_media / export_media HttpRequest
+                uri = request.uri
+            def on_progress(received, total_size):
+                self.info(lambda: {
+                    '_download_worker': "Download %s (%s/%s)" % (
+                        file_name, self.sizeof_fmt(received), self.sizeof_fmt(total_size) if total_size else '?')},
+                    sample='_download_worker.chunk')
+            if size is not None and size >= SEGMENTED_DOWNLOAD_THRESHOLD:
+                # one worker would otherwise stream a very large blob alone
+                self.info({'_download_worker': f'downloading {file_name} as {SEGMENTED_DOWNLOAD_SEGMENTS} parallel ranges'})
+                quick_xor = QuickXorHash()
+                size = download_segments_to_file(
+                    session=self.media_session, uri=uri, path=filepath, size=size,
+                    md5_checksum=md5_checksum, on_progress=on_progress, quick_xor=quick_xor,
+                    retry_seconds=GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
+            else:
+                # hashed as it streams: md5 checks the download against Drive,
+                # quickXorHash checks the upload against Graph
+                hasher = ContentHasher()
+                size = download_to_file(
+                    session=self.media_session, uri=uri, path=filepath, on_progress=on_progress,
+                    md5_checksum=md5_checksum, hasher=hasher, retry_seconds=GOOGLE_DRIVE_SLEEP_RETRY_SECONDS)
+                quick_xor = hasher.quick_xor
+            current_span().set_attribute('bytes', size)
+            record = UploadRecord(filepath, dest_folder, size, file_id, quick_xor.b64digest(), replaces_item_id)
+            self.downloaded_files.append(record)
+            self.num_files_downloaded += 1 
+            self.current_batch_downloaded += 1  
         except Exception as e:
             self.error(e)  
+            current_span().set_error(e)
             self.num_files_failed_to_download += 1
+            record = None
         self.num_active_downloads -= 1
+        return record
 
     def get_children_from_drive(self, drive_id): 
         """ Get children files & folders from drive by drive id """
@@ -296,6 +426,7 @@ class GoogleToSharePoint(BaseUtil):
                 entity='files', 
                 query=f"'{drive_id}' in parents and trashed = false and mimeType='{self.folder_type}'", 
                 **{
+                    'pageSize': DEFAULT_PAGESIZE,    
                     'driveId': drive_id,  
                     'corpora': 'drive', 
                     'supportsAllDrives': True,
@@ -307,13 +438,14 @@ class GoogleToSharePoint(BaseUtil):
             entity='files', 
             query=f"'{drive_id}' in parents and trashed = false and mimeType!='{self.folder_type}'", 
             **{
+                'pageSize': DEFAULT_PAGESIZE,    
                 'driveId': drive_id,  
                 'corpora': 'drive', 
                 'supportsAllDrives': True,
                 'supportsTeamDrives': True,
                 'includeTeamDriveItems': True, 
                 'includeItemsFromAllDrives': True, 
-                'fields': 'files(id,name,kind,size,mimeType,exportLinks)'
+                'fields': 'nextPageToken,files(id,name,size,md5Checksum,modifiedTime,mimeType,exportLinks)'
                 })['files']
         return {'folders': folders, 'files': files}  
 
@@ -322,7 +454,7 @@ class GoogleToSharePoint(BaseUtil):
     def count_migratable_files_in_folder(self, folder: dict = {}):
         migratable_file_count = 0
         self.debug(f'Counting migratable files in folder: {folder["name"]}')
-        folder['name'] = sanitize(folder['name']) 
+        folder['name'] = normalize_name(folder['name']) 
         _id = folder['id'] 
         kwargs = {
                 'pageSize': DEFAULT_PAGESIZE,    
@@ -330,7 +462,7 @@ class GoogleToSharePoint(BaseUtil):
                 'supportsTeamDrives': True,
                 'includeTeamDriveItems': True, 
                 'includeItemsFromAllDrives': True, 
-                'fields': 'files(id,name,kind,size,mimeType,exportLinks)'
+                'fields': 'nextPageToken,files(id,name,size,md5Checksum,modifiedTime,mimeType,exportLinks)'
             }
         files = self.getlist(
             entity='files', 
@@ -361,14 +493,6 @@ class GoogleToSharePoint(BaseUtil):
         r = (self.num_files_downloaded ) / self.total_migratable_files
         return f'{round(r,2) * 100}%'   
 
-    def _get_batch_for_download_from_files_list(self, files_list: list = []):   
-        """ pops batch_size items from list at a time which prevents infinite loop. """
-        batch = []
-        self.info(f'getting batch for download from files list of length {len(files_list)}')
-        while len(batch) < self.file_batch_size and len(files_list) > 0:
-            batch.append(files_list.pop(0))  
-        return batch    
-
     def _confirm(self, entity_type: str = 'shared_drive', entity: dict = {}): 
         if entity_type == 'shared_drive': 
             src_info = ( 
@@ -408,11 +532,40 @@ class GoogleToSharePoint(BaseUtil):
                 ext = '.pdf'
         return ext 
 
-    def _get_flattened_files_list_in_folder(self, folder: dict = {}, parent_folder_local_path: str = ''): 
+    def _add_scanned_file(self, file: dict = {}, parent_folder_local_path: str = '', files_list: list = []):
+        """ Record a file found while traversing the source. Migratable files get their 
+        local path and O365 extension, with the name normalized (see naming.py),
+        and are appended to files_list. """
+        if self.file_is_migratable(file):
+            file['parent_folder_local_path'] = parent_folder_local_path
+            file['name'] = normalize_name(
+                f'{file["name"]}{self.get_o365_extension_from_file_mimetype(file["mimeType"])}')
+            files_list.append(file)
+        else:
+            self.unmigratable_files.append(file)
+
+    def _add_scanned_files(self, files: list = [], parent_folder_local_path: str = '', files_list: list = [],
+                           folders: list = []):
+        """ _add_scanned_file for the files of one folder, whose subfolders are
+        folders. With on_folder_scanned set, the folder's migratable files are
+        handed to it instead of appended to files_list. """
+        scanned = []
+        for f in files:
+            self._add_scanned_file(f, parent_folder_local_path, scanned)
+        if self.on_folder_scanned is None:
+            files_list.extend(scanned)
+        else:
+            self.on_folder_scanned(scanned, parent_folder_local_path, [
+                os.path.join(parent_folder_local_path, normalize_name(f['name'])) for f in folders])
+
+    def _get_flattened_files_list_in_folder(self, folder: dict = {}, parent_folder_local_path: str = '',
+                                            files_list: FileManifest = None): 
         """ Traverse entire recursive hierarchy in folder and build/return a flattened
-        list of files within """
-        files_list = []
-        folder_name = sanitize(folder['name'])
+        list of files within. Subfolders append to the same files_list (a new
+        FileManifest by default) rather than merging lists on the way up. """
+        if files_list is None:
+            files_list = FileManifest()
+        folder_name = normalize_name(folder['name'])
         new_parent_folder_local_path = os.path.join(parent_folder_local_path, folder_name)
         folder_id = folder['id'] 
         kwargs = {
@@ -421,40 +574,34 @@ class GoogleToSharePoint(BaseUtil):
                 'supportsTeamDrives': True,
                 'includeTeamDriveItems': True, 
                 'includeItemsFromAllDrives': True, 
-                'fields': 'files(id,name,kind,size,mimeType,exportLinks)'
+                'fields': 'nextPageToken,files(id,name,size,md5Checksum,modifiedTime,mimeType,exportLinks)'
             } 
         children_files = self.getlist(
             entity='files', 
             query=f"'{folder_id}' in parents and trashed = false and mimeType != '{self.folder_type}'",
             **kwargs)['files']  
-        for chfi in children_files:
-            if self.file_is_migratable(chfi):
-                self.total_migratable_files += 1
-                chfi['parent_folder_local_path'] = new_parent_folder_local_path
-                chfi['name'] = f'{chfi["name"]}{self.get_o365_extension_from_file_mimetype(chfi["mimeType"])}'                   
-                files_list.append(chfi)   
-            else:
-                self.unmigratable_files.append(chfi)
         children_folders = self.getlist(
             entity='files', 
             query=f"'{folder_id}' in parents and trashed = false and mimeType = '{self.folder_type}'",
             **kwargs)['files']     
+        self._add_scanned_files(children_files, new_parent_folder_local_path, files_list, children_folders)
         with ThreadPoolExecutor(max_workers=MAX_LIST_THREADS) as executor: 
             futures = [
                 executor.submit(
                     self._get_flattened_files_list_in_folder,
                     f, 
-                    new_parent_folder_local_path
+                    new_parent_folder_local_path,
+                    files_list
                     ) for f in children_folders
                     ] 
             for future in wait(futures).done:
-                files_list.extend(future.result()) 
+                future.result()
         return files_list 
 
     def _get_flattened_files_list_in_drive(self, drive_id: str = ''): 
         """ Traverse entire recursive hierarchy in drive and build/return a flattened
         list of files within; similar to get_flattened_files_list_in_folder but starts at the drive level """
-        files_list = []
+        files_list = FileManifest()
         drive_children = self.get_children_from_drive(drive_id)
         files, folders = drive_children['files'], drive_children['folders']  
         self.debug({
@@ -463,52 +610,85 @@ class GoogleToSharePoint(BaseUtil):
                 'num_children_files': len(files),
                 'num_children_folders': len(folders)
             }})  
-        for f in files:
-            if self.file_is_migratable(f):
-                self.total_migratable_files += 1
-                f['parent_folder_local_path'] =  self.local_temp_dir
-                f['name'] = f'{f["name"]}{self.get_o365_extension_from_file_mimetype(f["mimeType"])}' 
-                files_list.append(f)  
-            else:
-                self.unmigratable_files.append(f)
+        self._add_scanned_files(files, self.local_temp_dir, files_list, folders)
         with ThreadPoolExecutor(max_workers=MAX_LIST_THREADS) as executor: 
             futures = [
-                executor.submit(self._get_flattened_files_list_in_folder, f, self.local_temp_dir) for f in folders]   
+                executor.submit(self._get_flattened_files_list_in_folder, f, self.local_temp_dir, files_list)
+                for f in folders]   
             for future in wait(futures, return_when=ALL_COMPLETED).done: 
-                files_list.extend(future.result()) # extend for one long flat list of files.
+                future.result()
         return files_list   
  
-    def _file_already_migrated(self, file: dict = {}, target_files_dict: list = []): 
-        """ return whether file has already been migrated. if
-        it is already migrated then there should be a key in the target files dict with format:
-        f'PARENT<{local_folder_base_path}>PARENT--FILENAME<{f["name"]}>FILENAME'
-        with the same parent folder local path and the same name. Obviously 
-        cannot use IDs for comparison since Google and SPO/OneDrive do not share unique ids. """ 
-        already_migrated = False 
-        name, parent_folder_local_path = file['name'], file['parent_folder_local_path']
-        name = sanitize(name) 
-        key = f'PARENT<{parent_folder_local_path}>PARENT--FILENAME<{name}>FILENAME'
-        already_migrated = key in target_files_dict 
-        if already_migrated:
-            self.info(f'{file["name"]} already migrated.')
-            self.num_files_already_in_destination += 1 
-        return already_migrated
-
-    def _exclude_files_already_migrated_from_source_file_list(self, 
-        source_file_list: list = []):  
-        """ Do not re-migrate files that are already in the target. 
-        Obtain a list of what's in the target. Exclude those from current list
-        files to migrate. """
-        target_files_dict = self.uploader.get_flattened_files_dict_in_remote_folder(
-            local_folder_base_path=self.local_temp_dir
-        ) 
-        self.info({'_exclude_files_already_migrated_from_source_file_list': {
-            'target_files_dict_already_uploaded': target_files_dict
+    def _get_transferred_hashes(self):
+        """ {file id: (md5Checksum, quickXorHash)} of the files transferred by
+        earlier runs of this migration, as recorded in the MigrationFile table """
+        return {
+            google_id: (md5_checksum, quick_xor_hash)
+            for google_id, md5_checksum, quick_xor_hash in self.migration.migratable_files.exclude(
+                quick_xor_hash='').values_list('google_id', 'md5_checksum', 'quick_xor_hash').iterator(
+                    chunk_size=SCAN_RESULT_BULK_CREATE_BATCH_SIZE)
+        }
+
+    def _record_transferred_hashes(self, hashes: dict = {}):
+        """ Record the quickXorHash of each transferred file ({file id: hash})
+        for the transfer plan of the next scan """
+        if not hashes:
+            return
+        if self._deferred_hashes is not None:
+            # scan_and_migrate(): the scanned files are saved when the scan ends
+            self._deferred_hashes.update(hashes)
+            return
+        try:
+            files = list(self.migration.migratable_files.filter(google_id__in=list(hashes)))
+            for f in files:
+                f.quick_xor_hash = hashes[f.google_id]
+            MigrationFile.objects.bulk_update(
+                files, ['quick_xor_hash'], batch_size=SCAN_RESULT_BULK_CREATE_BATCH_SIZE)
+        except Exception as e:
+            self.error({'_record_transferred_hashes': {'error': str(e)}})
+
+    def _resolve_destination_names(self, source_file_list: list = []):
+        """ Resolve name collisions and over-long paths of the scanned files
+        before they are compared with the destination (see naming.py) """
+        self.name_plan = NamePlan(source_file_list, base_path=self.local_temp_dir)
+        self.name_plan.apply(source_file_list)
+        if self.name_plan.renamed:
+            self.info({'_resolve_destination_names': {'renamed': [
+                os.path.join(f['parent_folder_local_path'], f['name'])
+                for f in map(source_file_list.__getitem__, self.name_plan.renamed)]}})
+        if self.name_plan.too_long:
+            self.error({'_resolve_destination_names': {'path_too_long': [
+                os.path.join(f['parent_folder_local_path'], f['name'])
+                for f in map(source_file_list.__getitem__, self.name_plan.too_long)]}})
+
+    def _get_destination_files(self):
+        """ PathIndex of the files already in the destination (see pathindex.py) """
+        return self.uploader.get_remote_path_index(local_folder_base_path=self.local_temp_dir)
+
+    def _plan_transfer(self, source_file_list: list = [], transferred: dict = None,
+                       destination_files: PathIndex = None):
+        """ Compare the scanned files with what is already in the destination
+        (see transferplan.py) and return the new and changed files. The plan is
+        kept in self.transfer_plan. Google and SPO/OneDrive do not share ids, so
+        files are matched by parent folder local path and name, once their
+        destination names are resolved. transferred defaults to
+        _get_transferred_hashes() and destination_files to _get_destination_files(). """
+        self._resolve_destination_names(source_file_list)
+        if destination_files is None:
+            destination_files = self._get_destination_files()
+        if transferred is None:
+            transferred = self._get_transferred_hashes()
+        self.transfer_plan = TransferPlan(
+            files_list=source_file_list, destination_files=destination_files, transferred=transferred)
+        self.num_files_already_in_destination = len(self.transfer_plan.files[UNCHANGED])
+        if self.transfer_plan.deleted_at_source:
+            self.info({'_plan_transfer': {'deleted_at_source': [
+                os.path.join(f['parent_folder_local_path'], f['name']) for f in self.transfer_plan.deleted_at_source]}})
+        self.info({'_plan_transfer': {
+            'num_files_in_destination': len(destination_files),
+            **self.transfer_plan.summary()
         }})
-        return [
-            f for f in source_file_list if not self._file_already_migrated(
-                file=f, target_files_dict=target_files_dict)
-        ]
+        return self.transfer_plan.files_to_transfer
 
     def _migrate_files_list(self, flattened_files_list: list = []):
         """ Download a shared drive recursively. """
@@ -517,26 +697,70 @@ class GoogleToSharePoint(BaseUtil):
             files_list=flattened_files_list
             )
 
-    def _scan_shared_drive(self):
-        """ Scan (do not download/migrate) a shared drive recursively. """
-        self.debug({'_scan_shared_drive': self.migration.source_id}) 
-        google_files_list = self._get_flattened_files_list_in_drive(drive_id=self.migration.source_id)  
-        google_files_list = self._exclude_files_already_migrated_from_source_file_list(
-            google_files_list
-            )
-        return google_files_list
+    def _scan_source_and_destination(self, crawl_source):
+        """ Crawl the source with crawl_source() while the destination is
+        listed in another thread (the two use different APIs and quotas), then
+        plan the transfer from both """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            destination_files = executor.submit(self._get_destination_files)
+            google_files_list = crawl_source()
+            return self._plan_transfer(google_files_list, destination_files=destination_files.result())
 
-    def _scan_folder(self):
-        """ Scan (do not download/migrate) a folder recursively. """
-        self.info({'_scan_folder': self.migration.source_id})
-        google_files_list = self._get_flattened_files_list_in_folder(
+    def _crawl_source(self):
+        """ Flattened list of the migratable files in the migration source """
+        if self.migration.source_type == 'shared_drive':
+            return self._get_flattened_files_list_in_drive(drive_id=self.migration.source_id)
+        return self._get_flattened_files_list_in_folder(
             folder=self.migration.google_source['details'],
-            parent_folder_local_path=self.local_temp_dir
-            )
-        google_files_list = self._exclude_files_already_migrated_from_source_file_list(
-            google_files_list
-        ) 
-        return google_files_list
+            parent_folder_local_path=self.local_temp_dir)
+
+    def _scan_into_stream(self, stream: ScanStream = None, on_done=None):
+        """ Crawl the source into stream (see scanstream.py) while the
+        destination is listed in another thread, then call on_done() """
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                destination = executor.submit(lambda: stream.set_destination_files(self._get_destination_files()))
+                self._crawl_source()
+                destination.result()
+        finally:
+            on_done()
+
+    def _scan_and_migrate_files(self, transferred: dict = {}):
+        """ Scan the source in another thread and transfer the files to
+        transfer in batches as the scan queues them. Return the ScanStream. """
+        files_queue = queue.Queue()
+
+        def put(files):
+            for f in files:
+                files_queue.put(f)
+
+        stream = ScanStream(downloader=self, transferred=transferred, put=put)
+        self.on_folder_scanned = stream.add_folder
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            scan = executor.submit(self._scan_into_stream, stream, lambda: files_queue.put(None))
+            retransfer = []
+            while True:
+                # wait for a file, then take up to a batch of those queued
+                batch = []
+                f = files_queue.get()
+                while f is not None:
+                    batch.append(f)
+                    if len(batch) == self.file_batch_size:
+                        break
+                    try:
+                        f = files_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    mismatched_ids = self._migrate_file_batch(batch)
+                    retransfer.extend(file for file in batch if file['id'] in mismatched_ids)
+                if f is None:
+                    break
+            scan.result()
+        if retransfer:
+            self.info({'_scan_and_migrate_files': {'hash_mismatches_to_retransfer': len(retransfer)}})
+            self._migrate_files_list_in_batches(files_list=retransfer, attempts=1)
+        return stream
 
     def _download_file_batch(self, files_list : list = []):
         self.info({'_download_file_batch': 'starting download threadpool'})
@@ -545,29 +769,86 @@ class GoogleToSharePoint(BaseUtil):
             for fut in wait(futures, return_when=ALL_COMPLETED).done:
                 self.info({'_download_file_batch': f'File downloaded: {fut.result()["name"]}'})
 
-    def _migrate_files_list_in_batches(self, files_list: list = []):
-        while len(files_list) > 0: 
-            self.debug({'_migrate_files_list_in_batches': f'files_still_left,progress={self.get_progress()}'})
-            batch = self._get_batch_for_download_from_files_list(
-                files_list=files_list
-            ) # pops batch_size items from list at a time which prevents infinite loop.
-            self.debug({'_migrate_files_list_in_batches': f'collected batch of {len(batch)} files; starting download'})
-            self._download_file_batch(batch)
-            self.debug({'_migrate_files_list_in_batches': f'batch download complete; starting SharePoint upload'})
-            self._upload_and_delete() 
+    def get_transfer_scheduler(self, files_list: list = []):
+        return TransferScheduler(files_list, policy=self.transfer_schedule, batch_size=self.file_batch_size)
+
+    def _create_destination_folders(self, files_list: list = []):
+        """ Create every destination folder the files will go in before the
+        first batch, so batch uploads go straight into known folder ids """
+        self.uploader.create_remote_folder_tree(
+            folder_paths={f['parent_folder_local_path'] for f in files_list},
+            base_path=self.local_temp_dir,
+            base_parent_id=self.uploader.get_upload_base_folder_id())
+
+    def _migrate_file_batch(self, files_list: list = []):
+        """ Transfer one batch of scanned files. Return the ids of those whose
+        upload did not match the download. """
+        if PRECREATE_FOLDERS:
+            self._create_destination_folders(files_list)
+        if DEDUPLICATE:
+            files_list, self._duplicates = group_duplicates(files_list)
+        self._download_file_batch(files_list)
+        return {record.source_id for record in self._upload_and_delete()}
+
+    def _migrate_files_list_in_batches(self, files_list: list = [], attempts: int = 2):
+        if PRECREATE_FOLDERS and files_list:
+            self._create_destination_folders(files_list)
+        # files whose upload did not match the download get one more transfer
+        for attempt in range(attempts):
+            retransfer = []
+            mismatched_ids = set()
+            attempt_files = files_list
+            if DEDUPLICATE:
+                files_list, self._duplicates = group_duplicates(files_list)
+            scheduler = self.get_transfer_scheduler(files_list)
+            while len(scheduler) > 0: 
+                self.debug({'_migrate_files_list_in_batches': f'files_still_left,progress={self.get_progress()}'})
+                self.info(f'getting {scheduler.policy} batch for download from {len(scheduler)} remaining files')
+                batch = scheduler.next_batch()
+                self.debug({'_migrate_files_list_in_batches': f'collected batch of {len(batch)} files; starting download'})
+                self._download_file_batch(batch)
+                self.debug({'_migrate_files_list_in_batches': f'batch download complete; starting SharePoint upload'})
+                mismatched_ids.update(record.source_id for record in self._upload_and_delete())
+            # duplicates are not in the batches but may be mismatched too
+            if mismatched_ids:
+                retransfer = [f for f in attempt_files if f['id'] in mismatched_ids]
+            if not retransfer:
+                break
+            if attempt + 1 < attempts:
+                self.info({'_migrate_files_list_in_batches': {'hash_mismatches_to_retransfer': len(retransfer)}})
+            files_list = retransfer
+        else:
+            self.error({'_migrate_files_list_in_batches': {
+                'hash_mismatch_after_retransfer': [f['name'] for f in retransfer]}})
+            self.uploader._num_failed += len(retransfer)
         return True
 
+    def _get_scanned_files_list(self):
+        """ Load the migratable files found by scan() from the MigrationFile table
+        into a FileManifest. Scans saved before the table existed kept the list
+        in the JSON scan result. """
+        scan_result = self.migration.source_data_scan_result
+        if 'migratable_files_list' in scan_result:
+            return FileManifest(scan_result['migratable_files_list'])
+        return FileManifest(
+            f.to_drive_file() for f in self.migration.files_to_transfer.order_by('id').iterator(
+                chunk_size=SCAN_RESULT_BULK_CREATE_BATCH_SIZE)
+        )
+
     def migrate(self):
-        """ Must be called after scan has run. Scan populates self.migration.source_data_scan_result """
+        """ Must be called after scan has run. Scan populates self.migration.files """
         self.info({'migrate': {'status': 'starting'}})
-        migrate_files = self.migration.source_data_scan_result['migratable_files_list']
-        # COPY LIST. Otherwise the database value itself changes (list items get popped.)
-        migrate_files_copy = migrate_files.copy()  
-        self.total_migratable_files = len(migrate_files_copy)
-        response = self._migrate_files_list(
-            flattened_files_list=migrate_files_copy
-        )
+        self.tracer.reset()
+        migrate_files = self._get_scanned_files_list()
+        self.total_migratable_files = len(migrate_files)
+        if self.engine == 'asyncio':
+            response = AsyncTransferEngine(downloader=self).migrate(files_list=migrate_files)
+        else:
+            response = self._migrate_files_list(
+                flattened_files_list=migrate_files
+            )
         self.info({'migrate':{'status': 'complete', 'response': response}})
+        self.export_latency_breakdown(phase='migrate')
         return response 
     
     def _get_total_file_size_from_files_list(self, files_list):
@@ -577,23 +858,102 @@ class GoogleToSharePoint(BaseUtil):
                 size += int(f['size'])
         return self.convert_size(size)
 
+    def export_latency_breakdown(self, phase: str = 'migrate'):
+        """ Write the spans recorded during scan() or migrate() to the migration log
+        folder (which is uploaded to the destination with the logs) and log a summary """
+        if not self.tracer.enabled:
+            return None
+        try:
+            os.makedirs(self.log_folder_path, exist_ok=True)
+            path = self.tracer.export(os.path.join(self.log_folder_path, f'latency-breakdown-{phase}.json'))
+            self.info(f'{phase} latency breakdown ({path}):\n{self.tracer.format_breakdown()}')
+            return path
+        except Exception as e:
+            self.error({'export_latency_breakdown': {'error': str(e)}})
+            return None
+
+    def _save_scan_result(self, files_list: list = [], scan_response: dict = {}):
+        """ Write the scanned files to the MigrationFile table with bulk inserts and 
+        keep only the summary stats on the migration row. Replaces any previous scan.
+        Files the transfer plan found unchanged are kept too, with their recorded hashes. """
+        unchanged_files = self.transfer_plan.files[UNCHANGED] if self.transfer_plan else []
+        scanned_files = itertools.chain(
+            (MigrationFile.from_drive_file(migration=self.migration, file=f, migratable=True)
+             for f in itertools.chain(files_list, unchanged_files)),
+            (MigrationFile.from_drive_file(migration=self.migration, file=f, migratable=False)
+             for f in self.unmigratable_files))
+        with transaction.atomic():
+            self.migration.files.all().delete()
+            # a batch of model instances at a time, not one per scanned file
+            while True:
+                batch = list(itertools.islice(scanned_files, SCAN_RESULT_BULK_CREATE_BATCH_SIZE))
+                if not batch:
+                    break
+                MigrationFile.objects.bulk_create(batch)
+            self.migration.source_data_scan_result = scan_response
+            self.migration.save(update_fields=['source_data_scan_result', 'lastmod'])
+
     def scan(self):
-        self.info({'scan': {'status': 'starting'}})
-        if self.migration.source_type == 'shared_drive':
-            files_list = self._scan_shared_drive()
-        elif self.migration.source_type == 'folder':
-            files_list = self._scan_folder()
+        self.info({'scan': {
+            'status': 'starting', 'engine': self.engine, 'source_type': self.migration.source_type,
+            'source_id': self.migration.source_id}})
+        self.tracer.reset()
+        self.transfer_plan = None
+        self.name_plan = None
+        if self.engine == 'asyncio':
+            files_list = AsyncTransferEngine(downloader=self).scan()
+        else:
+            files_list = self._scan_source_and_destination(self._crawl_source)
+        scan_response = self._get_scan_response(files_list)
+        if self.name_plan:
+            scan_response['destination_names'] = self.name_plan.summary()
+        self._save_scan_result(files_list=files_list, scan_response=scan_response)
+        self.info({'scan': {'status': 'complete', 'response': scan_response}})
+        self.export_latency_breakdown(phase='scan')
+        return scan_response
+
+    def _get_scan_response(self, files_list: list = []):
+        """ Summary stats of a scan whose files to transfer are files_list """
         scan_response = {
-            'migratable_files_list': files_list,
             'total_migratable_size': self._get_total_file_size_from_files_list(files_list),
             'total_migratable_count': len(files_list),
-            'unmigratable_files_list': self.unmigratable_files,
             'total_unmigratable_size': self._get_total_file_size_from_files_list(self.unmigratable_files),
             'total_unmigratable_count': len(self.unmigratable_files)
         }
-        self.migration.source_data_scan_result =  scan_response
-        self.migration.save()
-        self.info({'scan': {'status': 'complete', 'response': scan_response}})
+        if self.transfer_plan:
+            scan_response['transfer_plan'] = self.transfer_plan.summary()
+        return scan_response
+
+    def scan_and_migrate(self):
+        """ scan() and migrate() in one pass: each folder's new and changed
+        files are transferred as soon as the scan lists it, and the progress
+        totals grow as the scan goes on (see scanstream.py). The scan result is
+        saved when the scan ends. Return the scan response. """
+        self.info({'scan_and_migrate': {'status': 'starting', 'engine': self.engine}})
+        self.tracer.reset()
+        self.transfer_plan = None
+        self.name_plan = None
+        self.total_migratable_files = 0
+        self._deferred_hashes = {}
+        transferred = self._get_transferred_hashes()
+        try:
+            if self.engine == 'asyncio':
+                stream = AsyncTransferEngine(downloader=self).scan_and_migrate(transferred=transferred)
+            else:
+                stream = self._scan_and_migrate_files(transferred=transferred)
+        finally:
+            self.on_folder_scanned = None
+            hashes, self._deferred_hashes = self._deferred_hashes, None
+        if self.transfer_plan.deleted_at_source:
+            self.info({'scan_and_migrate': {'deleted_at_source': [
+                os.path.join(f['parent_folder_local_path'], f['name']) for f in self.transfer_plan.deleted_at_source]}})
+        files_list = self.transfer_plan.files_to_transfer
+        scan_response = self._get_scan_response(files_list)
+        scan_response['destination_names'] = stream.summary()
+        self._save_scan_result(files_list=files_list, scan_response=scan_response)
+        self._record_transferred_hashes(hashes)
+        self.info({'scan_and_migrate': {'status': 'complete', 'response': scan_response}})
+        self.export_latency_breakdown(phase='scan_and_migrate')
         return scan_response 
 
     
\ No newline at end of file
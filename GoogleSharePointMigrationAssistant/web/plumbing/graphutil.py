@@ -5,12 +5,14 @@ from .constants import (
     GRAPH_SLEEP_RETRY_SECONDS
 )
 from .m365_util import get_token_from_cache
+from .tracing import current_span, get_url_attribute, traced
 import requests
 import time
 
 class GraphUtil():
     """ Abstract class offering basic graph API http methods GET, POST, PUT 
     which parameterize the URLs and the data """
+    @traced('graph_get', lambda a: {'url': get_url_attribute(a['url'])})
     @sleep_and_retry
     @limits(calls=MAX_GRAPH_REQUESTS_PER_MINUTE, period=ONE_MINUTE)
     def graph_get(self, url: str = '', headers: dict = {}):
@@ -25,6 +27,7 @@ class GraphUtil():
                 url=url,
                 headers=use_headers
             )
+            current_span().set_attribute('http.status_code', response.status_code)
             response_data = response.json()
             msg = {
                 'graph_get': {
@@ -40,7 +43,8 @@ class GraphUtil():
                 self.debug(msg)
         except requests.exceptions.ConnectTimeout as etimeout:
             self.error({'graph_get': {'TimeoutError': str(
-                econnerror), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+                etimeout), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
             response_data = self.graph_get(url=url, headers=headers)
         except (
@@ -51,13 +55,18 @@ class GraphUtil():
         ) as econnerror:
             self.error({'graph_get': {'ConnectionErrorOrProtocolError': str(
                 econnerror), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
             response_data = self.graph_get(url=url, headers=headers)
         return response_data
 
+    @traced('graph_put', lambda a: {'url': get_url_attribute(a['url'])})
     @sleep_and_retry
     @limits(calls=MAX_GRAPH_REQUESTS_PER_MINUTE, period=ONE_MINUTE)
-    def graph_put(self, url: str = '', headers: dict = {}, data=None):
+    def graph_put(self, url: str = '', headers: dict = {}, data=None, accept_status_codes: tuple = ()):
+        """ PUT data to url. Returns the response JSON, or None on failure.
+        Responses with a status in accept_status_codes (e.g. 409 for a
+        conflictBehavior=fail upload) are returned rather than logged as errors. """
         response = None
         token = get_token_from_cache(m365_token_cache=self.m365_token_cache)
         use_headers = headers if headers else {
@@ -70,6 +79,9 @@ class GraphUtil():
                 headers=use_headers,
                 data=data
             )
+            if isinstance(data, bytes):
+                current_span().set_attribute('bytes', len(data))
+            current_span().set_attribute('http.status_code', response.status_code)
             response_data = response.json()
             msg = {
                 'graph_put': {
@@ -79,16 +91,21 @@ class GraphUtil():
                     'payload': data
                 }
             }
-            if response.status_code not in [200, 201, 202]:
+            if response.status_code in accept_status_codes:
+                self.debug(msg)
+            elif response.status_code not in [200, 201, 202]:
                 self.error(msg)
                 return None
             else:
-                self.debug(msg)
+                # one record per upload chunk is too many; sample those
+                self.debug(msg, sample='graph_put.chunk' if isinstance(data, bytes) else None)
         except requests.exceptions.ConnectTimeout as etimeout:
             self.error({'graph_put': {'TimeoutError': str(
                 etimeout), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
-            response_data = self.graph_put(url=url, headers=headers, data=data)
+            response_data = self.graph_put(
+                url=url, headers=headers, data=data, accept_status_codes=accept_status_codes)
         except (
             requests.exceptions.ConnectionError,
             # handle Connection aborted, RemoteDisconnected
@@ -97,13 +114,19 @@ class GraphUtil():
         ) as econnerror:
             self.error({'graph_put': {'ConnectionErrorOrProtocolError': str(
                 econnerror), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
-            response_data= self.graph_put(url=url, headers=headers, data=data)
+            response_data = self.graph_put(
+                url=url, headers=headers, data=data, accept_status_codes=accept_status_codes)
         return response_data
 
+    @traced('graph_post', lambda a: {'url': get_url_attribute(a['url'])})
     @sleep_and_retry
     @limits(calls=MAX_GRAPH_REQUESTS_PER_MINUTE, period=ONE_MINUTE)
-    def graph_post(self, url: str = '', headers: dict = {}, data = None):
+    def graph_post(self, url: str = '', headers: dict = {}, data = None, accept_status_codes: tuple = ()):
+        """ POST data to url. Returns the response JSON, or None on failure.
+        Responses with a status in accept_status_codes (e.g. 409 for a
+        conflictBehavior=fail folder create) are returned rather than logged as errors. """
         response = None
         token = get_token_from_cache(m365_token_cache=self.m365_token_cache)
         use_headers = headers if headers else {
@@ -116,6 +139,9 @@ class GraphUtil():
                 headers=use_headers,
                 data=data
             )
+            if isinstance(data, bytes):
+                current_span().set_attribute('bytes', len(data))
+            current_span().set_attribute('http.status_code', response.status_code)
             response_data = response.json()
             msg = {
                 'graph_post': {
@@ -125,7 +151,9 @@ class GraphUtil():
                     'payload': data
                 }
             }
-            if response.status_code not in [200, 201, 202]:
+            if response.status_code in accept_status_codes:
+                self.debug(msg)
+            elif response.status_code not in [200, 201, 202]:
                 self.error(msg)
                 return None
             else:
@@ -133,8 +161,10 @@ class GraphUtil():
         except requests.exceptions.ConnectTimeout as etimeout:
             self.error({'graph_post': {'TimeoutError': str(
                 etimeout), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
-            response_data = self.graph_post(url=url, headers=headers, data=data)
+            response_data = self.graph_post(
+                url=url, headers=headers, data=data, accept_status_codes=accept_status_codes)
         except (
             requests.exceptions.ConnectionError,
             # handle Connection aborted, RemoteDisconnected
@@ -143,6 +173,38 @@ class GraphUtil():
         ) as econnerror:
             self.error({'graph_post': {'ConnectionErrorOrProtocolError': str(
                 econnerror), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
+            time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
+            response_data = self.graph_post(
+                url=url, headers=headers, data=data, accept_status_codes=accept_status_codes)
+        return response_data
+
+    @traced('graph_delete', lambda a: {'url': get_url_attribute(a['url'])})
+    @sleep_and_retry
+    @limits(calls=MAX_GRAPH_REQUESTS_PER_MINUTE, period=ONE_MINUTE)
+    def graph_delete(self, url: str = ''):
+        """ DELETE url. Returns True if deleted (204) or already gone (404) """
+        token = get_token_from_cache(m365_token_cache=self.m365_token_cache)
+        try:
+            response = requests.delete(
+                url=url,
+                headers={'Authorization': f'Bearer {token["access_token"]}'}
+            )
+            current_span().set_attribute('http.status_code', response.status_code)
+            msg = {'graph_delete': {'status_code': response.status_code, 'url': url}}
+            if response.status_code not in [204, 404]:
+                self.error(msg)
+                return False
+            self.debug(msg)
+            return True
+        except (
+            requests.exceptions.ConnectionError,
+            # handle Connection aborted, RemoteDisconnected
+            # ref: https://github.com/urllib3/urllib3/issues/1327
+            ProtocolError
+        ) as econnerror:
+            self.error({'graph_delete': {'ConnectionErrorOrProtocolError': str(
+                econnerror), 'url': url, 'sleeping_for': f'{GRAPH_SLEEP_RETRY_SECONDS}s'}})
+            current_span().increment('retries')
             time.sleep(GRAPH_SLEEP_RETRY_SECONDS)
-            response_data = self.graph_post(url=url, headers=headers, data=data)
-        return response_data
\ No newline at end of file
+            return self.graph_delete(url=url)
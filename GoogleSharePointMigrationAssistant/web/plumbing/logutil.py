@@ -0,0 +1,138 @@
+""" Structured, cheap log messages for BaseUtil. Messages (usually dicts)
+are wrapped in a LogMessage: a redacted, size-capped copy is taken when the
+record is created and JSON is only rendered when a handler emits it, on the
+QueueListener thread. Secrets and binary payloads never reach the log, and a
+log call costs a bounded amount of CPU and disk whatever it was given. """
+import atexit
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from .constants import (
+    LOG_MAX_VALUE_LENGTH, LOG_MAX_LIST_ITEMS, LOG_MAX_MESSAGE_LENGTH, LOG_REDACTED_KEYS
+)
+
+
+def _truncate(text: str = '', limit: int = LOG_MAX_VALUE_LENGTH):
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}...<{len(text) - limit} more chars>'
+
+
+def redact(value=None, depth: int = 0):
+    """ Copy of value that is safe and cheap to log. Secrets (by key) are
+    masked, binary payloads are replaced by their length, long strings and
+    containers are truncated. """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str):
+        return _truncate(value)
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if depth > 6:
+        return '<nested>'
+    if isinstance(value, dict):
+        redacted = {}
+        for i, (k, v) in enumerate(value.items()):
+            if i == LOG_MAX_LIST_ITEMS:
+                redacted['...'] = f'<{len(value) - i} more keys>'
+                break
+            if str(k).lower() in LOG_REDACTED_KEYS:
+                redacted[k] = '<redacted>'
+            else:
+                redacted[k] = redact(v, depth + 1)
+        return redacted
+    if isinstance(value, (list, tuple, set)):
+        items = [redact(v, depth + 1) for v in list(value)[:LOG_MAX_LIST_ITEMS]]
+        if len(value) > LOG_MAX_LIST_ITEMS:
+            items.append(f'<{len(value) - LOG_MAX_LIST_ITEMS} more items>')
+        return items
+    return _truncate(str(value))
+
+
+class LogMessage:
+    """ Deferred message. The (bounded) redacted copy is taken in the logging
+    thread, so later mutation of the logged dict cannot race the listener;
+    JSON encoding happens in str(), on the listener thread, once. """
+    __slots__ = ('msg', '_rendered')
+
+    def __init__(self, msg=None):
+        if callable(msg):
+            msg = msg()
+        self.msg = redact(msg) if isinstance(msg, (dict, list, tuple)) else msg
+        self._rendered = None
+
+    def __str__(self):
+        if self._rendered is None:
+            if isinstance(self.msg, (dict, list)):
+                rendered = json.dumps(self.msg, default=str)
+            else:
+                rendered = str(self.msg)
+            self._rendered = _truncate(rendered, LOG_MAX_MESSAGE_LENGTH)
+            self.msg = None
+        return self._rendered
+
+
+class DeferredQueueHandler(QueueHandler):
+    """ QueueHandler that leaves formatting to the listener thread. The stock
+    prepare() formats the record in the logging thread, which is the cost we
+    are trying to move off the hot path. """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks cannot outlive the frame; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class Sampler:
+    """ Thread-safe 1-in-N sampler per event name; the first occurrence is always kept """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: str = '', every: int = 1):
+        with self._lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        return count % every == 0
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def attach_queue_listener(logger: logging.Logger = None, handlers: list = []):
+    """ Route logger through a queue to handlers, serviced by a QueueListener
+    thread. Replaces a listener previously attached to the same logger. """
+    detach_queue_listener(logger)
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    with _listeners_lock:
+        _listeners[logger.name] = (queue_handler, listener, handlers)
+    logger.addHandler(queue_handler)
+    listener.start()
+    return listener
+
+
+def detach_queue_listener(logger: logging.Logger = None):
+    """ Flush and stop the logger's listener and close its handlers """
+    with _listeners_lock:
+        attached = _listeners.pop(logger.name, None)
+    if attached is None:
+        return
+    queue_handler, listener, handlers = attached
+    logger.removeHandler(queue_handler)
+    listener.stop()
+    for handler in handlers:
+        handler.close()
+
+
+@atexit.register
+def _stop_queue_listeners():
+    for name in list(_listeners):
+        detach_queue_listener(logging.getLogger(name))
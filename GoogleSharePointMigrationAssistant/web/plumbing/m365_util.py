@@ -1,6 +1,6 @@
 """ Utility methods used by Views """
 from msal import ConfidentialClientApplication, SerializableTokenCache
-from django.core.cache import cache as django_cache
+from django.core.cache import cache as django_cache, caches
 from django.conf import settings
 from django.http import HttpRequest
 from django.shortcuts import redirect
@@ -125,211 +125,155 @@ def get_user_profile(request):
         logger.debug(msg)
     return data
 
-def get_user_onedrive_item_by_id(request, item_id):
-    if f'user_onedrive_folder_{item_id}' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/me/drive/items/{item_id}',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_user_onedrive_root_children_response': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        request.session[f'user_onedrive_folder_{item_id}'] = data
-    else:
-        data = request.session.get(f'user_onedrive_folder_{item_id}')
-    return data 
+# Graph browse lookups (destination pickers). Lookups are cached per tenant and shared by all of its users, who must
+# each pass a cheap access check before being served an entry. Results that depend on who is asking (/me, site search)
+# are cached per user.
+GRAPH_LOOKUP_KINDS = [
+    'onedrive_item', 'onedrive_root_children', 'sharepoint_sites', 'sharepoint_site',
+    'sharepoint_site_document_libraries', 'sharepoint_doclib', 'sharepoint_doclib_item',
+    'sharepoint_doclib_children'
+]
 
-def get_user_onedrive_root_children(request):
-    if 'user_onedrive_root_children' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/me/drive/root/children',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_user_onedrive_root_children_response': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        data = data['value']
-        request.session['user_onedrive_root_children'] = data
 
-    else:
-        data = request.session.get('user_onedrive_root_children')
-    return data
+def get_graph_lookup_cache():
+    return caches['graph_lookups']
 
 
-def get_user_sharepoint_sites(request, site_filter=''):
-    """ Allow user to search for sharepoint site. If no site_filter provided, pulls last query result from session.  """
-    if 'sharepoint_sites' not in request.session or site_filter:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/sites?$search={site_filter}',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_user_sharepoint_sites': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
+def get_graph_lookup_cache_key(request, kind: str = '', resource: str = '', per_user: bool = False):
+    """ graph-lookup:<tenant>[:<user>]:<kind>:<resource> """
+    config = django_cache.get('config', AdministrationSettings.objects.first())
+    django_cache.set('config', config)
+    scope = f'{config.azure_ad_tenant_id}:{request.user.pk}' if per_user else config.azure_ad_tenant_id
+    return f'{scope}:{kind}:{quote(resource)}'
+
+
+def _record_graph_lookup(cache, kind: str = '', outcome: str = 'hits'):
+    key = f'stats:{kind}:{outcome}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired/evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def get_graph_lookup_cache_stats():
+    """ hits, misses and hit rate per lookup kind and in total """
+    cache = get_graph_lookup_cache()
+    counts = cache.get_many([
+        f'stats:{kind}:{outcome}' for kind in GRAPH_LOOKUP_KINDS for outcome in ['hits', 'misses']])
+    stats = {}
+    for kind in GRAPH_LOOKUP_KINDS + ['total']:
+        if kind == 'total':
+            hits = sum(s['hits'] for s in stats.values())
+            misses = sum(s['misses'] for s in stats.values())
         else:
-            logger.debug(msg)
-        data = data['value']
-        request.session['sharepoint_sites'] = data
-    else:
-        data = request.session.get('sharepoint_sites')
+            hits = counts.get(f'stats:{kind}:hits', 0)
+            misses = counts.get(f'stats:{kind}:misses', 0)
+        stats[kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None
+        }
+    return stats
 
-    return data
 
-def get_sharepoint_site_by_id(request, site_id):
-    """ Allow user to search for sharepoint site. If no site_filter provided, pulls last query result from session.  """
-    if f'sharepoint_site_{site_id}' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/sites/{site_id}',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_site_by_id_response': {
-                'status_code': response.status_code,
-                'data': data
-            }
+def _has_graph_access(request, cache, resource: str = ''):
+    """ Whether the requesting user can read resource, from a GET of just its
+    id. Granted access is cached per user like the lookups themselves. """
+    key = get_graph_lookup_cache_key(request, kind='access', resource=resource, per_user=True)
+    if cache.get(key):
+        return True
+    result = get_token_from_request_session(request)
+    response = requests.get(
+        url=f'{settings.GRAPH_API_URL}/{resource}?$select=id',
+        headers={'Authorization': f'Bearer {result["access_token"]}'},
+    )
+    if response.status_code != 200:
+        logger.warning({'graph_access_check': {'status_code': response.status_code, 'resource': resource}})
+        return False
+    cache.set(key, True)
+    return True
+
+
+def graph_lookup(request, kind: str = '', resource: str = '', per_user: bool = False, value_list: bool = False,
+                 access_resource: str = ''):
+    """ GET {GRAPH_API_URL}/{resource} through the graph_lookups cache, which
+    expires entries after GRAPH_LOOKUP_CACHE_TTL seconds. Failed requests
+    are logged and not cached. If value_list, return the 'value' list.
+    Entries shared by the tenant are only served to users who can read
+    access_resource (resource by default). """
+    cache = get_graph_lookup_cache()
+    key = get_graph_lookup_cache_key(request, kind=kind, resource=resource, per_user=per_user)
+    access_resource = access_resource or resource
+    data = cache.get(key)
+    if data is not None and (per_user or _has_graph_access(request, cache, resource=access_resource)):
+        _record_graph_lookup(cache, kind=kind, outcome='hits')
+        return data
+    if data is not None:
+        return None
+    _record_graph_lookup(cache, kind=kind, outcome='misses')
+    result = get_token_from_request_session(request)
+    response = requests.get(
+        url=f'{settings.GRAPH_API_URL}/{resource}',
+        headers={'Authorization': f'Bearer {result["access_token"]}'},
+    )
+    data = response.json()
+    msg = {
+        f'get_{kind}_response': {
+            'status_code': response.status_code,
+            'resource': resource,
+            'data': data
         }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        request.session[f'sharepoint_site_{site_id}'] = data
+    }
+    if response.status_code != 200:
+        logger.error(msg)
+        return None
     else:
-        data = request.session.get(f'sharepoint_site_{site_id}')
+        logger.debug(msg)
+    if value_list:
+        data = data['value']
+    cache.set(key, data)
+    if not per_user:
+        # the lookup itself shows this user has access
+        cache.set(get_graph_lookup_cache_key(request, kind='access', resource=access_resource, per_user=True), True)
     return data
 
+
+def get_user_onedrive_item_by_id(request, item_id):
+    return graph_lookup(request, kind='onedrive_item', resource=f'me/drive/items/{item_id}', per_user=True)
+
+def get_user_onedrive_root_children(request):
+    return graph_lookup(
+        request, kind='onedrive_root_children', resource='me/drive/root/children', per_user=True, value_list=True)
+
+
+def get_user_sharepoint_sites(request, site_filter=''):
+    """ Allow user to search for sharepoint site. Search results depend on the user's access, so are cached per user. """
+    return graph_lookup(
+        request, kind='sharepoint_sites', resource=f'sites?$search={site_filter}', per_user=True, value_list=True)
+
+def get_sharepoint_site_by_id(request, site_id):
+    return graph_lookup(request, kind='sharepoint_site', resource=f'sites/{site_id}')
+
 def get_sharepoint_doclib_by_id(request, doclib_id):
-    if f'sharepoint_doclib_{doclib_id}' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/drives/{doclib_id}',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_doclib_by_id_response': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        request.session[f'sharepoint_doclib_{doclib_id}'] = data
-    else:
-        data = request.session.get(f'sharepoint_doclib_{doclib_id}')
-    return data
+    return graph_lookup(request, kind='sharepoint_doclib', resource=f'drives/{doclib_id}')
 
 def get_sharepoint_doclib_item_by_id(request, doclib_id, item_id):
-    if f'sharepoint_doclib_{doclib_id}_item_{item_id}' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/drives/{doclib_id}/items/{item_id}',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_sharepoint_doclib_item_by_id_response': {
-                'status_code': response.status_code,
-                'doclib_id': doclib_id,
-                'item_id': item_id,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        request.session[f'sharepoint_doclib_{doclib_id}_item_{item_id}'] = data
-    else:
-        data = request.session.get(f'sharepoint_doclib_{doclib_id}_item_{item_id}')
-    return data
+    return graph_lookup(request, kind='sharepoint_doclib_item', resource=f'drives/{doclib_id}/items/{item_id}')
 
 def get_sharepoint_doclib_children_by_id(request, doclib_id):
     """ return children in root folder """
-    if f'sharepoint_doclib_{doclib_id}_children' not in request.session:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/drives/{doclib_id}/root/children',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_doclib_by_id_response': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        data = data['value']
-        request.session[f'sharepoint_doclib_{doclib_id}_children'] = data
-    else:
-        data = request.session.get(f'sharepoint_doclib_{doclib_id}_children')
-    return data
+    return graph_lookup(
+        request, kind='sharepoint_doclib_children', resource=f'drives/{doclib_id}/root/children', value_list=True,
+        access_resource=f'drives/{doclib_id}/root')
 
 
 def get_sharepoint_site_document_libraries(request, site_id=None):
-    """ Get document libraries for a site. If no site_id provided, use stored libraries in session. """
-    if 'sharepoint_document_libraries' not in request.session or site_id:
-        result = get_token_from_request_session(request)
-        response = requests.get(
-            url=f'{settings.GRAPH_API_URL}/sites/{site_id}/drives',
-            headers={'Authorization': f'Bearer {result["access_token"]}'},
-        )
-        data = response.json()
-        msg = {
-            'get_site_document_libraries': {
-                'status_code': response.status_code,
-                'data': data
-            }
-        }
-        if response.status_code != 200:
-            logger.error(msg)
-            return None
-        else:
-            logger.debug(msg)
-        data = data['value']
-        request.session['sharepoint_document_libraries'] = data
-    else:
-        data = request.session.get('sharepoint_document_libraries')
-    return data
+    """ Get document libraries for a site. """
+    return graph_lookup(
+        request, kind='sharepoint_site_document_libraries', resource=f'sites/{site_id}/drives', value_list=True,
+        access_resource=f'sites/{site_id}')
 
 ########################################
 # End Microsoft 365 Utility Functions #
@@ -0,0 +1,313 @@
+""" Compact, array-backed list of scanned Drive files. A scan of a million
+files held as Drive API dicts takes well over a gigabyte; most of that is
+per-object overhead and strings repeated on every file (folder paths,
+mimetypes, the exportLinks URLs). FileManifest stores the files by column
+instead:
+
+- id, name, destination_item_id and quick_xor_hash: utf-8 in one bytearray
+  per field, with an array of end offsets
+- parent_folder_local_path, mimeType and transfer_status: interned, an index
+  into a table of the distinct values
+- size and modifiedTime (milliseconds since the epoch): int64 arrays, -1
+  for none. md5Checksum: 16 raw bytes
+- exportLinks: interned with the file id taken out of the URLs, so all files
+  of one Google-native type share an entry and the links are derived from
+  the id when a file is read
+
+Values that do not fit a column (another timestamp format, unknown fields)
+are kept as they are in a sparse dict. Reading a file builds the same dict
+that was appended, so the plumbing can use a FileManifest wherever it takes
+a list of files.
+
+save() writes the columns to one file that load() maps with mmap, read
+only, so download workers in other processes can share a manifest through
+the page cache instead of each holding a copy. """
+import calendar
+import json
+import mmap
+import re
+import sys
+import threading
+from array import array
+from datetime import datetime, timezone
+
+MAGIC = b'GSMAMAN1'
+STRING_FIELDS = ('id', 'name')
+OPTIONAL_STRING_FIELDS = ('destination_item_id', 'quick_xor_hash')
+INTERNED_FIELDS = ('parent_folder_local_path', 'mimeType', 'transfer_status')
+MD5_BYTES = 16
+_NO_MD5 = bytes(MD5_BYTES)
+# stands for the file id in interned exportLinks; never part of a URL
+_ID_PLACEHOLDER = '\0'
+_DRIVE_TIMESTAMP = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}Z')
+_MD5_HEX = re.compile(r'[0-9a-f]{32}')
+
+
+def encode_timestamp(value: str = ''):
+    """ Milliseconds since the epoch of a Drive modifiedTime
+    ('2023-05-01T10:20:30.123Z'), or None if it is in another format """
+    if not _DRIVE_TIMESTAMP.fullmatch(value):
+        return None
+    seconds = calendar.timegm(datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+    return seconds * 1000 + int(value[20:23])
+
+
+def decode_timestamp(millis: int = 0):
+    """ Inverse of encode_timestamp """
+    seconds, millis = divmod(millis, 1000)
+    return f'{datetime.fromtimestamp(seconds, timezone.utc):%Y-%m-%dT%H:%M:%S}.{millis:03d}Z'
+
+
+class _Table:
+    """ Distinct values of an interned column. Index 0 is 'no value'. """
+
+    def __init__(self, values=()):
+        self.values = [None, *values]
+        self.index = {value: i for i, value in enumerate(self.values)}
+
+    def intern(self, value):
+        if value not in self.index:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+        return self.index[value]
+
+
+class FileManifest:
+    """ List-like sequence of Drive file dicts (as built by the scan), stored
+    by column. Appending is thread-safe; a loaded manifest is read only. """
+
+    def __init__(self, files=()):
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._views = []
+        self._count = 0
+        self._strings = {field: (bytearray(), array('Q')) for field in STRING_FIELDS + OPTIONAL_STRING_FIELDS}
+        self._tables = {field: _Table() for field in INTERNED_FIELDS}
+        self._interned = {field: array('I') for field in INTERNED_FIELDS}
+        self._export_links = _Table()
+        self._export_links_index = array('I')
+        self._size = array('q')
+        self._modified_time = array('q')
+        self._md5 = bytearray()
+        # {index: {field: value}} for values that have no column
+        self._extras = {}
+        self.extend(files)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('manifest index out of range')
+        file = {field: self._get_string(field, index) for field in STRING_FIELDS}
+        for field in INTERNED_FIELDS:
+            value = self._tables[field].values[self._interned[field][index]]
+            if value is not None:
+                file[field] = value
+        if self._size[index] >= 0:
+            file['size'] = str(self._size[index])
+        md5 = bytes(self._md5[index * MD5_BYTES:(index + 1) * MD5_BYTES])
+        if md5 != _NO_MD5:
+            file['md5Checksum'] = md5.hex()
+        if self._modified_time[index] >= 0:
+            file['modifiedTime'] = decode_timestamp(self._modified_time[index])
+        links = self._export_links.values[self._export_links_index[index]]
+        if links is not None:
+            file['exportLinks'] = {
+                mimetype: link.replace(_ID_PLACEHOLDER, file['id']) for mimetype, link in links}
+        for field in OPTIONAL_STRING_FIELDS:
+            value = self._get_string(field, index)
+            if value:
+                file[field] = value
+        file.update(self._extras.get(index, {}))
+        return file
+
+    def _get_string(self, field: str = '', index: int = 0):
+        data, ends = self._strings[field]
+        start = ends[index - 1] if index else 0
+        return bytes(data[start:ends[index]]).decode()
+
+    def append(self, file: dict = {}):
+        """ Add a Drive file dict. Later changes to the dict are not seen. """
+        if self._mmap is not None:
+            raise TypeError('a loaded manifest is read only')
+        file = dict(file)
+        extras = {}
+        with self._lock:
+            index = self._count
+            for field in STRING_FIELDS + OPTIONAL_STRING_FIELDS:
+                if field in OPTIONAL_STRING_FIELDS and file.get(field) == '':
+                    # stored as absent; keep the empty value as it was
+                    extras[field] = ''
+                value = file.pop(field, '')
+                data, ends = self._strings[field]
+                data += value.encode()
+                ends.append(len(data))
+            for field in INTERNED_FIELDS:
+                self._interned[field].append(self._tables[field].intern(file.pop(field)) if field in file else 0)
+            self._append_size(file.pop('size', None), extras)
+            self._append_md5(file.pop('md5Checksum', None), extras)
+            self._append_modified_time(file.pop('modifiedTime', None), extras)
+            self._append_export_links(file.pop('exportLinks', None), file_id=self._get_string('id', index))
+            extras.update(file)
+            if extras:
+                self._extras[index] = extras
+            self._count += 1
+
+    def _append_size(self, size, extras: dict = {}):
+        # Drive sizes are decimal strings
+        if isinstance(size, str) and size.isdigit() and str(int(size)) == size:
+            self._size.append(int(size))
+            return
+        self._size.append(-1)
+        if size is not None:
+            extras['size'] = size
+
+    def _append_md5(self, md5_checksum, extras: dict = {}):
+        if md5_checksum and _MD5_HEX.fullmatch(md5_checksum) and md5_checksum != _NO_MD5.hex():
+            self._md5 += bytes.fromhex(md5_checksum)
+            return
+        self._md5 += _NO_MD5
+        if md5_checksum is not None:
+            extras['md5Checksum'] = md5_checksum
+
+    def _append_modified_time(self, modified_time, extras: dict = {}):
+        millis = encode_timestamp(modified_time) if isinstance(modified_time, str) else None
+        self._modified_time.append(-1 if millis is None else millis)
+        if millis is None and modified_time is not None:
+            extras['modifiedTime'] = modified_time
+
+    def _append_export_links(self, export_links, file_id: str = ''):
+        if export_links is None:
+            self._export_links_index.append(0)
+            return
+        links = tuple((mimetype, link.replace(file_id, _ID_PLACEHOLDER) if file_id else link)
+                      for mimetype, link in export_links.items())
+        self._export_links_index.append(self._export_links.intern(links))
+
+    def update(self, index: int = 0, fields: dict = {}):
+        """ Change fields of a stored file. The new values are kept in the
+        sparse dict, so this is meant for a few files (e.g. renames). """
+        if self._mmap is not None:
+            raise TypeError('a loaded manifest is read only')
+        with self._lock:
+            self._extras.setdefault(index, {}).update(fields)
+
+    def extend(self, files=()):
+        for file in files:
+            self.append(file)
+
+    @property
+    def folders(self):
+        """ The distinct parent_folder_local_path values """
+        return self._tables['parent_folder_local_path'].values[1:]
+
+    def get_size(self, index: int = 0):
+        """ Size of a file in bytes, 0 for Google-native files """
+        if self._size[index] >= 0:
+            return self._size[index]
+        return int(self._extras.get(index, {}).get('size') or 0)
+
+    def total_size(self):
+        return sum(size for size in self._size if size > 0) + sum(
+            int(extras.get('size') or 0) for extras in self._extras.values())
+
+    def save(self, path: str = ''):
+        """ Write the manifest to path, for load() """
+        sections, blobs, offset = [], [], 0
+
+        def add(name, buffer):
+            nonlocal offset
+            data = memoryview(buffer).cast('B')
+            sections.append([name, offset, len(data), getattr(buffer, 'typecode', 'B')])
+            padding = -len(data) % 8
+            blobs.append((data, padding))
+            offset += len(data) + padding
+
+        for field in STRING_FIELDS + OPTIONAL_STRING_FIELDS:
+            add(f'{field}.data', self._strings[field][0])
+            add(f'{field}.ends', self._strings[field][1])
+        for field in INTERNED_FIELDS:
+            add(field, self._interned[field])
+        add('exportLinks', self._export_links_index)
+        add('size', self._size)
+        add('modifiedTime', self._modified_time)
+        add('md5Checksum', self._md5)
+        header = json.dumps({
+            'count': self._count,
+            'byteorder': sys.byteorder,
+            'itemsizes': {typecode: array(typecode).itemsize for typecode in 'QqI'},
+            'tables': {field: self._tables[field].values[1:] for field in INTERNED_FIELDS},
+            'exportLinks': self._export_links.values[1:],
+            'extras': self._extras,
+            'sections': sections,
+        }).encode()
+        header += b' ' * (-len(header) % 8)
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for data, padding in blobs:
+                f.write(data)
+                f.write(bytes(padding))
+        return path
+
+    @classmethod
+    def load(cls, path: str = ''):
+        """ The manifest saved at path, mapped read only. close() it when done. """
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{path} is not a file manifest')
+            header_length = int.from_bytes(mm[len(MAGIC):len(MAGIC) + 8], 'little')
+            base = len(MAGIC) + 8 + header_length
+            header = json.loads(mm[len(MAGIC) + 8:base])
+            itemsizes = {typecode: array(typecode).itemsize for typecode in 'QqI'}
+            if header['byteorder'] != sys.byteorder or header['itemsizes'] != itemsizes:
+                raise ValueError(f'{path} was saved on an incompatible platform')
+        except Exception:
+            mm.close()
+            raise
+        manifest = cls()
+        manifest._mmap = mm
+        view = memoryview(mm)
+        manifest._views.append(view)
+        columns = {}
+        for name, offset, length, typecode in header['sections']:
+            column = view[base + offset:base + offset + length]
+            if typecode != 'B':
+                manifest._views.append(column)
+                column = column.cast(typecode)
+            manifest._views.append(column)
+            columns[name] = column
+        manifest._count = header['count']
+        manifest._strings = {
+            field: (columns[f'{field}.data'], columns[f'{field}.ends'])
+            for field in STRING_FIELDS + OPTIONAL_STRING_FIELDS}
+        manifest._tables = {field: _Table(header['tables'][field]) for field in INTERNED_FIELDS}
+        manifest._interned = {field: columns[field] for field in INTERNED_FIELDS}
+        manifest._export_links = _Table(
+            tuple(tuple(pair) for pair in links) for links in header['exportLinks'])
+        manifest._export_links_index = columns['exportLinks']
+        manifest._size = columns['size']
+        manifest._modified_time = columns['modifiedTime']
+        manifest._md5 = columns['md5Checksum']
+        manifest._extras = {int(index): extras for index, extras in header['extras'].items()}
+        return manifest
+
+    def close(self):
+        """ Unmap a loaded manifest """
+        if self._mmap is None:
+            return
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._count = 0
+        self._mmap.close()
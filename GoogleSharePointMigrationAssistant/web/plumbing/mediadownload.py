@@ -0,0 +1,212 @@
+""" Streaming Drive downloads. files.get alt=media, files.export and exportLinks
+content is written straight to the destination file in DOWNLOAD_CHUNK_SIZE
+pieces, so a download holds at most one chunk in memory whatever the file's
+size. A download interrupted by a connection error or a retryable status
+(including Drive's 403 rate limiting) resumes from the bytes already written with a Range request instead of
+starting over. Blobs of at least SEGMENTED_DOWNLOAD_THRESHOLD bytes can be
+fetched as several byte ranges at once (download_segments_to_file) and are
+then checked against Drive's md5Checksum. Content can be hashed as it is
+written (see contenthash.py), for verifying it without reading it again. """
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .constants import (
+    DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_RETRIES, DOWNLOAD_TIMEOUT_SECONDS, GOOGLE_DRIVE_SLEEP_RETRY_SECONDS,
+    SEGMENTED_DOWNLOAD_SEGMENTS
+)
+from .contenthash import ContentHasher, QuickXorHash
+from .tracing import current_span
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# reasons of the 403s with which Drive throttles
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout
+)
+
+
+def get_total_size(response=None, offset: int = 0):
+    """ Full size of the content from Content-Range (206) or Content-Length (200), if sent """
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    length = response.headers.get('Content-Length')
+    return offset + int(length) if length is not None else None
+
+
+def get_md5_checksum(path: str = '', chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """ Hex md5 of a file, read chunk_size bytes at a time """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _should_retry_response(response=None):
+    """ Whether a failed response is retried: a RETRY_STATUS_CODES status, or a
+    403 whose error reason is rate limiting, as googleapiclient decides """
+    if response.status_code in RETRY_STATUS_CODES:
+        return True
+    if response.status_code != 403:
+        return False
+    try:
+        error = response.json().get('error', {})
+    except ValueError:
+        return False
+    if not isinstance(error, dict):
+        return False
+    return any(
+        detail.get('reason') in RATE_LIMIT_REASONS
+        for detail in error.get('errors', []) + error.get('details', []) if isinstance(detail, dict))
+
+
+def _stream_range(session=None, uri: str = '', sink=None, start: int = 0, end: int = None,
+                  chunk_size: int = DOWNLOAD_CHUNK_SIZE, max_retries: int = DOWNLOAD_MAX_RETRIES,
+                  retry_seconds: float = GOOGLE_DRIVE_SLEEP_RETRY_SECONDS, on_chunk=None, hasher=None):
+    """ Write bytes start..end (inclusive; end None for the rest of the content)
+    of uri to sink, which is positioned at start. Return the offset after the
+    last byte written. on_chunk(num_bytes, total_size) is called per chunk and
+    hasher.update(chunk), if given, with each chunk written. Retries resume at
+    the current offset. A whole-content request (start 0, no end) is rewritten
+    from the start if the server ignores Range. """
+    whole = start == 0 and end is None
+    offset = start
+    for attempt in range(max_retries + 1):
+        if attempt:
+            current_span().increment('retries')
+        # offsets count bytes on the wire, so ask for them uncompressed
+        headers = {'Accept-Encoding': 'identity'}
+        if offset or end is not None:
+            headers['Range'] = f'bytes={offset}-{"" if end is None else end}'
+        try:
+            with session.get(uri, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+                if response.status_code >= 400 and attempt < max_retries and _should_retry_response(response):
+                    time.sleep(float(response.headers.get('Retry-After', retry_seconds)))
+                    continue
+                if response.status_code == 416 and whole and offset and get_total_size(response) == offset:
+                    # everything was written before the connection dropped
+                    return offset
+                response.raise_for_status()
+                if response.status_code != 206:
+                    if not whole:
+                        raise requests.HTTPError(
+                            f'expected 206 for bytes {offset}-{end}, got {response.status_code}', response=response)
+                    # a full response: start over (it ignored Range, or nothing was written yet)
+                    if on_chunk and offset:
+                        on_chunk(-offset, None)
+                    offset = 0
+                    sink.seek(0)
+                    sink.truncate()
+                    if hasher:
+                        hasher.reset()
+                total_size = get_total_size(response, offset)
+                expected_end = total_size if end is None else end + 1
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    sink.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
+                    offset += len(chunk)
+                    if on_chunk:
+                        on_chunk(len(chunk), total_size)
+                if expected_end is not None and offset < expected_end:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f'connection closed after {offset} of {expected_end} bytes')
+                return offset
+        except RESUMABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            sink.flush()
+            time.sleep(retry_seconds)
+
+
+def download_to_file(session=None, uri: str = '', path: str = '', chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                     max_retries: int = DOWNLOAD_MAX_RETRIES, retry_seconds: float = GOOGLE_DRIVE_SLEEP_RETRY_SECONDS,
+                     on_progress=None, md5_checksum: str = '', hasher: ContentHasher = None):
+    """ Stream uri into path with session (an authorized requests.Session) and
+    return the number of bytes written. on_progress(received, total_size) is
+    called after every chunk; total_size is None if the server did not say.
+    Failed attempts are retried up to max_retries times, resuming at the
+    current offset. If the server ignores the Range header the file is
+    rewritten from the start. The content is hashed into hasher as it is
+    written and, if md5_checksum is given, checked against it. On failure the
+    partial file is removed and the last error is raised. """
+    received = 0
+    if md5_checksum and hasher is None:
+        hasher = ContentHasher()
+
+    def on_chunk(num_bytes, total_size):
+        nonlocal received
+        received += num_bytes
+        if on_progress and num_bytes > 0:
+            on_progress(received, total_size)
+    try:
+        with open(path, 'wb') as sink:
+            size = _stream_range(
+                session=session, uri=uri, sink=sink, chunk_size=chunk_size, max_retries=max_retries,
+                retry_seconds=retry_seconds, on_chunk=on_chunk, hasher=hasher)
+        if md5_checksum and hasher.md5.hexdigest() != md5_checksum:
+            raise ValueError(f'md5 mismatch for {path}: expected {md5_checksum}, got {hasher.md5.hexdigest()}')
+        return size
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def download_segments_to_file(session=None, uri: str = '', path: str = '', size: int = 0, md5_checksum: str = '',
+                              num_segments: int = SEGMENTED_DOWNLOAD_SEGMENTS, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                              max_retries: int = DOWNLOAD_MAX_RETRIES,
+                              retry_seconds: float = GOOGLE_DRIVE_SLEEP_RETRY_SECONDS, on_progress=None,
+                              quick_xor: QuickXorHash = None):
+    """ Download the size bytes of uri (which must honour Range, as alt=media
+    does) into path as num_segments byte ranges fetched in parallel, each
+    written at its own offset of the preallocated file. Each segment resumes
+    on its own after errors. The result is checked against md5_checksum if
+    given (md5 cannot be computed out of order, so this reads the file back).
+    quickXorHash can: each segment is hashed as it is written and the
+    segments' hashes are merged into quick_xor. Returns the number of bytes
+    written; on failure the partial file is removed and the error raised. """
+    segment_size = max(-(-size // num_segments), 1)
+    ranges = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    lock = threading.Lock()
+    received = 0
+
+    def on_chunk(num_bytes, total_size):
+        nonlocal received
+        with lock:
+            received += num_bytes
+            progress = received
+        if on_progress:
+            on_progress(progress, size)
+
+    def fetch(segment):
+        start, end = segment
+        segment_hash = QuickXorHash(offset=start) if quick_xor is not None else None
+        with open(path, 'r+b') as sink:
+            sink.seek(start)
+            _stream_range(
+                session=session, uri=uri, sink=sink, start=start, end=end, chunk_size=chunk_size,
+                max_retries=max_retries, retry_seconds=retry_seconds, on_chunk=on_chunk, hasher=segment_hash)
+        return segment_hash
+
+    try:
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        with ThreadPoolExecutor(max_workers=max(len(ranges), 1), thread_name_prefix='segment') as executor:
+            for segment_hash in executor.map(fetch, ranges):
+                if segment_hash is not None:
+                    quick_xor.merge(segment_hash)
+        current_span().set_attribute('segments', len(ranges))
+        if md5_checksum:
+            actual = get_md5_checksum(path, chunk_size=chunk_size)
+            if actual != md5_checksum:
+                raise ValueError(f'md5 mismatch for {path}: expected {md5_checksum}, got {actual}')
+        return size
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
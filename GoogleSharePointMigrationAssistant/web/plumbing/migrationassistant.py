@@ -109,18 +109,33 @@ class MigrationAssistant(BaseUtil):
         response = self.downloader.migrate()
         if not response: 
             return False 
-        self.info(f"{self.downloader.num_files_downloaded} total files downloaded.\n")
-        if self.downloader.num_files_skipped > 0:
-            self.info(f"{self.downloader.num_files_skipped} total skipped files, not downloaded.")  
+        self._log_transfer_counts()
         end = time.time()
         elapsed = end - start
         self.migration_elapsed_time_seconds = self.format_elapsed_time_seconds(elapsed)
         # add migration report to migration object; model update
         return True 
 
+    def _log_transfer_counts(self):
+        self.info(f"{self.downloader.num_files_downloaded} total files downloaded.\n")
+        if self.downloader.num_files_deduplicated > 0:
+            self.info(f"{self.downloader.num_files_deduplicated} of them copied from a duplicate, not downloaded again.")
+        if self.downloader.num_exports_from_cache > 0:
+            self.info(f"{self.downloader.num_exports_from_cache} of them exported by an earlier run, not exported again.")
+        if self.downloader.num_files_skipped > 0:
+            self.info(f"{self.downloader.num_files_skipped} total skipped files, not downloaded.")  
+
     def scan_data_source(self):
         return self.downloader.scan()
 
+    def scan_and_migrate(self):
+        """ Scan the source and migrate it in one pass; return the scan result """
+        start = time.time()
+        scan_result = self.downloader.scan_and_migrate()
+        self._log_transfer_counts()
+        self.migration_elapsed_time_seconds = self.format_elapsed_time_seconds(time.time() - start)
+        return scan_result
+
 
 def clear_logs(assistant: MigrationAssistant = None):
     if assistant:
@@ -139,8 +154,7 @@ def scan_data_source(migration_id: int = 0, google_credentials: dict = {}, user_
     """ Scan source data asynchronously """
     user = User.objects.get(id=user_id)
     migration = Migration.objects.get(id=migration_id)
-    migration.state = Migration.STATES.SCANNING
-    migration.save()
+    migration.set_state(Migration.STATES.SCANNING)
     assistant = MigrationAssistant(
             migration=migration, 
             name=f'migration-{user.username}-mig-{migration.id}', 
@@ -148,8 +162,7 @@ def scan_data_source(migration_id: int = 0, google_credentials: dict = {}, user_
             user=user
             )
     scan_result = assistant.scan_data_source()
-    migration.state = Migration.STATES.SCAN_COMPLETE
-    migration.save()
+    migration.set_state(Migration.STATES.SCAN_COMPLETE)
     return scan_result
 
 @shared_task 
@@ -163,11 +176,9 @@ def migrate_data(migration_id: int = 0, google_credentials: dict = {}, user_id:
         user=user,
         m365_token_cache=m365_token_cache
     )
-    migration.state = Migration.STATES.MIGRATING
-    migration.save()
+    migration.set_state(Migration.STATES.MIGRATING)
     migration_response = assistant.migrate()
-    migration.state = Migration.STATES.MIGRATION_COMPLETE
-    migration.save()
+    migration.set_state(Migration.STATES.MIGRATION_COMPLETE)
 
     assistant.upload_logs_to_destination()
 
@@ -176,3 +187,25 @@ def migrate_data(migration_id: int = 0, google_credentials: dict = {}, user_id:
     
     clear_logs(assistant)
     return migration_response
+
+@shared_task
+def scan_and_migrate_data(migration_id: int = 0, google_credentials: dict = {}, user_id: int = 0, m365_token_cache: dict = {}):
+    """ scan_data_source and migrate_data in one pass (SCAN_AND_MIGRATE) """
+    user = User.objects.get(id=user_id)
+    migration = Migration.objects.get(id=migration_id)
+    assistant = MigrationAssistant(
+        migration=migration,
+        name=f'migration-{user.username}-mig-{migration.id}', 
+        google_credentials=google_credentials,
+        user=user,
+        m365_token_cache=m365_token_cache
+    )
+    migration.set_state(Migration.STATES.MIGRATING)
+    scan_result = assistant.scan_and_migrate()
+    migration.set_state(Migration.STATES.MIGRATION_COMPLETE)
+
+    assistant.upload_logs_to_destination()
+    assistant.notify_completion()
+
+    clear_logs(assistant)
+    return scan_result
@@ -0,0 +1,161 @@
+""" Destination names of scanned files. Names are normalized once, when a file
+is scanned, to the form written to the temp folder and uploaded (sanitized:
+no characters that SharePoint or the local filesystem reject). normalize_name
+is memoized, as the same names are normalized again by the downloads, the
+uploads and the destination listing.
+
+Before the transfer plan, NamePlan goes over the whole scan and resolves, up
+front rather than with a round trip per file:
+
+- collisions: Drive allows files of the same name in a folder, and names
+  that differ only in characters removed by sanitizing or in case are the
+  same name in SharePoint. They would overwrite each other in the temp
+  folder, or be renamed at random by the destination. All but one of them
+  (ordered by file id, so reruns resolve them the same way) get a ' (n)'
+  suffix; a file named like a subfolder is renamed too.
+- long paths: a name that would make the path below the target folder
+  longer than MAX_DESTINATION_PATH_LENGTH is shortened, keeping its
+  extension. Files in folders whose path alone is too long are reported.
+
+The resolved names are written into the scanned files (or manifest), so
+every later step uses them as they are. A scan that is migrated while it runs
+(scan_and_migrate()) plans the files of each folder as it is listed instead:
+names taken by the folders planned before are kept, and the subfolders of the
+folder are given, as its files are planned before they are crawled. """
+import functools
+import itertools
+import os
+from sanitize_filename import sanitize
+from .constants import MAX_DESTINATION_PATH_LENGTH
+from .manifest import FileManifest
+
+NAME_CACHE_SIZE = 2 ** 16
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def normalize_name(name: str = ''):
+    """ The name of a file or folder as written to the temp folder and uploaded """
+    return sanitize(name)
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_name_key(name: str = ''):
+    """ Names with the same key are the same name in the destination, whose
+    names are case-insensitive """
+    return normalize_name(name).casefold()
+
+
+def shorten_name(name: str = '', max_length: int = 0):
+    """ name cut to max_length characters, keeping the extension, or None if
+    not even one character of the stem fits """
+    if len(name) <= max_length:
+        return name
+    stem, ext = os.path.splitext(name)
+    if max_length - len(ext) < 1:
+        return None
+    return stem[:max_length - len(ext)].rstrip(' .') + ext
+
+
+class NamePlan:
+    """ Destination names of a scan that differ from the normalized scanned
+    names: renamed {index in files_list: name}, and the indexes of files
+    whose path is too long even with a shortened name (too_long) """
+
+    def __init__(self, files_list: list = [], base_path: str = '',
+                 max_path_length: int = MAX_DESTINATION_PATH_LENGTH,
+                 folder_paths=(), names_taken: dict = None):
+        """ base_path: the local folder that mirrors the migrated folder,
+        which goes in the target folder. folder_paths: local paths of folders
+        with no files in files_list. names_taken: {parent folder path: name
+        keys} of files planned before, which keep their names; this plan's
+        names are added to it """
+        if names_taken is None:
+            names_taken = {}
+        self.renamed = {}
+        self.too_long = []
+        root = os.path.dirname(base_path) or os.curdir
+        # {parent folder path: {name key: index of the first file}}
+        names = {}
+        # {(parent folder path, name key): [indexes of the other files]}
+        collisions = {}
+        budgets = {}
+        for index, file in enumerate(files_list):
+            parent = file['parent_folder_local_path']
+            if parent not in budgets:
+                # characters left for a name below parent, after the separator
+                budgets[parent] = max_path_length - len(os.path.relpath(parent, root)) - 1
+            name = normalize_name(file['name'])
+            if name != file['name']:
+                # scans saved before names were normalized when scanned
+                self.renamed[index] = name
+            if len(name) > budgets[parent]:
+                shortened = shorten_name(name, budgets[parent])
+                if shortened is None:
+                    self.too_long.append(index)
+                else:
+                    name = self.renamed[index] = shortened
+            key = get_name_key(name)
+            first = names.setdefault(parent, {}).setdefault(key, index)
+            if first != index:
+                collisions.setdefault((parent, key), []).append(index)
+        # {parent folder path: name keys of its subfolders}
+        folders = {}
+        for path in itertools.chain(budgets, folder_paths):
+            while path != base_path and os.path.dirname(path) != path:
+                folders.setdefault(os.path.dirname(path), set()).add(get_name_key(os.path.basename(path)))
+                path = os.path.dirname(path)
+        for parent, keys in names.items():
+            # a name taken by a subfolder or an earlier file
+            for key in keys.keys() & (folders.get(parent, set()) | names_taken.get(parent, set())):
+                collisions.setdefault((parent, key), [])
+        taken_by_parent = {}
+        for (parent, key), others in collisions.items():
+            indexes = sorted([names[parent][key]] + others, key=lambda i: files_list[i]['id'])
+            # a subfolder or an earlier file keeps its name; files are renamed
+            if key not in folders.get(parent, ()) and key not in names_taken.get(parent, ()):
+                indexes = indexes[1:]
+            if parent not in taken_by_parent:
+                taken_by_parent[parent] = (
+                    names[parent].keys() | folders.get(parent, set()) | names_taken.get(parent, set()))
+            taken = taken_by_parent[parent]
+            # suffixes below n are taken by earlier files of the group
+            n = 1
+            for index in indexes:
+                name = self.get_name(files_list, index)
+                resolved, n = self._get_free_name(name, taken, budgets[parent], n)
+                if resolved is None:
+                    self.too_long.append(index)
+                    continue
+                self.renamed[index] = resolved
+                taken.add(get_name_key(resolved))
+        self.too_long = sorted(set(self.too_long))
+        for parent, keys in names.items():
+            names_taken.setdefault(parent, set()).update(taken_by_parent.get(parent, keys.keys()))
+
+    def get_name(self, files_list: list = [], index: int = 0):
+        """ Resolved name of a file """
+        return self.renamed.get(index) or normalize_name(files_list[index]['name'])
+
+    def _get_free_name(self, name: str = '', taken: set = (), max_length: int = 0, n: int = 1):
+        """ (name with the lowest ' (n)' suffix from n on whose key is not taken,
+        shortened to max_length, or None if it does not fit; the next n) """
+        stem, ext = os.path.splitext(name)
+        while True:
+            suffix = f' ({n}){ext}'
+            if max_length - len(suffix) < 1:
+                return None, n
+            candidate = stem[:max_length - len(suffix)].rstrip(' .') + suffix
+            n += 1
+            if get_name_key(candidate) not in taken:
+                return candidate, n
+
+    def apply(self, files_list: list = []):
+        """ Write the resolved names into files_list """
+        for index, name in self.renamed.items():
+            if isinstance(files_list, FileManifest):
+                files_list.update(index, {'name': name})
+            else:
+                files_list[index]['name'] = name
+
+    def summary(self):
+        return {'renamed': len(self.renamed), 'path_too_long': len(self.too_long)}
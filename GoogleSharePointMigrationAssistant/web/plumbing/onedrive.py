@@ -4,14 +4,17 @@ from msal import SerializableTokenCache
 from django.conf import settings
 import json
 from concurrent.futures import wait, ThreadPoolExecutor
-from sanitize_filename import sanitize
-from .constants import MAX_UPLOAD_THREADS
+from .constants import MAX_UPLOAD_THREADS, SMALL_FILE_FAST_PATH, VERIFY_UPLOADS
+from .contenthash import verify_quick_xor_hash
 from .base import BaseUtil
 from .graphutil import GraphUtil
+from .pathindex import PathIndex
+from .remotefolders import RemoteFolderCache
 from .m365_util import get_token_from_cache
+from .tracing import current_span, traced
 
 
-class OneDriveUploader(BaseUtil, GraphUtil):
+class OneDriveUploader(BaseUtil, GraphUtil, RemoteFolderCache):
     def __init__(self,
                  name: str = 'OneDriveUploader',
                  m365_token_cache: SerializableTokenCache = None,
@@ -28,10 +31,12 @@ class OneDriveUploader(BaseUtil, GraphUtil):
         self.num_completed_uploads = 0
         self._num_active_uploads = 0
         self.base_folder_id = None
+        self.reset_remote_folder_cache()
 
     def get_progress(self):
         return f'{round((self.num_completed_uploads / self.total_files_to_upload), 2) * 100 }%'
 
+    @traced('_create_folder', lambda a: {'folder.name': a['folder_name']})
     def _create_onedrive_folder(self, folder_name: str = '', parent_folder_id: str = ''):
 
         if parent_folder_id == 'root':
@@ -41,29 +46,38 @@ class OneDriveUploader(BaseUtil, GraphUtil):
         payload = {
             'name': folder_name,
             'folder': {},
-            "@microsoft.graph.conflictBehavior": "rename"
+            "@microsoft.graph.conflictBehavior": "fail"
         }
-        return self.graph_post(url=url, data=json.dumps(payload))
+        return self.graph_post(url=url, data=json.dumps(payload), accept_status_codes=(409,))
 
-    def _create_upload_session(self, folder_id: str = '', file_name: str = ''):
+    def _create_remote_folder(self, folder_name: str = '', parent_id: str = ''):
+        return self._create_onedrive_folder(folder_name=folder_name, parent_folder_id=parent_id)
+
+    def _create_upload_session(self, folder_id: str = '', file_name: str = '', replace: bool = False):
+        """ With replace, the upload replaces an existing file of the same name instead of being renamed """
         url = f'{settings.GRAPH_API_URL}/users/{self.username}/drive/items/{folder_id}:/{file_name}:/createUploadSession'
         payload = {
             "item": {
-                "@microsoft.graph.conflictBehavior": "rename",
+                "@microsoft.graph.conflictBehavior": "replace" if replace else "rename",
                 "name": file_name
             }
         }
         response = self.graph_post(url, data=json.dumps(payload)).json()
         return response
 
-    def _upload_file_in_chunks(self, file_path: str = '', file_name: str = '', remote_parent_folder_id: str = '', total_file_size: int = 1):
+    def _upload_file_in_chunks(self, file_path: str = '', file_name: str = '', remote_parent_folder_id: str = '', total_file_size: int = 1,
+                               replace: bool = False):
         self.debug({
-            '_'
+            '_upload_file_in_chunks': {
+                'file_name': file_name,
+                'total_file_size': total_file_size
+            }
         })
         response = None
         upload_session = self._create_upload_session(
             folder_id=remote_parent_folder_id,
-            file_name=file_name
+            file_name=file_name,
+            replace=replace
         )
         if 'uploadUrl' in upload_session:
             upload_session_url = upload_session['uploadUrl']
@@ -105,8 +119,15 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                 i += 1
         return response
 
-    def _upload_complete_file(self, file_path: str = '', file_name: str = '', remote_parent_folder_id: str = '', total_file_size: int = 0):
+    def _upload_complete_file(self, file_path: str = '', file_name: str = '', remote_parent_folder_id: str = '', total_file_size: int = 0,
+                              if_absent: bool = False, replace: bool = False):
+        """ With if_absent, an existing file of the same name is left alone and
+        the 409 error response is returned; with replace, it is replaced """
         url = f'{settings.GRAPH_API_URL}/users/{self.username}/drive/items/{remote_parent_folder_id}:/{file_name}:/content'
+        if if_absent:
+            url = f'{url}?@microsoft.graph.conflictBehavior=fail'
+        elif replace:
+            url = f'{url}?@microsoft.graph.conflictBehavior=replace'
         token = get_token_from_cache(m365_token_cache=self.m365_token_cache)
         with open(file_path, 'rb') as f:
             content = f.read()
@@ -116,18 +137,54 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                     'Content-Type': 'multipart/form-data',
                     'Content-Length': f'{total_file_size}',
                     'Authorization': f'Bearer {token["access_token"]}'},
-                data=content)
+                data=content,
+                accept_status_codes=(409,) if if_absent else ())
         return response
 
-    def _upload_file_worker(self, file_path=None, remote_parent_folder_id: str = ''):
+    def _upload_small_file(self, file_path: str = '', file_name: str = '', remote_parent_folder_id: str = '', total_file_size: int = 0):
+        """ Small-file fast path: a single PUT that fails with 409 if the name
+        is taken, instead of a _child_exists GET before the PUT """
+        self._num_active_uploads += 1
+        file = None
+        try:
+            current_span().set_attribute('bytes', total_file_size)
+            file = self._upload_complete_file(
+                file_path=file_path, file_name=file_name, remote_parent_folder_id=remote_parent_folder_id,
+                total_file_size=total_file_size, if_absent=True)
+            if file and 'error' in file:
+                self.info({'file_already_exists': {
+                    'file_name': file_name, 'remote_parent_folder_id': remote_parent_folder_id}})
+                file = None
+            else:
+                self.info({'upload_success': file})
+            self.num_completed_uploads += 1
+        except Exception as e:
+            self.error({'upload_fail': file, 'error': str(e)})
+            current_span().set_error(e)
+            self._num_failed += 1
+            file = None
+        self._num_active_uploads -= 1
+        self.info({'file_name': file_name, 'progress': self.get_progress()})
+        return file
+
+    @traced('_upload_file', lambda a: {'file.name': os.path.basename(a['file_path'])})
+    def _upload_file_worker(self, file_path=None, remote_parent_folder_id: str = '', total_file_size: int = None,
+                            replace: bool = False):
         """ Given a path to a downloaded file, upload that file to the target 
-        folder on the target site.
+        folder on the target site. With replace, it replaces the file of the
+        same name there (a file changed at the source), keeping its history.
         Referenced documentation for using upload sessions: 
         https://docs.microsoft.com/en-us/onedrive/developer/rest-api/api/driveitem_createuploadsession?view=odsp-graph-online
         """
         file = None
         file_name = self.get_name_of_folder_or_file_from_path(file_path)
-        exists, file = self._child_exists(
+        if total_file_size is None:
+            total_file_size = os.path.getsize(file_path)
+        if SMALL_FILE_FAST_PATH and self.less_than_4mb(total_file_size) and not replace:
+            return self._upload_small_file(
+                file_path=file_path, file_name=file_name, remote_parent_folder_id=remote_parent_folder_id,
+                total_file_size=total_file_size)
+        exists, file = (False, None) if replace else self._child_exists(
             child_name=file_name, parent_folder_id=remote_parent_folder_id)
         if not exists:
             self._num_active_uploads += 1
@@ -137,31 +194,35 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                 'remote_parent_folder_id': remote_parent_folder_id
             })
             try:
-                total_file_size = os.path.getsize(file_path)
+                current_span().set_attribute('bytes', total_file_size)
                 if self.less_than_4mb(total_file_size):
                     file = self._upload_complete_file(
                         file_path=file_path,
                         file_name=file_name,
-                        remote_parent_folder_id=remote_parent_folder_id
+                        remote_parent_folder_id=remote_parent_folder_id,
+                        replace=replace
                     )
                 else:
                     file = self._upload_file_in_chunks(
                         file_path=file_path,
                         file_name=file_name,
                         remote_parent_folder_id=remote_parent_folder_id,
-                        total_file_size=total_file_size
+                        total_file_size=total_file_size,
+                        replace=replace
                     )
                     if file is None:
                         # try complete file upload if chunked did not work.
                         file = self._upload_complete_file(
                             file_path=file_path,
                             file_name=file_name,
-                            remote_parent_folder_id=remote_parent_folder_id
+                            remote_parent_folder_id=remote_parent_folder_id,
+                            replace=replace
                         )
                 self.info({'upload_success': file})
                 self.num_completed_uploads += 1
             except Exception as e:
                 self.error({'upload_fail': file, 'error': str(e)})
+                current_span().set_error(e)
                 self._num_failed += 1
                 file = None
             self._num_active_uploads -= 1
@@ -183,6 +244,7 @@ class OneDriveUploader(BaseUtil, GraphUtil):
             })
         return file
 
+    @traced('_child_exists', lambda a: {'child.name': a['child_name']})
     def _child_exists(self, child_name: str = '', parent_folder_id: str = ''):
         exists = False
         child = None
@@ -203,6 +265,7 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                        'child_name': child_name, 'parent_folder_id': parent_folder_id}})
         return exists, child
 
+    @traced('_upload_folder', lambda a: {'folder.path': a['folder_path']})
     def _upload_folder_worker(self, folder_path: str = '', remote_parent_folder_id: str = ''):
         """ Create the local folder on sharepoint target and also 
         upload all of the contents """
@@ -213,16 +276,9 @@ class OneDriveUploader(BaseUtil, GraphUtil):
             }
         })
         folder_name = self.get_name_of_folder_or_file_from_path(folder_path)
-        folder_exists, new_folder = self._child_exists(
-            child_name=folder_name, parent_folder_id=remote_parent_folder_id
-        )
-        if not folder_exists:
-            new_folder = self._create_onedrive_folder(
-                folder_name=self.get_name_of_folder_or_file_from_path(
-                    folder_path),
-                parent_folder_id=remote_parent_folder_id
-            )
-        if not new_folder:
+        new_folder_id = self.get_remote_folder_id(
+            folder_path=folder_path, parent_id=remote_parent_folder_id)
+        if not new_folder_id:
             self._num_active_uploads -= 1
             self.info({
                 '_upload_folder_worker': {
@@ -231,8 +287,8 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                 }
             })
             return None
-        if remote_parent_folder_id == 'root' and new_folder:
-            self.base_folder_id = new_folder['id']
+        if remote_parent_folder_id == 'root':
+            self.base_folder_id = new_folder_id
         with ThreadPoolExecutor(max_workers=MAX_UPLOAD_THREADS) as executor:
             folder_futures = {}
             file_futures = {}
@@ -240,10 +296,10 @@ class OneDriveUploader(BaseUtil, GraphUtil):
                 _full = os.path.join(folder_path, f)
                 if os.path.isdir(_full):
                     folder_futures[executor.submit(
-                        self._upload_folder_worker, _full, new_folder['id'])] = _full
+                        self._upload_folder_worker, _full, new_folder_id)] = _full
                 elif os.path.isfile(_full):
                     file_futures[executor.submit(
-                        self._upload_file_worker, _full, new_folder['id'])] = _full
+                        self._upload_file_worker, _full, new_folder_id)] = _full
             for complete_file_upload in wait(file_futures).done:
                 self.debug({
                     '_upload_folder_worker': {
@@ -264,67 +320,81 @@ class OneDriveUploader(BaseUtil, GraphUtil):
         })
         return True
 
-    def get_children_from_folder_id(self, folder_id: str = ''):
-        if not folder_id:
-            url = f'{settings.GRAPH_API_URL}/users/{self.username}/drive/root/children'
-        else:
-            url = f'{settings.GRAPH_API_URL}/users/{self.username}/drive/items/{folder_id}/children'
-        response = self.graph_get(url).json()
-        if 'value' in response:
-            return response['value']
-        else:
-            return None
-
     def count_remote_files_recursively(self, folder_id: str = ''):
-        folder_id = self.base_folder_id if not folder_id else folder_id
-        children = self.get_children_from_folder_id(folder_id=folder_id)
-        files = [c for c in children if 'file' in c]
-        folders = [c for c in children if 'folder' in c]
-        return len(files) + sum([self.count_remote_files_recursively(folder_id=f['id']) for f in folders])
+        return super().count_remote_files_recursively(folder_id=folder_id or self.base_folder_id)
 
-    def get_flattened_files_dict_in_remote_folder(self, local_folder_base_path: str = '', remote_folder_id: str = ''):
-        """ 
-        Use recursion to return a flattned map of all files in the passed folder's
-        hierarchy. key = parent_folder_local_path, value = name. 
-        A dictionary is 6.6 times faster than a list when we lookup in 100 items.
-        When it comes to 10,000,000 items a dictionary lookup can be 585714 times faster than a list lookup.
-        * remote folder id is id of drive item
-        * local folder base path is the path to where that folder lives 
-        locally during local download/upload process
-        """
-        files_dict = {}
-        if not remote_folder_id:
-            # Base. Remote parent folder is currently root.
-            folder_name = self.get_name_of_folder_or_file_from_path(
-                local_folder_base_path)
-            exists, folder = self._child_exists(
-                child_name=folder_name, parent_folder_id='root')
-            if exists:
-                self.info(f'Folder {folder_name} already uploaded.')
-                remote_folder_id = folder['id']
-                self.base_folder_id = remote_folder_id
-            else:
-                self.info(f'Target folder {folder_name} not yet uploaded.')
-                return {}
-        children = self.get_children_from_folder_id(folder_id=remote_folder_id)
-        files = [c for c in children if 'file' in c]
-        for f in files:
-            fname = sanitize(f['name'])
-            key = f'PARENT<{local_folder_base_path}>PARENT--FILENAME<{fname}>FILENAME'
-            f['parent_folder_local_path'] = local_folder_base_path
-            files_dict[key] = f
-        folders = [c for c in children if 'folder' in c]
-        for f in folders:
-            f_local_path = os.path.join(local_folder_base_path, f['name'])
-            # merge dictionary with subfolder dictionary.
-            files_dict = files_dict | self.get_flattened_files_dict_in_remote_folder(
-                remote_folder_id=f['id'], local_folder_base_path=f_local_path
-            )
-        return files_dict
+    def get_remote_path_index(self, local_folder_base_path: str = ''):
+        """ PathIndex (see pathindex.py) of all files already in the destination
+        folder that mirrors local_folder_base_path, which is in the drive root.
+        Empty if it is not there yet. """
+        folder_name = self.get_name_of_folder_or_file_from_path(local_folder_base_path)
+        exists, folder = self._child_exists(child_name=folder_name, parent_folder_id='root')
+        if not exists:
+            self.info(f'Target folder {folder_name} not yet uploaded.')
+            return PathIndex(local_folder_base_path)
+        self.info(f'Folder {folder_name} already uploaded.')
+        self.base_folder_id = folder['id']
+        return self.build_remote_path_index(local_folder_base_path, folder['id'])
 
     def set_todo_count(self, total_files_to_upload: int = 0):
         self.total_files_to_upload = total_files_to_upload
 
+    def get_drive_url(self):
+        """ Graph URL of the user's OneDrive """
+        return f'{settings.GRAPH_API_URL}/users/{self.username}/drive'
+
+    def get_upload_base_folder_id(self):
+        """ ID of the drive item that the migrated folder is created in """
+        return 'root'
+
+    def _upload_file_record(self, record=None, base_path: str = '', base_parent_id: str = ''):
+        remote_parent_folder_id = self.resolve_remote_folder_id(
+            folder_path=record.parent_folder_local_path, base_path=base_path, base_parent_id=base_parent_id)
+        if not remote_parent_folder_id:
+            self.error({'upload_fail': {'error': 'no destination folder', 'file_path': record.local_path}})
+            self._num_failed += 1
+            return None
+        # a file changed at the source replaces its destination copy in place
+        return self._upload_file_worker(
+            file_path=record.local_path, remote_parent_folder_id=remote_parent_folder_id,
+            total_file_size=record.size, replace=bool(record.replaces_item_id))
+
+    def upload_files(self, files=(), base_path: str = '', base_parent_id: str = 'root'):
+        """ Upload the UploadRecords of a download batch, each into the
+        destination folder mirroring its local parent folder under base_path
+        (which itself goes in base_parent_id). Unlike upload(), this does not
+        walk the local folder. Returns the records whose upload failed
+        verification; their uploaded copies have been deleted, unless they
+        replaced a destination file (the re-transfer replaces them again). """
+        files = list(files)
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_THREADS) as executor:
+            futures = [
+                executor.submit(self._upload_file_record, record, base_path, base_parent_id)
+                for record in files]
+            wait(futures)
+        mismatched = []
+        if VERIFY_UPLOADS:
+            for record, future in zip(files, futures):
+                item = future.result()
+                if verify_quick_xor_hash(item, record.quick_xor_hash) is False:
+                    self.error({'upload_fail': {
+                        'hash_mismatch': record.local_path, 'expected': record.quick_xor_hash,
+                        'reported': item['file']['hashes']['quickXorHash']}})
+                    if not record.replaces_item_id:
+                        # remove the bad copy so that the re-transfer is not a name conflict
+                        self.delete_item(item['id'])
+                    self.num_completed_uploads -= 1
+                    mismatched.append(record)
+        if base_parent_id == 'root':
+            # logs are uploaded into the migrated folder
+            self.base_folder_id = self._remote_folder_ids.get(base_path, self.base_folder_id)
+        self.info({'upload_files': {
+            'files': len(futures), 'hash_mismatches': len(mismatched), 'progress': self.get_progress()}})
+        return mismatched
+
+    def delete_item(self, item_id: str = ''):
+        return self.graph_delete(url=f'{self.get_drive_url()}/items/{item_id}')
+
     def upload(self, local_folder_base_path: str = ''):
         """ Upload a local folder (by path) to a user's onedrive """
         self.local_folder_base_path = local_folder_base_path
@@ -0,0 +1,93 @@
+""" Index of the files already in the destination, by folder. Each destination
+folder is a node holding its subfolders and files by normalized name, so a
+scanned file is looked up as (node of its parent folder, normalized name)
+instead of as one string key per file that repeats its whole folder path.
+The index is built in one pass over the destination tree and grows linearly
+with the number of folders and files; folder names are interned and each
+folder path is built once. Names are matched by naming.get_name_key: as
+normalized for upload, and case-insensitive like the destination. """
+import os
+import sys
+from .naming import get_name_key
+
+
+class FolderNode:
+    """ A destination folder: its local path, and its subfolders and files
+    (drive items) by name key """
+    __slots__ = ('path', 'folders', 'files')
+
+    def __init__(self, path: str = ''):
+        self.path = path
+        self.folders = {}
+        self.files = {}
+
+
+class PathIndex:
+    """ The destination files under the folder that mirrors local base_path """
+
+    def __init__(self, base_path: str = ''):
+        self.root = FolderNode(base_path)
+        self._count = 0
+        # local folder path: node (or None if there is no such folder), as looked up
+        self._nodes_by_path = {base_path: self.root}
+        self._has_misses = False
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """ The drive items of all files, folder by folder """
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            yield from node.files.values()
+            pending.extend(node.folders.values())
+
+    def add_folder(self, parent: FolderNode = None, name: str = ''):
+        """ The node of subfolder name of parent, added if new """
+        key = sys.intern(get_name_key(name))
+        if key not in parent.folders:
+            parent.folders[key] = FolderNode(os.path.join(parent.path, name))
+            if self._has_misses:
+                # a folder looked up before may exist now
+                self._nodes_by_path = {path: node for path, node in self._nodes_by_path.items() if node is not None}
+                self._has_misses = False
+        return parent.folders[key]
+
+    def add_file(self, parent: FolderNode = None, item: dict = {}):
+        """ Add a drive item to the files of parent. Like the scanned files, it
+        gets 'parent_folder_local_path'. """
+        key = get_name_key(item['name'])
+        if key not in parent.files:
+            self._count += 1
+        item['parent_folder_local_path'] = parent.path
+        parent.files[key] = item
+
+    def get_folder(self, path: str = '', create: bool = False):
+        """ The node of the folder at local path (under the base path), or None
+        if there is none; created with its ancestors if create """
+        node = self._nodes_by_path.get(path)
+        if node is not None or (path in self._nodes_by_path and not create):
+            return node
+        relative = os.path.relpath(path, self.root.path)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            node = None
+        else:
+            node = self.root
+            for name in relative.split(os.sep):
+                if create:
+                    node = self.add_folder(node, name)
+                else:
+                    node = node.folders.get(get_name_key(name))
+                    if node is None:
+                        break
+        self._nodes_by_path[path] = node
+        self._has_misses = self._has_misses or node is None
+        return node
+
+    def get(self, parent_folder_local_path: str = '', name: str = ''):
+        """ The drive item of file name in the folder at parent_folder_local_path, or None """
+        node = self.get_folder(parent_folder_local_path)
+        if node is None:
+            return None
+        return node.files.get(get_name_key(name))
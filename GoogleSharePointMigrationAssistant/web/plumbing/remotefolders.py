@@ -0,0 +1,143 @@
+""" Destination folder ids by local folder path, kept for the life of an
+uploader (the whole migration), so each destination folder is looked up or
+created once rather than on every upload batch; and the index of the files
+already in the destination, built by listing its folders in parallel. """
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .constants import DESTINATION_LIST_THREADS, GRAPH_CHILDREN_SELECT, GRAPH_PAGE_SIZE, MAX_UPLOAD_THREADS
+from .pathindex import PathIndex
+
+# a downloaded file, as handed from the download step to uploader.upload_files();
+# quick_xor_hash, computed while downloading, is checked against the uploaded item.
+# replaces_item_id is the stale destination copy of a file changed at the source
+# (see transferplan.py), replaced in place by uploading with conflictBehavior=replace
+UploadRecord = namedtuple(
+    'UploadRecord',
+    ['local_path', 'parent_folder_local_path', 'size', 'source_id', 'quick_xor_hash', 'replaces_item_id'],
+    defaults=(None, None, None))
+
+
+class RemoteFolderCache:
+    """ Abstract class for uploaders. Subclasses implement
+    _child_exists(child_name, parent_folder_id),
+    _create_remote_folder(folder_name, parent_id), which creates with
+    conflictBehavior=fail and returns the folder, or None if it could not,
+    get_drive_url() and graph_get(url) """
+
+    def reset_remote_folder_cache(self):
+        self._remote_folder_ids = {}
+        self._remote_folder_locks = {}
+        self._remote_folder_locks_lock = threading.Lock()
+
+    def get_remote_folder_id(self, folder_path: str = '', parent_id: str = ''):
+        """ Return the ID of the destination folder mirroring the local folder_path
+        inside parent_id, creating it on first use. Return None on failure. """
+        if folder_path in self._remote_folder_ids:
+            return self._remote_folder_ids[folder_path]
+        with self._remote_folder_locks_lock:
+            lock = self._remote_folder_locks.setdefault(folder_path, threading.Lock())
+        with lock:
+            if folder_path in self._remote_folder_ids:
+                return self._remote_folder_ids[folder_path]
+            folder_name = self.get_name_of_folder_or_file_from_path(folder_path)
+            exists, folder = self._child_exists(child_name=folder_name, parent_folder_id=parent_id)
+            if not exists:
+                folder = self._create_remote_folder(folder_name=folder_name, parent_id=parent_id)
+                if not folder or 'error' in folder:
+                    # 409: created by another run since the lookup
+                    exists, folder = self._child_exists(child_name=folder_name, parent_folder_id=parent_id)
+            if not folder or 'id' not in folder:
+                self.error({'get_remote_folder_id': {
+                    'error': 'failed to create folder', 'folder_path': folder_path, 'parent_id': parent_id}})
+                return None
+            self._remote_folder_ids[folder_path] = folder['id']
+            return folder['id']
+
+    def resolve_remote_folder_id(self, folder_path: str = '', base_path: str = '', base_parent_id: str = ''):
+        """ get_remote_folder_id for any folder under base_path (which itself
+        goes in base_parent_id), resolving its ancestors first """
+        if folder_path in self._remote_folder_ids:
+            return self._remote_folder_ids[folder_path]
+        if os.path.normpath(folder_path) == os.path.normpath(base_path):
+            parent_id = base_parent_id
+        elif os.path.dirname(folder_path) == folder_path:
+            # reached the filesystem root: folder_path is not under base_path
+            return None
+        else:
+            parent_id = self.resolve_remote_folder_id(os.path.dirname(folder_path), base_path, base_parent_id)
+        if not parent_id:
+            return None
+        return self.get_remote_folder_id(folder_path=folder_path, parent_id=parent_id)
+
+    def get_children_from_folder_id(self, folder_id: str = ''):
+        """ All children of a destination folder (the drive root if no
+        folder_id), following every @odata.nextLink, with only the fields in
+        GRAPH_CHILDREN_SELECT. None if a page could not be read. """
+        if not folder_id or folder_id == 'root':
+            url = f'{self.get_drive_url()}/root/children'
+        else:
+            url = f'{self.get_drive_url()}/items/{folder_id}/children'
+        url = f'{url}?$top={GRAPH_PAGE_SIZE}&$select={GRAPH_CHILDREN_SELECT}'
+        children = []
+        while url:
+            response = self.graph_get(url=url)
+            if not response or 'value' not in response:
+                return None
+            children.extend(response['value'])
+            url = response.get('@odata.nextLink')
+        return children
+
+    def build_remote_path_index(self, base_path: str = '', base_folder_id: str = ''):
+        """ PathIndex of the files in the destination folder base_folder_id
+        (which mirrors local base_path) and all its subfolders. Each folder is
+        listed once, up to DESTINATION_LIST_THREADS folders at a time; the
+        index is only built in this thread. """
+        index = PathIndex(base_path)
+        with ThreadPoolExecutor(max_workers=DESTINATION_LIST_THREADS) as executor:
+            pending = {executor.submit(self.get_children_from_folder_id, base_folder_id): index.root}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = pending.pop(future)
+                    children = future.result()
+                    if children is None:
+                        # its files would be transferred again
+                        self.error({'build_remote_path_index': {
+                            'error': 'failed to list folder', 'folder_path': node.path}})
+                        continue
+                    for child in children:
+                        if 'file' in child:
+                            index.add_file(node, child)
+                        elif 'folder' in child:
+                            folder = executor.submit(self.get_children_from_folder_id, child['id'])
+                            pending[folder] = index.add_folder(node, child['name'])
+        return index
+
+    def count_remote_files_recursively(self, folder_id: str = ''):
+        """ Number of files in a destination folder and all its subfolders """
+        return len(self.build_remote_path_index(base_path='', base_folder_id=folder_id))
+
+    def create_remote_folder_tree(self, folder_paths=(), base_path: str = '', base_parent_id: str = ''):
+        """ Create the destination folders for folder_paths (local paths under
+        base_path, which itself goes in base_parent_id) before any upload.
+        Folders are created a level at a time, each level in parallel. """
+        levels = {}
+        for path in folder_paths:
+            relative = os.path.relpath(path, base_path)
+            parts = [] if relative == os.curdir else relative.split(os.sep)
+            # every ancestor up to base_path needs a folder too
+            for depth in range(len(parts) + 1):
+                levels.setdefault(depth, set()).add(os.path.join(base_path, *parts[:depth]))
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_THREADS) as executor:
+            for depth in sorted(levels):
+                pending = []
+                for path in sorted(levels[depth]):
+                    parent_id = base_parent_id if depth == 0 else self._remote_folder_ids.get(os.path.dirname(path))
+                    # a folder whose parent failed is left to the upload pass
+                    if parent_id:
+                        pending.append((path, parent_id))
+                list(executor.map(lambda args: self.get_remote_folder_id(*args), pending))
+        self.info({'create_remote_folder_tree': {
+            'folders': len(self._remote_folder_ids), 'levels': len(levels)}})
@@ -0,0 +1,74 @@
+""" Scan-and-migrate: the transfer plan of a scan that is migrated while it
+runs. Instead of planning the whole scan once it is crawled, each folder's
+files are planned as soon as the folder is listed (see
+GoogleToSharePoint.on_folder_scanned): their destination names are resolved
+(naming.NamePlan, per folder) and they are compared with the destination
+(transferplan.TransferPlan.add). The new and changed files are handed to the
+transfer right away, and the totals used for progress grow with them.
+
+Folders scanned before the destination is indexed wait until it is. """
+import os
+import threading
+from .naming import NamePlan
+from .transferplan import TransferPlan, UNCHANGED
+
+
+class ScanStream:
+    """ Plans scanned folders for a downloader and passes the files to
+    transfer to put(files). Thread-safe. """
+
+    def __init__(self, downloader=None, transferred: dict = {}, put=None):
+        """ transferred: {file id: (md5Checksum, quickXorHash)} recorded by
+        earlier transfers. put: called with each list of files to transfer """
+        self.downloader = downloader
+        self.transferred = transferred
+        self.put = put
+        self.plan = None
+        self.num_renamed = 0
+        self.num_path_too_long = 0
+        self._names_taken = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add_folder(self, files: list = [], parent_folder_local_path: str = '', folder_paths=()):
+        """ Plan the scanned files of the folder at parent_folder_local_path,
+        whose subfolders are folder_paths """
+        with self._lock:
+            if self.plan is None:
+                self._pending.append((files, folder_paths))
+            else:
+                self._plan_folder(files, folder_paths)
+
+    def set_destination_files(self, destination_files=None):
+        """ Start planning against destination_files (a PathIndex), with the
+        folders scanned so far """
+        with self._lock:
+            self.plan = self.downloader.transfer_plan = TransferPlan(
+                destination_files=destination_files, transferred=self.transferred)
+            pending, self._pending = self._pending, []
+            for files, folder_paths in pending:
+                self._plan_folder(files, folder_paths)
+
+    def _plan_folder(self, files: list = [], folder_paths=()):
+        name_plan = NamePlan(
+            files, base_path=self.downloader.local_temp_dir, folder_paths=folder_paths,
+            names_taken=self._names_taken)
+        name_plan.apply(files)
+        self.num_renamed += len(name_plan.renamed)
+        self.num_path_too_long += len(name_plan.too_long)
+        if name_plan.renamed:
+            self.downloader.info({'_resolve_destination_names': {'renamed': [
+                os.path.join(files[i]['parent_folder_local_path'], files[i]['name']) for i in name_plan.renamed]}})
+        if name_plan.too_long:
+            self.downloader.error({'_resolve_destination_names': {'path_too_long': [
+                os.path.join(files[i]['parent_folder_local_path'], files[i]['name']) for i in name_plan.too_long]}})
+        files_to_transfer = self.plan.add(files)
+        self.downloader.num_files_already_in_destination = len(self.plan.files[UNCHANGED])
+        if files_to_transfer:
+            self.downloader.total_migratable_files += len(files_to_transfer)
+            self.downloader.uploader.set_todo_count(total_files_to_upload=self.downloader.total_migratable_files)
+            self.put(files_to_transfer)
+
+    def summary(self):
+        """ Like NamePlan.summary(), for all the folders planned """
+        return {'renamed': self.num_renamed, 'path_too_long': self.num_path_too_long}
@@ -0,0 +1,70 @@
+""" Order in which scanned files are transferred. The threads engine downloads
+a batch, uploads it and starts the next, so a batch takes as long as its
+slowest download thread; the asyncio engine pulls files one at a time from a
+shared queue. Policies (TRANSFER_SCHEDULE):
+
+    listing         scan order (the original behaviour)
+    largest-first   biggest files first, so no huge file starts last and sets the tail
+    smallest-first  smallest files first, for quick visible progress
+    bin-pack        largest-first, with batches also capped at BATCH_BYTE_BUDGET bytes,
+                    which bounds the temp disk a batch needs
+
+Files are held in a deque of their positions in files_list, sorted once by
+size, so handing out a file is O(1) and files_list (a FileManifest for large
+scans) is not copied into one dict per file up front. Google-native files have
+no size until exported and count as 0 bytes. """
+from collections import deque
+from .constants import BATCH_BYTE_BUDGET, FILE_BATCH_SIZE, TRANSFER_SCHEDULE
+from .manifest import FileManifest
+
+SCHEDULING_POLICIES = ('listing', 'largest-first', 'smallest-first', 'bin-pack')
+
+
+def get_file_size(file: dict = {}):
+    return int(file.get('size') or 0)
+
+
+class TransferScheduler:
+    """ Hands out files_list in batches (threads engine) or one at a time
+    (asyncio engine, by iterating) in the order of policy """
+
+    def __init__(self, files_list: list = [], policy: str = TRANSFER_SCHEDULE,
+                 batch_size: int = FILE_BATCH_SIZE, batch_bytes: int = BATCH_BYTE_BUDGET):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f'unknown transfer schedule {policy!r}; expected one of {SCHEDULING_POLICIES}')
+        self.policy = policy
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self._files_list = files_list
+        if policy == 'listing':
+            self._files = deque(range(len(files_list)))
+        else:
+            self._files = deque(sorted(
+                range(len(files_list)), key=self._get_size, reverse=policy != 'smallest-first'))
+
+    def _get_size(self, index: int = 0):
+        if isinstance(self._files_list, FileManifest):
+            # read from the size column without building the file's dict
+            return self._files_list.get_size(index)
+        return get_file_size(self._files_list[index])
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        while self._files:
+            yield self._files_list[self._files.popleft()]
+
+    def next_batch(self):
+        """ Remove and return the next batch: up to batch_size files and, for
+        bin-pack, up to batch_bytes bytes (a larger file gets a batch of its own) """
+        if self.policy != 'bin-pack':
+            return [self._files_list[self._files.popleft()] for _ in range(min(self.batch_size, len(self._files)))]
+        # next-fit decreasing: files of similar size share a batch, so its
+        # threads finish at about the same time
+        batch, budget = [], self.batch_bytes
+        while self._files and len(batch) < self.batch_size and (
+                not batch or self._get_size(self._files[0]) <= budget):
+            budget -= self._get_size(self._files[0])
+            batch.append(self._files_list[self._files.popleft()])
+        return batch
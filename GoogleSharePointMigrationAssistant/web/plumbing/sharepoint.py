@@ -3,15 +3,18 @@ import time
 from msal import SerializableTokenCache
 from concurrent.futures import ThreadPoolExecutor, wait
 import json
-from sanitize_filename import sanitize
 from django.conf import settings
-from .constants import MAX_UPLOAD_THREADS
+from .constants import MAX_UPLOAD_THREADS, SMALL_FILE_FAST_PATH, VERIFY_UPLOADS
+from .contenthash import verify_quick_xor_hash
 from .m365_util import get_token_from_cache
 from .base import BaseUtil
 from ..models import Migration
 from .graphutil import GraphUtil
+from .pathindex import PathIndex
+from .remotefolders import RemoteFolderCache
+from .tracing import current_span, traced
 
-class SharePointUploader(BaseUtil, GraphUtil):
+class SharePointUploader(BaseUtil, GraphUtil, RemoteFolderCache):
     def __init__(self,
                  migration: Migration = None,
                  m365_token_cache: SerializableTokenCache = None,
@@ -27,6 +30,7 @@ class SharePointUploader(BaseUtil, GraphUtil):
         self.set_relative_base()
         self._num_active_uploads = 0
         self._num_failed = 0
+        self.reset_remote_folder_cache()
 
     def set_relative_base(self):
         if self.migration.target_folder_name == 'root':
@@ -39,6 +43,8 @@ class SharePointUploader(BaseUtil, GraphUtil):
                   use_multithreading=False
                   ):
         """ allow reconfiguration of existing uploader objects """
+        if migration != self.migration:
+            self.reset_remote_folder_cache()
         self.migration = migration
         self.use_multithreading = use_multithreading
         self.num_completed_uploads = 0
@@ -48,6 +54,15 @@ class SharePointUploader(BaseUtil, GraphUtil):
     def set_todo_count(self, total_files_to_upload: int = 0):
         self.total_files_to_upload = total_files_to_upload
 
+    def get_drive_url(self):
+        """ Graph URL of the target document library (drive) """
+        return f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}'
+
+    def get_upload_base_folder_id(self):
+        """ ID of the drive item that the migrated folder is created in """
+        return self.migration.target_folder_id
+
+    @traced('_create_folder', lambda a: {'folder.path': a['folder_path']})
     def _create_sharepoint_folder(self, folder_path='', parent_id=None):
         """ Given a parent ID and a folder name, create a new folder with that name in the parent """
         folder_name = self.get_name_of_folder_or_file_from_path(folder_path)
@@ -63,52 +78,31 @@ class SharePointUploader(BaseUtil, GraphUtil):
             data=json.dumps({
                 'name': folder_name,
                 'folder': {},
-                '@microsoft.graph.conflictBehavior': 'rename'
-            })
+                '@microsoft.graph.conflictBehavior': 'fail'
+            }),
+            accept_status_codes=(409,)
         )
 
-    def get_flattened_files_dict_in_remote_folder(self, local_folder_base_path: str = '', remote_folder_id: str = ''):
-        """ 
-        Use recursion to return a flattned map of all files in the passed folder's
-        hierarchy. key = parent_folder_local_path, value = name. 
-        A dictionary is 6.6 times faster than a list when we lookup in 100 items.
-        When it comes to 10,000,000 items a dictionary lookup can be 585714 times faster than a list lookup.
-        * remote folder id is id of drive item
-        * local folder base path is the path to where that folder lives 
-        locally during local download/upload process
-        """
-        files_dict = {}
-        if not remote_folder_id:
-            # Base. Remote parent folder is currently root.
-            folder_name = self.get_name_of_folder_or_file_from_path(
-                local_folder_base_path)
-            exists, folder = self._child_exists(
-                child_name=folder_name, parent_folder_id='root')  # define me
-            self.debug({'get_flattened_files_dict_in_remote_folder': {
-                'folder_name': folder_name,
-                'already_in_target': exists,
-            }})
-            if exists:
-                remote_folder_id = folder['id']
-                self.base_folder_id = remote_folder_id
-            else:
-                return {}
-        children = self.get_children_from_folder_id(folder_id=remote_folder_id)
-        files = [c for c in children if 'file' in c]
-        for f in files:
-            fname = sanitize(f['name'])
-            key = f'PARENT<{local_folder_base_path}>PARENT--FILENAME<{fname}>FILENAME'
-            f['parent_folder_local_path'] = local_folder_base_path
-            files_dict[key] = f
-        folders = [c for c in children if 'folder' in c]
-        for f in folders:
-            f_local_path = os.path.join(local_folder_base_path, f['name'])
-            # merge dictionary with subfolder dictionary.
-            files_dict = files_dict | self.get_flattened_files_dict_in_remote_folder(
-                remote_folder_id=f['id'], local_folder_base_path=f_local_path
-            )
-        return files_dict
+    def _create_remote_folder(self, folder_name: str = '', parent_id: str = ''):
+        return self._create_sharepoint_folder(folder_path=folder_name, parent_id=parent_id)
+
+    def get_remote_path_index(self, local_folder_base_path: str = ''):
+        """ PathIndex (see pathindex.py) of all files already in the destination
+        folder that mirrors local_folder_base_path, which the migrated folder is
+        created in inside the target folder. Empty if it is not there yet. """
+        folder_name = self.get_name_of_folder_or_file_from_path(local_folder_base_path)
+        exists, folder = self._child_exists(
+            child_name=folder_name, parent_folder_id=self.get_upload_base_folder_id())
+        self.debug({'get_remote_path_index': {
+            'folder_name': folder_name,
+            'already_in_target': exists,
+        }})
+        if not exists:
+            return PathIndex(local_folder_base_path)
+        self.base_folder_id = folder['id']
+        return self.build_remote_path_index(local_folder_base_path, folder['id'])
 
+    @traced('_child_exists', lambda a: {'child.name': a['child_name']})
     def _child_exists(self, child_name: str = '', parent_folder_id: str = ''):
         """ Determine if a child (by name) of a given parent folder (by id) exists already. Return boolean. """
         self.info(
@@ -131,20 +125,6 @@ class SharePointUploader(BaseUtil, GraphUtil):
             self.error({'_child_exists': {'error': str(e), 'child_name': child_name, 'parent_folder_id': parent_folder_id}})
         return exists, child
 
-    def get_children_from_folder_id(self, folder_id: str = ''):
-        """ Given a folder id, return its children. If no folder id provided, use root. """
-        if not folder_id:
-            url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/root/children'
-        else:
-            url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/items/{folder_id}/children'
-     
-        result = get_token_from_cache(m365_token_cache=self.m365_token_cache)
-        response = self.graph_get(url=url)
-        if 'value' in response:
-            return response['value']
-        else:
-            return None
-
     def get_progress(self):
         return f'{round(self.num_completed_uploads / self.total_files_to_upload, 2) * 100 }%'
 
@@ -177,9 +157,10 @@ class SharePointUploader(BaseUtil, GraphUtil):
 
     
 
-    def _create_upload_session(self, file_name: str = '', file_size: int = 0, parent_id: str = ''):
+    def _create_upload_session(self, file_name: str = '', file_size: int = 0, parent_id: str = '', replace: bool = False):
         """ Given the ID of some parent (either root of drive or specific folder/item), 
-        create an upload session into that item and return the data describing that upload session """
+        create an upload session into that item and return the data describing that upload session.
+        With replace, the upload replaces an existing file of the same name instead of being renamed. """
         if not parent_id:
             if self.migration.target_folder_id == 'root':
                 url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/root:/{file_name}:/createUploadSession'
@@ -191,14 +172,14 @@ class SharePointUploader(BaseUtil, GraphUtil):
         result = get_token_from_cache(m365_token_cache=self.m365_token_cache)
         payload = {
             "item": { 
-                "@microsoft.graph.conflictBehavior": "rename",
+                "@microsoft.graph.conflictBehavior": "replace" if replace else "rename",
             }
         }  
         response = self.graph_post(url=url, data=json.dumps(payload))
         return response
 
 
-    def _upload_file_in_chunks(self, file_path: str = '', parent_id: str = ''):
+    def _upload_file_in_chunks(self, file_path: str = '', parent_id: str = '', replace: bool = False):
         file_name = self.get_name_of_folder_or_file_from_path(file_path)
         file_size = os.path.getsize(file_path)
         self.info(f'Uploading file in chunks: {file_name}')
@@ -207,6 +188,7 @@ class SharePointUploader(BaseUtil, GraphUtil):
             file_name=file_name,
             file_size=file_size,
             parent_id=parent_id,
+            replace=replace,
         )
         if 'uploadUrl' in upload_session:
             upload_session_url = upload_session['uploadUrl']
@@ -244,8 +226,11 @@ class SharePointUploader(BaseUtil, GraphUtil):
                 i += 1
         return response
 
-    def _upload_complete_file(self, file_path: str = '', file_name: str = '', parent_id: str = '', total_file_size: int = 0): 
-        """ Upload a complete  file without creating a resumable upload session. """
+    def _upload_complete_file(self, file_path: str = '', file_name: str = '', parent_id: str = '', total_file_size: int = 0,
+                              if_absent: bool = False, replace: bool = False): 
+        """ Upload a complete  file without creating a resumable upload session.
+        With if_absent, an existing file of the same name is left alone and the
+        409 error response is returned; with replace, it is replaced. """
         if not parent_id:
             if self.migration.target_folder_id == 'root':
                 url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/root:/{file_name}:/content'
@@ -253,6 +238,10 @@ class SharePointUploader(BaseUtil, GraphUtil):
                 url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/items/{self.migration.target_folder_id}:/{file_name}:/content'
         else:
             url = f'{settings.GRAPH_API_URL}/sites/{self.migration.target_site_id}/drives/{self.migration.target_document_library_id}/items/{parent_id}:/{file_name}:/content'
+        if if_absent:
+            url = f'{url}?@microsoft.graph.conflictBehavior=fail'
+        elif replace:
+            url = f'{url}?@microsoft.graph.conflictBehavior=replace'
         result = get_token_from_cache(m365_token_cache=self.m365_token_cache)
         with open(file_path, 'rb') as f:
             content = f.read() 
@@ -263,38 +252,72 @@ class SharePointUploader(BaseUtil, GraphUtil):
                     'Content-Type': 'text/plain', 
                     'Content-Length': f'{total_file_size}'
                     },
-                data=content
+                data=content,
+                accept_status_codes=(409,) if if_absent else ()
             )
             return response
 
+    def _upload_small_file(self, file_path: str = '', file_name: str = '', parent_id: str = '', total_file_size: int = 0):
+        """ Small-file fast path: a single PUT that fails with 409 if the name
+        is taken, instead of a _child_exists GET before the PUT """
+        self._num_active_uploads += 1
+        file = None
+        try:
+            current_span().set_attribute('bytes', total_file_size)
+            file = self._upload_complete_file(
+                file_path=file_path, file_name=file_name, parent_id=parent_id,
+                total_file_size=total_file_size, if_absent=True)
+            if file and 'error' in file:
+                self.info({'_upload_file': {'file_already_exists': f'{file_name} in {parent_id}'}})
+                file = None
+            elif not file:
+                file = self._upload_file_in_chunks(file_path=file_path, parent_id=parent_id)
+            self.num_completed_uploads += 1
+        except Exception as e:
+            self.error({'_upload_file': {'error': str(e)}})
+            current_span().set_error(e)
+            self._num_failed += 1
+            file = None
+        self._num_active_uploads -= 1
+        self.info({'_upload_file': {'progress': self.get_progress()}})
+        return file
+
 
-    def _upload_file(self, file_path=None, parent_id: str = ''):
+    @traced('_upload_file', lambda a: {'file.name': os.path.basename(a['file_path'])})
+    def _upload_file(self, file_path=None, parent_id: str = '', total_file_size: int = None, replace: bool = False):
         """ Given a path to a downloaded file, upload that file to the target 
-        folder on the target site.
+        folder on the target site. With replace, it replaces the file of the
+        same name there (a file changed at the source), keeping its history.
         Referenced documentation for using upload sessions: 
         https://docs.microsoft.com/en-us/onedrive/developer/rest-api/api/driveitem_createuploadsession?view=odsp-graph-online
         """  
         file = None 
         file_name = self.get_name_of_folder_or_file_from_path(file_path) 
-        exists, file = self._child_exists(child_name=file_name, parent_folder_id=parent_id)
+        if total_file_size is None:
+            total_file_size = os.path.getsize(file_path)
+        if SMALL_FILE_FAST_PATH and self.less_than_4mb(total_file_size) and not replace:
+            return self._upload_small_file(
+                file_path=file_path, file_name=file_name, parent_id=parent_id, total_file_size=total_file_size)
+        exists, file = (False, None) if replace else self._child_exists(child_name=file_name, parent_folder_id=parent_id)
         if not exists:
             self._num_active_uploads += 1
             try:   
-                total_file_size = os.path.getsize(file_path)
+                current_span().set_attribute('bytes', total_file_size)
                 if not self.less_than_4mb(total_file_size):
                     file = self._upload_file_in_chunks(
-                        file_path=file_path, parent_id=parent_id)
+                        file_path=file_path, parent_id=parent_id, replace=replace)
                 else:
                     file = self._upload_complete_file(
                         file_path=file_path, file_name=file_name,
-                        parent_id=parent_id, total_file_size=total_file_size)
+                        parent_id=parent_id, total_file_size=total_file_size, replace=replace)
                     if not file:
                         file = self._upload_file_in_chunks(
-                            file_path=file_path, parent_id=parent_id)
+                            file_path=file_path, parent_id=parent_id, replace=replace)
                 
                 self.num_completed_uploads += 1 
             except Exception as e:
                 self.error({'_upload_file': {'error': str(e)}})
+                current_span().set_error(e)
                 self._num_failed += 1
                 file = None 
             self._num_active_uploads -= 1   
@@ -304,31 +327,71 @@ class SharePointUploader(BaseUtil, GraphUtil):
         self.info({'_upload_file': {'progress': self.get_progress()}})
         return file 
 
+    @traced('_upload_folder', lambda a: {'folder.path': a['folder_path']})
     def _upload_folder_and_contents(self, folder_path: str = '', parent_id: str = ''):
         """ Create the local folder on sharepoint target and also upload all of the contents """
         self._num_active_uploads += 1
-        folder = self._create_sharepoint_folder(
-            folder_path=folder_path, parent_id=parent_id)
+        folder_id = self.get_remote_folder_id(
+            folder_path=folder_path, parent_id=parent_id or self.get_upload_base_folder_id())
+        if not folder_id:
+            self._num_active_uploads -= 1
+            return
         if self.use_multithreading:
             self._multithreaded_upload(
-                folder_path=folder_path, parent_id=folder['id'])
+                folder_path=folder_path, parent_id=folder_id)
         else:
             self._singlethreaded_upload(
-                folder_path=folder_path, parent_id=folder['id'])
+                folder_path=folder_path, parent_id=folder_id)
         self._num_active_uploads -= 1
         self.info({
             '_upload_folder_and_contents': {'progress': self.get_progress()}
         })
 
-    def count_remote_files_recursively(self, folder_id: str = ''):
-        """ given a folder, count its files recursively """
-        children = self.get_children_from_folder_id(folder_id)
-        count = 0
-        if children is not None:
-            for child in children:
-                count += 1 if not 'folder' in child else \
-                    self.count_remote_files_recursively(folder_id=child['id'])
-        return count
+    def _upload_file_record(self, record=None, base_path: str = '', base_parent_id: str = ''):
+        parent_id = self.resolve_remote_folder_id(
+            folder_path=record.parent_folder_local_path, base_path=base_path, base_parent_id=base_parent_id)
+        if not parent_id:
+            self.error({'_upload_file': {'error': 'no destination folder', 'file_path': record.local_path}})
+            self._num_failed += 1
+            return None
+        # a file changed at the source replaces its destination copy in place
+        return self._upload_file(
+            file_path=record.local_path, parent_id=parent_id, total_file_size=record.size,
+            replace=bool(record.replaces_item_id))
+
+    def upload_files(self, files=(), base_path: str = '', base_parent_id: str = ''):
+        """ Upload the UploadRecords of a download batch, each into the
+        destination folder mirroring its local parent folder under base_path
+        (which itself goes in base_parent_id). Unlike upload(), this does not
+        walk the local folder. Returns the records whose upload failed
+        verification; their uploaded copies have been deleted, unless they
+        replaced a destination file (the re-transfer replaces them again). """
+        files = list(files)
+        num_threads = MAX_UPLOAD_THREADS if self.use_multithreading else 1
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [
+                executor.submit(self._upload_file_record, record, base_path, base_parent_id)
+                for record in files]
+            wait(futures)
+        mismatched = []
+        if VERIFY_UPLOADS:
+            for record, future in zip(files, futures):
+                item = future.result()
+                if verify_quick_xor_hash(item, record.quick_xor_hash) is False:
+                    self.error({'upload_files': {
+                        'hash_mismatch': record.local_path, 'expected': record.quick_xor_hash,
+                        'reported': item['file']['hashes']['quickXorHash']}})
+                    if not record.replaces_item_id:
+                        # remove the bad copy so that the re-transfer is not a name conflict
+                        self.delete_item(item['id'])
+                    self.num_completed_uploads -= 1
+                    mismatched.append(record)
+        self.info({'upload_files': {
+            'files': len(futures), 'hash_mismatches': len(mismatched), 'progress': self.get_progress()}})
+        return mismatched
+
+    def delete_item(self, item_id: str = ''):
+        return self.graph_delete(url=f'{self.get_drive_url()}/items/{item_id}')
 
     def upload(self, local_folder_base_path: str = ''):
         self.num_completed_uploads = 0
@@ -0,0 +1,252 @@
+""" Lightweight, OpenTelemetry-style tracing for the migration plumbing.
+Spans (name, attributes, start/end, parent, status) are recorded around Drive
+and Graph calls and collected in-process by a SpanCollector, which writes a
+per-migration latency breakdown (JSON) that can be read offline. Span
+context is held in a ContextVar, so nesting works in threads and in asyncio tasks. """
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from .constants import TRACING_ENABLED, TRACE_MAX_RECORDED_SPANS
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """ One timed operation. Attributes follow OTel naming where one exists
+    (e.g. http.status_code); file.id, file.size, bytes and retries are ours. """
+    __slots__ = ('name', 'span_id', 'parent_id', 'attributes', 'start', 'end', 'status', '_token')
+
+    def __init__(self, name: str = '', attributes: dict = None, parent=None):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start = time.perf_counter()
+        self.end = None
+        self.status = 'OK'
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set_attribute(self, key: str = '', value=None):
+        self.attributes[key] = value
+
+    def increment(self, key: str = 'retries', amount: int = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def set_error(self, error=None):
+        self.status = 'ERROR'
+        if error is not None:
+            self.attributes['error'] = str(error)
+
+    def to_dict(self, epoch: float = 0):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_ms': round((self.start - epoch) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    """ Returned by current_span() outside of any span, so callers never need to check """
+
+    def set_attribute(self, key: str = '', value=None):
+        pass
+
+    def increment(self, key: str = 'retries', amount: int = 1):
+        pass
+
+    def set_error(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    """ The innermost active span, or a no-op span """
+    return _current_span.get() or NOOP_SPAN
+
+
+class SpanCollector:
+    """ In-process exporter. Keeps running totals per span name (all spans) and
+    the raw spans (up to max_recorded_spans) for one migration. """
+
+    def __init__(self, name: str = '', max_recorded_spans: int = TRACE_MAX_RECORDED_SPANS, enabled: bool = TRACING_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.max_recorded_spans = max_recorded_spans
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.epoch = time.perf_counter()
+        self.spans = []
+        self.durations = {}
+        self.totals = {}
+        self.dropped = 0
+
+    ### RECORDING ###
+
+    def start_span(self, name: str = '', attributes: dict = None):
+        span = Span(name=name, attributes=attributes, parent=_current_span.get())
+        span._token = _current_span.set(span)
+        return span
+
+    def end_span(self, span: Span = None):
+        span.end = time.perf_counter()
+        _current_span.reset(span._token)
+        with self._lock:
+            self.durations.setdefault(span.name, []).append(span.duration)
+            totals = self.totals.setdefault(span.name, {'errors': 0, 'retries': 0, 'bytes': 0})
+            totals['errors'] += span.status == 'ERROR'
+            totals['retries'] += span.attributes.get('retries', 0)
+            totals['bytes'] += span.attributes.get('bytes') or 0
+            if len(self.spans) < self.max_recorded_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def span(self, name: str = '', **attributes):
+        """ Context manager: with collector.span('getlist', query=q) as span: ... """
+        return _SpanContext(self, name, attributes)
+
+    ### EXPORT ###
+
+    def breakdown(self):
+        """ Per span name: count, total/mean/p50/p95/max latency, errors, retries, bytes.
+        Sorted by total time. Nested spans overlap their parents; compare like with like. """
+        summary = {}
+        with self._lock:
+            for name, durations in self.durations.items():
+                durations = sorted(durations)
+                count = len(durations)
+                summary[name] = {
+                    'count': count,
+                    'total_seconds': round(sum(durations), 3),
+                    'mean_ms': round(sum(durations) / count * 1000, 3),
+                    'p50_ms': round(durations[int(count * 0.50)] * 1000, 3),
+                    'p95_ms': round(durations[min(int(count * 0.95), count - 1)] * 1000, 3),
+                    'max_ms': round(durations[-1] * 1000, 3),
+                    **self.totals[name],
+                }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['total_seconds']))
+
+    def format_breakdown(self):
+        """ breakdown() as a fixed-width table for logs """
+        lines = [f'{"span":<28}{"count":>8}{"total s":>10}{"mean ms":>10}{"p95 ms":>10}{"max ms":>10}{"retries":>9}{"errors":>8}']
+        for name, s in self.breakdown().items():
+            lines.append(
+                f'{name:<28}{s["count"]:>8}{s["total_seconds"]:>10}{s["mean_ms"]:>10}'
+                f'{s["p95_ms"]:>10}{s["max_ms"]:>10}{s["retries"]:>9}{s["errors"]:>8}')
+        return '\n'.join(lines)
+
+    def export(self, path: str = ''):
+        """ Write the breakdown and the recorded spans to path as JSON """
+        with self._lock:
+            spans = [s.to_dict(self.epoch) for s in self.spans]
+        with open(path, 'w') as f:
+            json.dump({
+                'name': self.name,
+                'wall_seconds': round(time.perf_counter() - self.epoch, 3),
+                'breakdown': self.breakdown(),
+                'dropped_spans': self.dropped,
+                'spans': spans,
+            }, f, indent=1, default=str)
+        return path
+
+
+class _SpanContext:
+    __slots__ = ('collector', 'name', 'attributes', 'span')
+
+    def __init__(self, collector: SpanCollector = None, name: str = '', attributes: dict = None):
+        self.collector = collector
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        if not self.collector.enabled:
+            return NOOP_SPAN
+        self.span = self.collector.start_span(self.name, self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.collector.enabled:
+            if exc is not None:
+                self.span.set_error(exc)
+            self.collector.end_span(self.span)
+        return False
+
+
+def get_url_attribute(url: str = ''):
+    """ url as recorded in a span: scheme, host and path. The query is left
+    out, as it can carry credentials (the tempauth of an upload session's
+    uploadUrl), and exported spans are uploaded with the migration logs. """
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc.rpartition('@')[2], parts.path, '', ''))
+
+
+def traced(name: str = '', attributes=None):
+    """ Decorate a method of a class with a `tracer` (SpanCollector) attribute so
+    each call is recorded as a span. attributes, if given, maps the call's bound
+    arguments (a dict, including 'self') to span attributes. Works on coroutine
+    functions. Calls on objects without a tracer are not traced. """
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        def start(args, kwargs):
+            tracer = getattr(args[0], 'tracer', None) if args else None
+            if tracer is None or not tracer.enabled:
+                return None, None
+            span_attributes = None
+            if attributes is not None:
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    span_attributes = attributes(bound.arguments)
+                except Exception:
+                    span_attributes = None
+            return tracer, tracer.start_span(span_name, span_attributes)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                tracer, span = start(args, kwargs)
+                if span is None:
+                    return await func(*args, **kwargs)
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    span.set_error(e)
+                    raise
+                finally:
+                    tracer.end_span(span)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer, span = start(args, kwargs)
+            if span is None:
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                span.set_error(e)
+                raise
+            finally:
+                tracer.end_span(span)
+        return wrapper
+    return decorator
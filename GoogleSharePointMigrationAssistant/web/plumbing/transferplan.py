@@ -0,0 +1,127 @@
+""" Transfer plan of a scan. Each migratable source file is compared with the
+destination file at the same path, so a rerun transfers only what is new or
+has changed at the source since the last migration:
+
+- new: no destination file at that path
+- changed: the destination file differs from the source. This covers a
+  different size, and source content whose md5Checksum differs from the one
+  recorded at the last transfer. It also covers a destination quickXorHash
+  that differs from the one recorded at the last transfer. With no record to
+  go by, a source modifiedTime later than the destination
+  lastModifiedDateTime also counts.
+- unchanged: none of the above
+- deleted at source: a destination file that no source file maps to. It is
+  reported, not removed. """
+import itertools
+import os
+import re
+from datetime import datetime
+from .contenthash import verify_quick_xor_hash
+from .manifest import FileManifest
+from .pathindex import PathIndex
+
+NEW, CHANGED, UNCHANGED = 'new', 'changed', 'unchanged'
+
+
+def parse_timestamp(value: str = ''):
+    """ datetime of an RFC 3339 timestamp as written by Drive and Graph
+    ('2023-05-01T10:20:30.123Z'), or None """
+    if not value:
+        return None
+    # fromisoformat reads at most 6 fractional digits, and no 'Z' before 3.11
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value).replace('Z', '+00:00')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def compare_to_destination(file: dict = {}, item: dict = None, transferred: tuple = None):
+    """ NEW, CHANGED or UNCHANGED for a scanned source file, given the
+    destination drive item at its path (None if there is none) and the
+    (md5Checksum, quickXorHash) recorded when it was last transferred, if any """
+    if item is None:
+        return NEW
+    # Google-native files have no size until exported
+    if 'size' in file and int(file['size']) != item.get('size'):
+        return CHANGED
+    if transferred and file.get('md5Checksum'):
+        md5_checksum, quick_xor_hash = transferred
+        if md5_checksum != file['md5Checksum']:
+            return CHANGED
+        match = verify_quick_xor_hash(item, quick_xor_hash)
+        if match is not None:
+            return UNCHANGED if match else CHANGED
+    modified = parse_timestamp(file.get('modifiedTime'))
+    written = parse_timestamp(item.get('lastModifiedDateTime'))
+    if modified and written and modified > written:
+        return CHANGED
+    return UNCHANGED
+
+
+def is_log_file(item: dict = {}):
+    """ Whether a destination file is one of the migration logs uploaded into
+    the migrated folder, which have no source file """
+    parts = item.get('parent_folder_local_path', '').split(os.sep)
+    return any(part.startswith('migration-logs') for part in parts)
+
+
+class TransferPlan:
+    """ Scanned files by transfer status (each a FileManifest), and the
+    destination files deleted at the source. Files planned as changed get
+    'destination_item_id', the stale copy that the transfer replaces, and
+    unchanged files keep their recorded 'quick_xor_hash' for the next rerun.
+    Files can be added as they are scanned (see add()). """
+
+    def __init__(self, files_list: list = [], destination_files: PathIndex = None, transferred: dict = {}):
+        """ files_list: scanned migratable files. destination_files: the
+        uploader's get_remote_path_index(). transferred:
+        {file id: (md5Checksum, quickXorHash)} recorded by earlier transfers """
+        if destination_files is None:
+            destination_files = PathIndex()
+        self.destination_files = destination_files
+        self.transferred = transferred
+        self.files = {NEW: FileManifest(), CHANGED: FileManifest(), UNCHANGED: FileManifest()}
+        self._matched = set()
+        self._deleted_at_source = None
+        self.add(files_list)
+
+    def add(self, files_list: list = []):
+        """ Plan more scanned files. Return those to transfer (new or changed). """
+        files_to_transfer = []
+        for file in files_list:
+            item = self.destination_files.get(file['parent_folder_local_path'], file['name'])
+            status = compare_to_destination(file, item, self.transferred.get(file['id']))
+            file['transfer_status'] = status
+            if status == CHANGED:
+                file['destination_item_id'] = item['id']
+            elif status == UNCHANGED and file['id'] in self.transferred:
+                file['quick_xor_hash'] = self.transferred[file['id']][1]
+            if item is not None:
+                self._matched.add(item['id'])
+                self._deleted_at_source = None
+            if status != UNCHANGED:
+                files_to_transfer.append(file)
+            self.files[status].append(file)
+        return files_to_transfer
+
+    @property
+    def deleted_at_source(self):
+        """ Destination files that none of the files planned so far maps to """
+        if self._deleted_at_source is None:
+            self._deleted_at_source = [
+                item for item in self.destination_files
+                if item['id'] not in self._matched and not is_log_file(item)]
+        return self._deleted_at_source
+
+    @property
+    def files_to_transfer(self):
+        return FileManifest(itertools.chain(self.files[NEW], self.files[CHANGED]))
+
+    def summary(self):
+        return {
+            NEW: len(self.files[NEW]),
+            CHANGED: len(self.files[CHANGED]),
+            UNCHANGED: len(self.files[UNCHANGED]),
+            'deleted_at_source': len(self.deleted_at_source)
+        }
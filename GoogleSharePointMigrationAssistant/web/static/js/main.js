@@ -181,4 +181,93 @@ let fetchMigrationState = ({
         callback(data.success.state);
       }
     });
-};
\ No newline at end of file
+};
+
+let toggleGoogleDriveNode = (btn) => {
+  let node = btn.parentNode;
+  let children = node.querySelector(".google-drive-children");
+  if (!node.dataset.loaded) {
+    node.dataset.loaded = "true";
+    loadGoogleDriveChildren({
+      container: children,
+      parent: node.dataset.parent,
+      driveId: node.dataset.driveid,
+    });
+  }
+  children.classList.toggle("d-none");
+  btn.textContent = children.classList.contains("d-none") ? "+" : "-";
+};
+
+let loadGoogleDriveChildren = ({
+  container = null,
+  parent = "root",
+  driveId = "",
+  pageToken = "",
+}) => {
+  let params = new URLSearchParams({
+    parent: parent,
+    drive_id: driveId,
+    page_token: pageToken,
+  });
+  fetch(`/google-drive-browse?${params}`, {
+    method: "GET",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": CSRF_TOKEN,
+    },
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.error) {
+        let error = document.createElement("div");
+        error.classList.add("text-danger");
+        error.textContent = data.error;
+        container.appendChild(error);
+        return;
+      }
+      if (data.success.items.length === 0 && !pageToken) {
+        let empty = document.createElement("div");
+        empty.classList.add("text-muted");
+        empty.textContent = "No folders";
+        container.appendChild(empty);
+      }
+      data.success.items.forEach((item) => {
+        let isSharedDrive = item.mimeTypeFriendly === "Shared Drive";
+        let node = document.createElement("div");
+        node.classList.add("google-drive-node", "m-1");
+        node.dataset.parent = item.id;
+        node.dataset.driveid = isSharedDrive ? item.id : item.driveId || "";
+        let expand = document.createElement("button");
+        expand.classList.add("btn", "btn-outline-secondary", "btn-sm");
+        expand.title = "show folders";
+        expand.textContent = "+";
+        expand.addEventListener("click", () => toggleGoogleDriveNode(expand));
+        let use = document.createElement("a");
+        use.classList.add("btn", "btn-primary", "btn-sm", "rounded", "m-1");
+        use.title = `use ${item.name} as the source`;
+        use.href = isSharedDrive
+          ? `/use-google-drive-shared-drive-source/${item.id}`
+          : `/use-google-drive-folder-source/${item.id}`;
+        use.textContent = `${item.name} (${item.mimeTypeFriendly})`;
+        let children = document.createElement("div");
+        children.classList.add("google-drive-children", "ms-4", "d-none");
+        node.append(expand, use, children);
+        container.appendChild(node);
+      });
+      if (data.success.next_page_token) {
+        let more = document.createElement("button");
+        more.classList.add("btn", "btn-link", "btn-sm");
+        more.textContent = "Load more";
+        more.addEventListener("click", () => {
+          more.remove();
+          loadGoogleDriveChildren({
+            container: container,
+            parent: parent,
+            driveId: driveId,
+            pageToken: data.success.next_page_token,
+          });
+        });
+        container.appendChild(more);
+      }
+    });
+};
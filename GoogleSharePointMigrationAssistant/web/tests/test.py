@@ -1,5 +1,6 @@
 from django.test import TestCase, override_settings
-from ..models import Migration, User, Profile, AdministrationSettings
+from django.urls import reverse
+from ..models import Migration, MigrationFile, User, Profile, AdministrationSettings
 from .conf import *
 
 @override_settings(
@@ -154,3 +155,20 @@ class MigrationGoogleFolderTestCase(BaseTest):
     def test_job_status(self):
         val = self.migration.job_status
         self.assertEquals(val, 'Waiting to scan source data')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_scan_report_lists_only_files_to_transfer(self):
+        self.migration.source_data_scan_result = {
+            'total_migratable_size': '2 B', 'total_migratable_count': 1,
+            'total_unmigratable_size': '0B', 'total_unmigratable_count': 0,
+            'transfer_plan': {'new': 1, 'changed': 0, 'unchanged': 1, 'deleted_at_source': 0}}
+        self.migration.save()
+        for file_id, status in [('a', 'new'), ('b', 'unchanged')]:
+            MigrationFile.objects.create(
+                migration=self.migration, google_id=file_id, name=f'{status}-file.txt', mime_type='text/plain',
+                size=1, transfer_status=status)
+        self.client.force_login(self.migration.user)
+        response = self.client.get(reverse('scan-source-report', args=[self.migration.id]))
+        self.assertContains(response, 'new-file.txt')
+        self.assertNotContains(response, 'unchanged-file.txt')
+        self.assertContains(response, 'Unchanged: 1')
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from urllib.parse import unquote
+import httpx
+from django.test import TestCase, override_settings
+from ..models import Migration, User, AdministrationSettings
+from ..plumbing.asynctransfer import AsyncTransferEngine
+from ..plumbing.contenthash import QuickXorHash
+from ..plumbing.exportcache import ExportCache
+from ..plumbing.googletosharepoint import GoogleToSharePoint
+from ..plumbing.sharepoint import SharePointUploader
+from ..plumbing.pathindex import PathIndex
+from .conf import *
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+DRIVE_TREE = {
+    'scoobydoobydoo-folder': [
+        {'id': 'file-small', 'name': 'notes.txt', 'mimeType': 'text/plain', 'size': '5'},
+        {'id': 'folder-sub', 'name': 'sub', 'mimeType': FOLDER_MIMETYPE},
+    ],
+    'folder-sub': [
+        {'id': 'file-doc', 'name': 'Report', 'mimeType': 'application/vnd.google-apps.document',
+         'exportLinks': {
+             'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+             'https://docs.google.com/feeds/download/documents/export/Export?id=file-doc&exportFormat=docx'}},
+        {'id': 'file-large', 'name': 'video.mp4', 'mimeType': 'video/mp4', 'size': str(5 * 1024 * 1024)},
+        {'id': 'file-form', 'name': 'Survey', 'mimeType': 'application/vnd.google-apps.form'},
+    ],
+}
+
+
+class UnreadStream(httpx.AsyncByteStream):
+    """ A response body that is only read when awaited, as from a real server """
+
+    def __init__(self, content: bytes = b''):
+        self.content = content
+
+    async def __aiter__(self):
+        yield self.content
+
+
+class MockDriveAndGraph:
+    """ Minimal stand-in for the Drive v3 and Graph endpoints used by the engine """
+
+    def __init__(self):
+        self.uploaded = {}
+        self.folders = {}
+        self.existing = set()
+        # names whose next simple upload reports a quickXorHash that does not match
+        self.corrupt = set()
+        self.requests = []
+        # called with the parent folder id of each Drive files.list request
+        self.before_list = None
+        # file ids whose next download is throttled with 403 rateLimitExceeded
+        self.throttled = set()
+        # names whose simple upload is rejected
+        self.rejected = set()
+        # status codes of the next upload session chunk responses
+        self.chunk_errors = []
+
+    def __call__(self, request: httpx.Request):
+        self.requests.append(request)
+        url, path = request.url, unquote(request.url.path)
+        if url.host == 'docs.google.com':
+            return httpx.Response(200, content=b'exported docx')
+        if url.host == 'www.googleapis.com':
+            if path == '/drive/v3/files':
+                q = url.params['q']
+                parent = q.split("'")[1]
+                if self.before_list:
+                    self.before_list(parent)
+                want_folders = f"mimeType = '{FOLDER_MIMETYPE}'" in q
+                files = [
+                    dict(f) for f in DRIVE_TREE.get(parent, [])
+                    if (f['mimeType'] == FOLDER_MIMETYPE) == want_folders
+                ]
+                return httpx.Response(200, json={'files': files})
+            file_id = path.split('/')[4]
+            if file_id in self.throttled:
+                self.throttled.discard(file_id)
+                return httpx.Response(403, stream=UnreadStream(json.dumps(
+                    {'error': {'errors': [{'reason': 'rateLimitExceeded'}]}}).encode()))
+            size = next(int(f.get('size', 0)) for fs in DRIVE_TREE.values() for f in fs if f['id'] == file_id)
+            return httpx.Response(200, content=b'x' * size)
+        if url.host == 'upload.example':
+            name = path.split('/')[-1]
+            if 'Authorization' in request.headers:
+                return httpx.Response(401, json={'error': 'upload URLs are pre-authenticated'})
+            if request.method == 'GET':
+                return httpx.Response(200, json={'nextExpectedRanges': [f'{self.uploaded.get(name, 0)}-']})
+            if self.chunk_errors:
+                return httpx.Response(self.chunk_errors.pop(0), json={'error': {'code': 'chunk'}})
+            start, end, total = request.headers['Content-Range'].replace('bytes ', '').replace('/', '-').split('-')
+            if int(start) != self.uploaded.get(name, 0):
+                return httpx.Response(416, json={'error': {'code': 'invalidRange'}})
+            self.uploaded[name] = self.uploaded.get(name, 0) + len(request.content)
+            if int(end) + 1 == int(total):
+                return httpx.Response(201, json={'id': f'item-{name}', 'name': name})
+            return httpx.Response(202, json={'nextExpectedRanges': [f'{int(end) + 1}-']})
+        if path.endswith('/children') and request.method == 'GET':
+            return httpx.Response(200, json={'value': []})
+        if path.endswith('/children') and request.method == 'POST':
+            name = json.loads(request.content)['name']
+            self.folders[name] = path
+            return httpx.Response(201, json={'id': f'folder-{name}', 'name': name})
+        if path.endswith(':/content'):
+            name = path.split(':/')[-2]
+            if name in self.rejected:
+                return httpx.Response(400, json={'error': {'code': 'invalidRequest'}})
+            if name in self.existing and url.params.get('@microsoft.graph.conflictBehavior') == 'fail':
+                return httpx.Response(409, json={'error': {'code': 'nameAlreadyExists'}})
+            self.uploaded[name] = len(request.content)
+            quick_xor = QuickXorHash(request.content).b64digest()
+            if name in self.corrupt:
+                self.corrupt.discard(name)
+                quick_xor = QuickXorHash(b'corrupted').b64digest()
+            return httpx.Response(201, json={
+                'id': f'item-{name}', 'name': name, 'file': {'hashes': {'quickXorHash': quick_xor}}})
+        if request.method == 'DELETE':
+            return httpx.Response(204)
+        if path.endswith(':/createUploadSession'):
+            name = path.split(':/')[-2]
+            return httpx.Response(200, json={'uploadUrl': f'https://upload.example/session/{name}'})
+        return httpx.Response(404, json={'error': path})
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class AsyncTransferEngineTestCase(TestCase):
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False).save()
+        user = User.objects.create_user(
+            username='testuser', email='testuser@go365migrator.com', password='fakepass')
+        self.migration = Migration.objects.create(
+            user=user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        self.uploader = SharePointUploader(migration=self.migration)
+        self.downloader = GoogleToSharePoint(
+            uploader=self.uploader,
+            local_temp_dir='test-async-engine',
+            migration=self.migration,
+            auth_method='oauth',
+            google_credentials={'token': 'google-token'},
+            engine='asyncio'
+        )
+        self.backend = MockDriveAndGraph()
+        self.engine = AsyncTransferEngine(
+            downloader=self.downloader, transport=httpx.MockTransport(self.backend))
+        patcher = mock.patch(
+            'web.plumbing.asynctransfer.get_token_from_cache',
+            return_value={'access_token': 'graph-token', 'expires_in': 3600})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.downloader.local_temp_dir, ignore_errors=True)
+        shutil.rmtree(self.downloader.log_folder_path, ignore_errors=True)
+
+    def _scan(self):
+        with mock.patch.object(self.uploader, 'get_remote_path_index', return_value=PathIndex()):
+            return self.engine.scan()
+
+    def test_scan_walks_folder_tree(self):
+        files = self._scan()
+        self.assertEqual(
+            sorted(['notes.txt', 'Report.docx', 'video.mp4']), sorted(f['name'] for f in files))
+        self.assertEqual(['Survey'], [f['name'] for f in self.downloader.unmigratable_files])
+        sub = os.path.join(self.downloader.local_temp_dir, 'really cool folder', 'sub')
+        self.assertEqual(sub, next(f for f in files if f['name'] == 'Report.docx')['parent_folder_local_path'])
+
+    def test_migrate_uploads_every_file(self):
+        files = self._scan()
+        self.downloader.total_migratable_files = len(files)
+        self.assertTrue(self.engine.migrate(files_list=files))
+        self.assertEqual(3, self.downloader.num_files_downloaded)
+        self.assertEqual(0, self.downloader.num_files_failed_to_download)
+        self.assertEqual(
+            {'notes.txt': 5, 'Report.docx': len(b'exported docx'), 'video.mp4': 5 * 1024 * 1024},
+            self.backend.uploaded)
+        # migrated folder, source folder and subfolder are each created once
+        self.assertEqual(
+            sorted(['test-async-engine', 'really cool folder', 'sub']), sorted(self.backend.folders))
+        breakdown = self.downloader.tracer.breakdown()
+        self.assertEqual(3, breakdown['download_file']['count'])
+        self.assertEqual(3, breakdown['_upload_file']['count'])
+        self.assertEqual(3, breakdown['_create_folder']['count'])
+        self.assertEqual(5 + len(b'exported docx') + 5 * 1024 * 1024, breakdown['_download_worker']['bytes'])
+
+    def test_throttled_download_is_retried(self):
+        files = self._scan()
+        self.downloader.total_migratable_files = len(files)
+        self.backend.throttled.update(['file-small', 'file-large'])
+        with mock.patch('web.plumbing.asynctransfer.GOOGLE_DRIVE_SLEEP_RETRY_SECONDS', 0):
+            self.assertTrue(self.engine.migrate(files_list=files))
+        self.assertEqual(3, self.downloader.num_files_downloaded)
+        self.assertEqual(0, self.downloader.num_files_failed_to_download)
+        self.assertEqual(5, self.backend.uploaded['notes.txt'])
+        self.assertEqual(5 * 1024 * 1024, self.backend.uploaded['video.mp4'])
+
+    def test_failed_empty_file_upload_is_not_retried_in_a_session(self):
+        self.backend.rejected.add('empty.txt')
+        item = asyncio.run(self.engine._run(self.engine._upload(
+            parent_id='folder', file_name='empty.txt', source=io.BytesIO(), size=0)))
+        self.assertIsNone(item)
+        self.assertFalse([r for r in self.backend.requests if r.url.path.endswith('/createUploadSession')])
+
+    def test_failed_chunks_are_retried_and_resumed(self):
+        files = self._scan()
+        self.downloader.total_migratable_files = len(files)
+        # a throttled chunk is retried; a rejected one resumes where the session says
+        self.backend.chunk_errors = [503, 400]
+        with mock.patch('web.plumbing.asynctransfer.GRAPH_SLEEP_RETRY_SECONDS', 0):
+            self.assertTrue(self.engine.migrate(files_list=files))
+        self.assertEqual(5 * 1024 * 1024, self.backend.uploaded['video.mp4'])
+        self.assertEqual(3, self.uploader.num_completed_uploads)
+        session = [r.method for r in self.backend.requests if r.url.host == 'upload.example']
+        self.assertEqual(1, session.count('GET'))
+        self.assertEqual(1, self.downloader.tracer.breakdown()['graph_put']['retries'])
+
+    def test_existing_small_file_is_not_looked_up(self):
+        files = self._scan()
+        self.downloader.total_migratable_files = len(files)
+        self.backend.existing.add('notes.txt')
+        self.assertTrue(self.engine.migrate(files_list=files))
+        self.assertNotIn('notes.txt', self.backend.uploaded)
+        self.assertEqual(3, self.uploader.num_completed_uploads)
+        lookups = [unquote(str(r.url)) for r in self.backend.requests
+                   if r.method == 'GET' and r.url.path.endswith('/children')]
+        self.assertFalse([url for url in lookups if 'notes.txt' in url])
+        # the export and the large blob are still looked up before downloading
+        self.assertTrue([url for url in lookups if 'Report.docx' in url])
+        self.assertTrue([url for url in lookups if 'video.mp4' in url])
+
+    def test_hash_mismatch_is_deleted_and_transferred_again(self):
+        files = self._scan()
+        self.downloader.total_migratable_files = len(files)
+        self.backend.corrupt.add('notes.txt')
+        self.assertTrue(self.engine.migrate(files_list=files))
+        deletes = [r for r in self.backend.requests if r.method == 'DELETE']
+        self.assertEqual(['/v1.0/sites/org.sharepoint.com,longid,longid/drives/document-library-guid/items/item-notes.txt'],
+                         [unquote(r.url.path) for r in deletes])
+        self.assertEqual(4, self.downloader.num_files_downloaded)
+        self.assertEqual(3, self.uploader.num_completed_uploads)
+        self.assertEqual(0, self.uploader._num_failed)
+
+    def test_duplicates_are_downloaded_once(self):
+        # scanned files are read from a FileManifest; edit them as a list
+        files = list(self._scan())
+        notes = next(f for f in files if f['name'] == 'notes.txt')
+        notes['md5Checksum'] = hashlib.md5(b'x' * 5).hexdigest()
+        files.append(dict(notes, id='file-small-copy', name='copy of notes.txt'))
+        self.downloader.total_migratable_files = len(files)
+        self.assertTrue(self.engine.migrate(files_list=files))
+        downloads = [r for r in self.backend.requests if r.url.path.startswith('/drive/v3/files/file-small')]
+        self.assertEqual(1, len(downloads))
+        self.assertEqual(5, self.backend.uploaded['copy of notes.txt'])
+        self.assertEqual(4, self.downloader.num_files_downloaded)
+        self.assertEqual(1, self.downloader.num_files_deduplicated)
+        self.assertEqual(4, self.uploader.num_completed_uploads)
+
+    def test_upload_errors_are_not_counted_as_download_failures(self):
+        files = list(self._scan())
+        notes = next(f for f in files if f['name'] == 'notes.txt')
+        notes['md5Checksum'] = hashlib.md5(b'x' * 5).hexdigest()
+        files.append(dict(notes, id='file-small-copy', name='copy of notes.txt'))
+        self.downloader.total_migratable_files = len(files)
+        upload = self.engine._upload
+
+        async def failing_upload(file_name: str = '', **kwargs):
+            if 'notes.txt' in file_name:
+                raise RuntimeError('connection reset')
+            return await upload(file_name=file_name, **kwargs)
+
+        with mock.patch.object(self.engine, '_upload', failing_upload):
+            self.engine.migrate(files_list=files)
+        self.assertEqual(0, self.downloader.num_files_failed_to_download)
+        self.assertEqual(4, self.downloader.num_files_downloaded)
+        self.assertEqual(2, self.uploader._num_failed)
+        self.assertEqual(2, self.uploader.num_completed_uploads)
+
+    def test_destination_is_listed_while_the_source_is_crawled(self):
+        listing = threading.Event()
+
+        def get_remote_path_index(local_folder_base_path=''):
+            listing.set()
+            return PathIndex(local_folder_base_path)
+
+        # the subfolder is listed only once the destination listing has started
+        overlapped = []
+        self.backend.before_list = lambda parent: overlapped.append(listing.wait(5)) if parent == 'folder-sub' else None
+        with mock.patch.object(self.uploader, 'get_remote_path_index', side_effect=get_remote_path_index):
+            files = self.engine.scan()
+        self.assertEqual([True, True], overlapped)
+        self.assertEqual(3, len(files))
+
+    def test_scan_and_migrate_transfers_files_as_they_are_scanned(self):
+        todo_counts = []
+        set_todo_count = self.uploader.set_todo_count
+        self.uploader.set_todo_count = lambda total_files_to_upload=0: (
+            todo_counts.append(total_files_to_upload), set_todo_count(total_files_to_upload))
+        with mock.patch.object(self.uploader, 'get_remote_path_index', return_value=PathIndex()), \
+                mock.patch('web.plumbing.googletosharepoint.AsyncTransferEngine', return_value=self.engine):
+            scan_response = self.downloader.scan_and_migrate()
+        self.assertEqual(3, scan_response['total_migratable_count'])
+        self.assertEqual({'renamed': 0, 'path_too_long': 0}, scan_response['destination_names'])
+        # the totals grew folder by folder
+        self.assertEqual([1, 3], todo_counts)
+        self.assertEqual(
+            {'notes.txt': 5, 'Report.docx': len(b'exported docx'), 'video.mp4': 5 * 1024 * 1024},
+            self.backend.uploaded)
+        self.assertEqual(3, self.uploader.num_completed_uploads)
+        # the scan is saved, with the hashes of the transferred files
+        self.assertEqual(3, self.migration.migratable_files.exclude(quick_xor_hash='').count())
+        self.assertEqual(3, len(self.downloader._get_scanned_files_list()))
+
+    def test_rerun_transfers_only_new_and_changed_files(self):
+        base = os.path.join(self.downloader.local_temp_dir, 'really cool folder')
+        destination = PathIndex(self.downloader.local_temp_dir)
+        destination.add_file(destination.get_folder(base, create=True), {
+            'id': 'old-notes', 'name': 'notes.txt', 'size': 5, 'lastModifiedDateTime': '2030-01-01T00:00:00Z'})
+        destination.add_file(destination.get_folder(os.path.join(base, 'sub'), create=True), {
+            'id': 'old-video', 'name': 'video.mp4', 'size': 1, 'lastModifiedDateTime': '2030-01-01T00:00:00Z'})
+        with mock.patch.object(self.uploader, 'get_remote_path_index', return_value=destination):
+            files = self.engine.scan()
+        self.assertEqual(sorted(['Report.docx', 'video.mp4']), sorted(f['name'] for f in files))
+        self.assertEqual({'new': 1, 'changed': 1, 'unchanged': 1, 'deleted_at_source': 0},
+                         self.downloader.transfer_plan.summary())
+        self.downloader.total_migratable_files = len(files)
+        self.assertTrue(self.engine.migrate(files_list=files))
+        # the changed file replaces its destination copy in place
+        self.assertEqual([], [r for r in self.backend.requests if r.method == 'DELETE'])
+        sessions = [json.loads(r.content) for r in self.backend.requests
+                    if r.url.path.endswith('video.mp4:/createUploadSession')]
+        self.assertEqual([{'item': {'@microsoft.graph.conflictBehavior': 'replace'}}], sessions)
+        self.assertEqual(5 * 1024 * 1024, self.backend.uploaded['video.mp4'])
+        self.assertNotIn('notes.txt', self.backend.uploaded)
+
+    def test_unchanged_export_is_reused_from_the_export_cache(self):
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path, ignore_errors=True)
+        self.downloader.export_cache = ExportCache(path=cache_path, max_bytes=1024 * 1024)
+        files = self._scan()
+        report = next(f for f in files if f['name'] == 'Report.docx')
+        report['modifiedTime'] = '2023-01-01T00:00:00.000Z'
+        self.downloader.total_migratable_files = len(files)
+        self.assertTrue(self.engine.migrate(files_list=[report]))
+        self.backend.uploaded.clear()
+        self.assertTrue(self.engine.migrate(files_list=[report]))
+        exports = [r for r in self.backend.requests if r.url.host == 'docs.google.com']
+        self.assertEqual(1, len(exports))
+        self.assertEqual(1, self.downloader.num_exports_from_cache)
+        self.assertEqual(len(b'exported docx'), self.backend.uploaded['Report.docx'])
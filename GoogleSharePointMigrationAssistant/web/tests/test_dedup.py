@@ -0,0 +1,26 @@
+from django.test import SimpleTestCase
+from ..plumbing.dedup import group_duplicates
+
+
+class GroupDuplicatesTestCase(SimpleTestCase):
+    def test_same_checksum_and_size_are_grouped_under_the_first(self):
+        files = [
+            {'id': 'a', 'md5Checksum': 'm1', 'size': '10'},
+            {'id': 'b', 'md5Checksum': 'm1', 'size': '10'},
+            {'id': 'c', 'md5Checksum': 'm1', 'size': '11'},
+            {'id': 'd', 'md5Checksum': 'm2', 'size': '10'},
+            {'id': 'e', 'md5Checksum': 'm1', 'size': '10'},
+        ]
+        unique, duplicates = group_duplicates(files)
+        self.assertEqual(['a', 'c', 'd'], [f['id'] for f in unique])
+        self.assertEqual({'a': ['b', 'e']}, {k: [f['id'] for f in v] for k, v in duplicates.items()})
+
+    def test_files_without_checksum_are_not_grouped(self):
+        files = [
+            {'id': 'doc1', 'mimeType': 'application/vnd.google-apps.document'},
+            {'id': 'doc2', 'mimeType': 'application/vnd.google-apps.document'},
+            {'id': 'empty', 'md5Checksum': '', 'size': '0'},
+        ]
+        unique, duplicates = group_duplicates(files)
+        self.assertEqual(files, unique)
+        self.assertEqual({}, duplicates)
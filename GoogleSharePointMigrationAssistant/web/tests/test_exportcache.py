@@ -0,0 +1,53 @@
+import io
+import os
+import shutil
+import tempfile
+from django.test import SimpleTestCase
+from ..plumbing.exportcache import ExportCache, get_export_cache_key
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+def key(file_id='doc', modified_time='2023-01-01T00:00:00.000Z'):
+    return get_export_cache_key({'id': file_id, 'modifiedTime': modified_time}, DOCX)
+
+
+class ExportCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+
+    def read(self, cache, cache_key):
+        cached = cache.open(cache_key)
+        if cached is None:
+            return None
+        with cached:
+            return cached.read()
+
+    def test_entries_are_keyed_by_modified_time(self):
+        cache = ExportCache(path=self.path, max_bytes=100)
+        cache.put_fileobj(key(), io.BytesIO(b'version 1'))
+        self.assertEqual(b'version 1', self.read(cache, key()))
+        self.assertIsNone(self.read(cache, key(modified_time='2023-02-01T00:00:00.000Z')))
+        self.assertIsNone(get_export_cache_key({'id': 'doc'}, DOCX))
+        dest = os.path.join(self.path, 'copy.docx')
+        self.assertTrue(cache.copy_to(key(), dest))
+        with open(dest, 'rb') as f:
+            self.assertEqual(b'version 1', f.read())
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+    def test_least_recently_used_are_evicted_past_the_budget(self):
+        cache = ExportCache(path=self.path, max_bytes=25)
+        for name in ['a', 'b']:
+            cache.put_fileobj(key(name), io.BytesIO(b'x' * 10))
+        # a is now the most recently used
+        self.read(cache, key('a'))
+        cache.put_fileobj(key('c'), io.BytesIO(b'x' * 10))
+        self.assertEqual(20, cache.size)
+        self.assertIsNone(self.read(cache, key('b')))
+        self.assertIsNotNone(self.read(cache, key('a')))
+        # too large to ever fit
+        cache.put_fileobj(key('d'), io.BytesIO(b'x' * 26))
+        self.assertIsNone(self.read(cache, key('d')))
+        # a new process sees the same entries
+        self.assertEqual(20, ExportCache(path=self.path, max_bytes=25).size)
@@ -0,0 +1,81 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..models import User, AdministrationSettings
+from ..views import google
+
+FOLDER_PAGES = {
+    '': {'files': [{'id': 'folder-a', 'name': 'A', 'mimeType': google.FOLDER_MIMETYPE}], 'nextPageToken': 'page-2'},
+    'page-2': {'files': [{'id': 'folder-b', 'name': 'B', 'mimeType': google.FOLDER_MIMETYPE, 'driveId': 'drive-1'}]},
+}
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    GOOGLE_DRIVE_BROWSE_PAGE_SIZE=1
+)
+class GoogleDriveBrowseTestCase(TestCase):
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False).save()
+        User.objects.create_user(username='testuser', password='fakepass')
+        self.client.login(username='testuser', password='fakepass')
+        session = self.client.session
+        session['google_credentials'] = {'token': 'google-token'}
+        session['google_user'] = {'email_address': 'testuser@example.com'}
+        session.save()
+        self.drive = mock.MagicMock()
+        self.drive.files().list.side_effect = lambda pageToken=None, **kwargs: mock.Mock(
+            execute=mock.Mock(return_value=FOLDER_PAGES[pageToken or '']))
+        self.drive.drives().list.return_value.execute.return_value = {'drives': [{'id': 'drive-1', 'name': 'Team'}]}
+        patcher = mock.patch.object(google, 'get_drive_service', return_value=self.drive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        google.django_cache.clear()
+
+    def _browse(self, **params):
+        return self.client.get(reverse('google-drive-browse'), params).json()
+
+    def test_pages_through_children_of_one_node(self):
+        first = self._browse(parent='root')['success']
+        self.assertEqual(['A'], [f['name'] for f in first['items']])
+        self.assertEqual('Google Drive folder', first['items'][0]['mimeTypeFriendly'])
+        self.assertEqual('page-2', first['next_page_token'])
+        second = self._browse(parent='root', page_token='page-2')['success']
+        self.assertEqual(['B'], [f['name'] for f in second['items']])
+        self.assertIsNone(second['next_page_token'])
+        kwargs = self.drive.files().list.call_args.kwargs
+        self.assertEqual(google.BROWSE_FILES_FIELDS, kwargs['fields'])
+        self.assertEqual(1, kwargs['pageSize'])
+        self.assertEqual(
+            f"'root' in parents and mimeType = '{google.FOLDER_MIMETYPE}' and trashed = false", kwargs['q'])
+
+    def test_pages_are_cached_server_side(self):
+        for _ in range(3):
+            self._browse(parent='folder-a')
+        self.assertEqual(1, self.drive.files().list.call_count)
+
+    def test_shared_drive_children_are_listed_within_the_drive(self):
+        drives = self._browse(parent=google.SHARED_DRIVES_NODE)['success']['items']
+        self.assertEqual([{'id': 'drive-1', 'name': 'Team', 'mimeTypeFriendly': 'Shared Drive'}], drives)
+        self._browse(parent='drive-1', drive_id='drive-1')
+        kwargs = self.drive.files().list.call_args.kwargs
+        self.assertEqual(('drive', 'drive-1'), (kwargs['corpora'], kwargs['driveId']))
+
+    def test_parent_that_is_not_a_drive_id_is_rejected(self):
+        for params in [{'parent': "x' in parents or name contains '"}, {'parent': 'a\\b'},
+                       {'parent': 'root', 'drive_id': "drive' or '1"}]:
+            response = self.client.get(reverse('google-drive-browse'), params)
+            self.assertEqual(400, response.status_code)
+        self.drive.files().list.assert_not_called()
+
+    def test_query_values_are_escaped(self):
+        self.assertEqual("a\\'b\\\\c", google.escape_query_value("a'b\\c"))
+
+    def test_requires_google_credentials(self):
+        session = self.client.session
+        del session['google_credentials']
+        session.save()
+        response = self.client.get(reverse('google-drive-browse'))
+        self.assertEqual(403, response.status_code)
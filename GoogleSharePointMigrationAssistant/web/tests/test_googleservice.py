@@ -0,0 +1,66 @@
+import copy
+import threading
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from google.oauth2.credentials import Credentials
+from ..plumbing import googleservice
+from ..plumbing.googleservice import PooledAuthorizedHttp, get_drive_discovery_document, get_drive_service
+
+
+class DriveServiceFactoryTestCase(SimpleTestCase):
+    def test_one_service_per_credential_per_thread(self):
+        service = get_drive_service(Credentials(token='a', refresh_token='refresh-1'))
+        # the access token changes on refresh; the service is still reused
+        self.assertIs(service, get_drive_service(Credentials(token='b', refresh_token='refresh-1')))
+        self.assertIsNot(service, get_drive_service(Credentials(token='a', refresh_token='refresh-2')))
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(
+            get_drive_service(Credentials(token='a', refresh_token='refresh-1'))))
+        thread.start()
+        thread.join()
+        self.assertIsNot(service, other_thread[0])
+
+    @override_settings(GOOGLE_DRIVE_API_URL='http://127.0.0.1:1/drive/v3')
+    def test_services_share_the_parsed_discovery_document(self):
+        document = get_drive_discovery_document()
+        snapshot = copy.deepcopy(document)
+        service = get_drive_service(Credentials(token='a', refresh_token='refresh-3'))
+        self.assertIs(document, googleservice._discovery_document)
+        request = service.files().list(q="'root' in parents", fields='files(id)')
+        self.assertTrue(request.uri.startswith('http://127.0.0.1:1/drive/v3/files?'))
+        service.drives().get(driveId='drive-1')
+        self.assertEqual(snapshot, document)
+
+
+class PooledAuthorizedHttpTestCase(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(googleservice, 'AuthorizedHttp')
+        self.authorized_http = patcher.start()
+        self.authorized_http.side_effect = lambda credentials, http=None: mock.Mock(
+            request=mock.Mock(return_value=('response', b'content')))
+        self.addCleanup(patcher.stop)
+
+    def _request_from_threads(self, http, num_threads=4, requests_per_thread=3):
+        def worker():
+            for _ in range(requests_per_thread):
+                http.request('https://www.googleapis.com/drive/v3/files/1?alt=media')
+        threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_one_keep_alive_transport_per_thread(self):
+        credentials = mock.Mock(valid=True)
+        http = PooledAuthorizedHttp(credentials)
+        self._request_from_threads(http)
+        self.assertEqual(4, http.num_thread_transports)
+        self.assertEqual(4, self.authorized_http.call_count)
+        for call in self.authorized_http.call_args_list:
+            self.assertIs(credentials, call.args[0])
+
+    def test_expired_credentials_are_refreshed_once(self):
+        credentials = mock.Mock(valid=False)
+        credentials.refresh.side_effect = lambda request: setattr(credentials, 'valid', True)
+        self._request_from_threads(PooledAuthorizedHttp(credentials))
+        self.assertEqual(1, credentials.refresh.call_count)
@@ -0,0 +1,69 @@
+import shutil
+from unittest import mock
+from django.test import TestCase, override_settings
+from ..models import Migration, User, AdministrationSettings
+from ..plumbing.googletosharepoint import GoogleToSharePoint
+from ..plumbing.sharepoint import SharePointUploader
+from .conf import *
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+
+
+class PagedDriveFiles:
+    """ Drive files().list over {parent id: children}, in pages of pageSize
+    (100 by default). Like Drive, nextPageToken is only returned if fields
+    asks for it. """
+
+    def __init__(self, children: dict = {}):
+        self.children = children
+
+    def list(self, q: str = '', pageToken: str = '', pageSize: int = 100, fields: str = '', **kwargs):
+        parent = q.split("'")[1]
+        want_folders = '!=' not in q
+        children = [c for c in self.children.get(parent, []) if (c['mimeType'] == FOLDER_MIMETYPE) == want_folders]
+        start = int(pageToken or 0)
+        page = {'files': children[start:start + pageSize]}
+        if start + pageSize < len(children) and (not fields or 'nextPageToken' in fields):
+            page['nextPageToken'] = str(start + pageSize)
+        return mock.Mock(execute=mock.Mock(return_value=page))
+
+
+def text_files(prefix: str = '', count: int = 0):
+    return [{'id': f'{prefix}-{i}', 'name': f'{prefix} {i}.txt', 'mimeType': 'text/plain', 'size': '1'}
+            for i in range(count)]
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ScanListingTestCase(TestCase):
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False).save()
+        user = User.objects.create_user(
+            username='testuser', email='testuser@go365migrator.com', password='fakepass')
+        migration = Migration.objects.create(
+            user=user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        self.downloader = GoogleToSharePoint(
+            uploader=SharePointUploader(migration=migration),
+            local_temp_dir='test-scan-listing',
+            migration=migration,
+            auth_method='oauth',
+            google_credentials={'token': 'google-token'},
+            engine='threads'
+        )
+        self.downloader.service = mock.Mock()
+        self.downloader.service.files.return_value = PagedDriveFiles({
+            'drive-1': text_files('root', 250) + [{'id': 'big', 'name': 'big', 'mimeType': FOLDER_MIMETYPE}],
+            'big': text_files('big', 1200),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.downloader.log_folder_path, ignore_errors=True)
+
+    def test_folder_larger_than_a_page_is_listed_in_full(self):
+        files = self.downloader._get_flattened_files_list_in_folder({'id': 'big', 'name': 'big'}, 'tmp')
+        self.assertEqual(1200, len(files))
+
+    def test_shared_drive_larger_than_a_page_is_listed_in_full(self):
+        files = self.downloader._get_flattened_files_list_in_drive('drive-1')
+        self.assertEqual(250 + 1200, len(files))
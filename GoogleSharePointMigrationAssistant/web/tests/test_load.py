@@ -0,0 +1,83 @@
+import threading
+import time
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from ..models import Migration, MigrationFile, User, AdministrationSettings
+from .conf import *
+
+NUM_SCANNED_FILES = 5000
+NUM_STATE_POLLS = 50
+MAX_POLL_SECONDS = 2
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ConcurrentTaskLoadTestCase(TransactionTestCase):
+    """ Celery workers running scan and migrate tasks write to the database
+    while the web tier polls migration state. Those polls must not be blocked
+    (or fail with "database is locked") by the task writes. Run against the
+    configured DB_ENGINE; CI runs it against PostgreSQL as well as SQLite. """
+
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False).save()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='testuser@go365migrator.com',
+            password='fakepass')
+        self.scan_migration = Migration.objects.create(
+            user=self.user, google_source=GOOGLE_SHARED_DRIVE_SOURCE, target=TARGET_EXAMPLE)
+        self.migrate_migration = Migration.objects.create(
+            user=self.user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        self.errors = []
+
+    def _run_task(self, target):
+        try:
+            target()
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            connection.close()
+
+    def _scan_task(self):
+        """ mimic GoogleToSharePoint.scan() saving its result """
+        self.scan_migration.set_state(Migration.STATES.SCANNING)
+        files = [
+            MigrationFile(
+                migration=self.scan_migration, google_id=f'file-{i}', name=f'file-{i}.docx',
+                mime_type='application/vnd.google-apps.document', size=1024 * i,
+                parent_folder_local_path=f'migration/folder-{i % 100}')
+            for i in range(NUM_SCANNED_FILES)
+        ]
+        MigrationFile.objects.bulk_create(files, batch_size=1000)
+        self.scan_migration.source_data_scan_result = {'total_migratable_count': NUM_SCANNED_FILES}
+        self.scan_migration.save(update_fields=['source_data_scan_result', 'lastmod'])
+        self.scan_migration.set_state(Migration.STATES.SCAN_COMPLETE)
+
+    def _migrate_task(self):
+        """ mimic migrate_data() flipping state while it works """
+        for _ in range(NUM_STATE_POLLS):
+            self.migrate_migration.set_state(Migration.STATES.MIGRATING)
+        self.migrate_migration.set_state(Migration.STATES.MIGRATION_COMPLETE)
+
+    def test_state_polls_not_blocked_by_task_writes(self):
+        self.client.login(username='testuser', password='fakepass')
+        tasks = [
+            threading.Thread(target=self._run_task, args=(self._scan_task,)),
+            threading.Thread(target=self._run_task, args=(self._migrate_task,)),
+        ]
+        for t in tasks:
+            t.start()
+        slowest = 0
+        for i in range(NUM_STATE_POLLS):
+            migration = [self.scan_migration, self.migrate_migration][i % 2]
+            start = time.perf_counter()
+            response = self.client.get(f'/migration-state-poll/{migration.id}/')
+            slowest = max(slowest, time.perf_counter() - start)
+            self.assertEqual(200, response.status_code)
+            self.assertIn('success', response.json())
+        for t in tasks:
+            t.join()
+        self.assertEqual([], self.errors)
+        self.assertLess(slowest, MAX_POLL_SECONDS)
+        self.assertEqual(NUM_SCANNED_FILES, self.scan_migration.files.count())
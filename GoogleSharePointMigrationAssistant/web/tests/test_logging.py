@@ -0,0 +1,68 @@
+import json
+import logging
+import shutil
+from django.test import SimpleTestCase
+from ..plumbing.base import BaseUtil
+from ..plumbing.constants import LOG_MAX_LIST_ITEMS, LOG_MAX_VALUE_LENGTH, LOG_SAMPLE_EVERY_N
+from ..plumbing.logutil import DeferredQueueHandler, LogMessage, redact
+
+
+class LoggingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.util = BaseUtil(name='test-logging', verbose=False, username='test-logging')
+        self.log_file = f'{self.util.log_folder_path}/test-logging.log'
+
+    def tearDown(self):
+        self.util.shutdown_logging()
+        shutil.rmtree(self.util.log_folder_path, ignore_errors=True)
+
+    def _logged_lines(self):
+        # flushes the queue and closes the file
+        self.util.shutdown_logging()
+        with open(self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_redacts_secrets_and_payloads_and_caps_sizes(self):
+        redacted = redact({
+            'graph_put': {
+                'headers': {'Authorization': 'Bearer abc', 'Content-Range': 'bytes 0-9/10'},
+                'payload': b'\x00' * 4096,
+                'url': 'u' * (LOG_MAX_VALUE_LENGTH + 10),
+                'files': list(range(LOG_MAX_LIST_ITEMS + 5)),
+            }
+        })['graph_put']
+        self.assertEqual('<redacted>', redacted['headers']['Authorization'])
+        self.assertEqual('bytes 0-9/10', redacted['headers']['Content-Range'])
+        self.assertEqual('<4096 bytes>', redacted['payload'])
+        self.assertTrue(redacted['url'].endswith('...<10 more chars>'))
+        self.assertEqual(LOG_MAX_LIST_ITEMS + 1, len(redacted['files']))
+        self.assertEqual('<5 more items>', redacted['files'][-1])
+
+    def test_messages_are_json_and_disabled_levels_are_not_built(self):
+        built = []
+        self.util.debug(lambda: built.append('debug') or {'never': 'built'})
+        self.util.info(lambda: built.append('info') or {'k': 'v', 'token': 'secret'})
+        self.assertEqual(['info'], built)
+        lines = self._logged_lines()
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].startswith('[test-logging - test_logging.py:'))
+        self.assertEqual({'k': 'v', 'token': '<redacted>'}, json.loads(lines[0].split('] ', 1)[1]))
+
+    def test_sampled_events_keep_first_and_every_nth(self):
+        for i in range(2 * LOG_SAMPLE_EVERY_N + 1):
+            self.util.info({'chunk': i}, sample='chunk')
+        self.assertEqual(
+            [{'chunk': 0}, {'chunk': LOG_SAMPLE_EVERY_N}, {'chunk': 2 * LOG_SAMPLE_EVERY_N}],
+            [json.loads(line.split('] ', 1)[1]) for line in self._logged_lines()])
+
+    def test_handlers_are_queued_and_not_duplicated(self):
+        BaseUtil(name='test-logging', verbose=False, username='test-logging')
+        handlers = logging.getLogger('test-logging').handlers
+        self.assertEqual(1, len(handlers))
+        self.assertIsInstance(handlers[0], DeferredQueueHandler)
+
+    def test_message_is_a_snapshot(self):
+        files = {'a': 1}
+        message = LogMessage(files)
+        files['b'] = 2
+        self.assertEqual('{"a": 1}', str(message))
@@ -0,0 +1,66 @@
+from unittest import mock
+from django.test import RequestFactory, TestCase, override_settings
+from ..models import User, AdministrationSettings
+from ..plumbing import m365_util
+from ..plumbing.m365_util import (
+    get_sharepoint_site_by_id, get_user_sharepoint_sites, get_graph_lookup_cache_stats
+)
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'graph_lookups': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'graph-lookups'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, GRAPH_API_URL='https://graph.example/v1.0')
+class GraphLookupCacheTestCase(TestCase):
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False, azure_ad_tenant_id='tenant-a').save()
+        self.requests = [RequestFactory().get('/') for _ in range(2)]
+        for i, request in enumerate(self.requests):
+            request.user = User.objects.create_user(username=f'user{i}', password='fakepass')
+        token_patcher = mock.patch.object(
+            m365_util, 'get_token_from_request_session', return_value={'access_token': 't'})
+        get_patcher = mock.patch.object(m365_util.requests, 'get', side_effect=self._graph_get)
+        token_patcher.start()
+        self.graph_get = get_patcher.start()
+        self.addCleanup(token_patcher.stop)
+        self.addCleanup(get_patcher.stop)
+        self.status_code = 200
+
+    def tearDown(self):
+        m365_util.get_graph_lookup_cache().clear()
+
+    def _graph_get(self, url='', headers={}):
+        resource = url.replace('https://graph.example/v1.0/', '').replace('?$select=id', '')
+        payload = {'value': [{'id': 'site-1'}]} if resource.startswith('sites?') else {'id': resource}
+        return mock.Mock(status_code=self.status_code, json=mock.Mock(return_value=payload))
+
+    def test_site_lookups_are_shared_across_users_of_a_tenant(self):
+        for request in self.requests + self.requests:
+            self.assertEqual({'id': 'sites/site-1'}, get_sharepoint_site_by_id(request, site_id='site-1'))
+        # one lookup, then one access check for the second user
+        self.assertEqual(
+            ['sites/site-1', 'sites/site-1?$select=id'],
+            [c.kwargs['url'].replace('https://graph.example/v1.0/', '') for c in self.graph_get.call_args_list])
+        self.assertEqual(
+            {'hits': 3, 'misses': 1, 'hit_rate': 0.75}, get_graph_lookup_cache_stats()['sharepoint_site'])
+
+    def test_shared_lookups_are_not_served_to_users_without_access(self):
+        self.assertEqual({'id': 'sites/site-1'}, get_sharepoint_site_by_id(self.requests[0], site_id='site-1'))
+        self.status_code = 403
+        self.assertIsNone(get_sharepoint_site_by_id(self.requests[1], site_id='site-1'))
+        self.assertEqual({'id': 'sites/site-1'}, get_sharepoint_site_by_id(self.requests[0], site_id='site-1'))
+
+    def test_site_search_is_cached_per_user(self):
+        for request in self.requests + self.requests:
+            self.assertEqual([{'id': 'site-1'}], get_user_sharepoint_sites(request, site_filter='hr'))
+        self.assertEqual(2, self.graph_get.call_count)
+        self.assertEqual(0.5, get_graph_lookup_cache_stats()['total']['hit_rate'])
+
+    def test_failed_lookups_are_not_cached(self):
+        self.status_code = 404
+        self.assertIsNone(get_sharepoint_site_by_id(self.requests[0], site_id='missing'))
+        self.status_code = 200
+        self.assertEqual({'id': 'sites/missing'}, get_sharepoint_site_by_id(self.requests[0], site_id='missing'))
+        self.assertEqual(2, self.graph_get.call_count)
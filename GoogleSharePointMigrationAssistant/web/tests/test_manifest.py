@@ -0,0 +1,64 @@
+import os
+import tempfile
+from django.test import SimpleTestCase
+from ..plumbing.manifest import FileManifest, decode_timestamp, encode_timestamp
+
+BASE = os.path.join('tmp', 'migration')
+EXPORT = 'https://docs.google.com/feeds/download/documents/export/Export?id={}&exportFormat=docx'
+
+
+def doc(file_id, **kwargs):
+    return {'id': file_id, 'name': f'{file_id}.docx', 'mimeType': 'application/vnd.google-apps.document',
+            'modifiedTime': '2023-05-01T10:20:30.123Z', 'parent_folder_local_path': BASE,
+            'exportLinks': {'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+                            EXPORT.format(file_id)}, **kwargs}
+
+
+class FileManifestTestCase(SimpleTestCase):
+    def setUp(self):
+        self.files = [
+            doc('doc1'),
+            doc('doc2', transfer_status='unchanged', quick_xor_hash='AAAAAAAAAAAAAAAAAAAAAAAAAAA='),
+            {'id': 'blob', 'name': 'notes ü.txt', 'mimeType': 'text/plain', 'size': '0',
+             'md5Checksum': 'd41d8cd98f00b204e9800998ecf8427e', 'parent_folder_local_path': os.path.join(BASE, 'sub'),
+             'transfer_status': 'changed', 'destination_item_id': 'item-1'},
+            # values that do not fit a column are kept as they are
+            {'id': 'odd', 'name': 'odd', 'mimeType': 'text/plain', 'size': 12,
+             'modifiedTime': '2023-05-01T10:20:30Z', 'md5Checksum': 'not-a-checksum', 'kind': 'drive#file'},
+        ]
+
+    def test_files_read_back_as_appended(self):
+        manifest = FileManifest(self.files)
+        self.assertEqual(4, len(manifest))
+        self.assertEqual(self.files, list(manifest))
+        self.assertEqual(self.files[-1], manifest[-1])
+        self.assertEqual([BASE, os.path.join(BASE, 'sub')], manifest.folders)
+        self.assertEqual(12, manifest.total_size())
+        with self.assertRaises(IndexError):
+            manifest[4]
+
+    def test_export_links_are_shared_by_files_of_a_type(self):
+        manifest = FileManifest(doc(f'doc{i}') for i in range(100))
+        self.assertEqual(1, len(manifest._export_links.values) - 1)
+        self.assertEqual(EXPORT.format('doc42'), list(manifest[42]['exportLinks'].values())[0])
+
+    def test_timestamps(self):
+        self.assertEqual(1682936430123, encode_timestamp('2023-05-01T10:20:30.123Z'))
+        self.assertEqual('2023-05-01T10:20:30.123Z', decode_timestamp(1682936430123))
+        self.assertIsNone(encode_timestamp('2023-05-01T10:20:30Z'))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = FileManifest(self.files).save(os.path.join(tmp, 'manifest'))
+            manifest = FileManifest.load(path)
+            try:
+                self.assertEqual(self.files, list(manifest))
+                self.assertEqual(0, manifest.get_size(2))
+                with self.assertRaises(TypeError):
+                    manifest.append(doc('doc3'))
+            finally:
+                manifest.close()
+            with open(path, 'r+b') as f:
+                f.write(b'x')
+            with self.assertRaises(ValueError):
+                FileManifest.load(path)
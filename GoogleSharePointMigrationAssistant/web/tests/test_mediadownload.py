@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import tempfile
+import requests
+from django.test import SimpleTestCase
+from ..plumbing.contenthash import ContentHasher, QuickXorHash
+from ..plumbing.mediadownload import download_segments_to_file, download_to_file
+
+CONTENT = bytes(range(256)) * 40
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, body=b'', fail_after=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.fail_after = fail_after
+        self.chunk_sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error', response=self)
+
+    def iter_content(self, chunk_size=1):
+        self.chunk_sizes.append(chunk_size)
+        for start in range(0, len(self.body), chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError('connection reset')
+            yield self.body[start:start + chunk_size]
+
+
+class FakeSession:
+    """ Serves CONTENT, honouring Range unless told not to; the first response
+    can be cut off after fail_after bytes """
+
+    def __init__(self, honour_range=True, fail_after=None, status_code=200, errors={}):
+        self.honour_range = honour_range
+        self.fail_after = fail_after
+        self.status_code = status_code
+        # {index of a request: (status code, error reason) of its response}
+        self.errors = errors
+        self.requests = []
+
+    def get(self, uri, headers=None, stream=False, timeout=None):
+        self.requests.append(dict(headers))
+        if len(self.requests) - 1 in self.errors:
+            status_code, reason = self.errors[len(self.requests) - 1]
+            return FakeResponse(status_code, body=json.dumps(
+                {'error': {'code': status_code, 'errors': [{'reason': reason}]}}).encode())
+        fail_after, self.fail_after = self.fail_after, None
+        if self.status_code != 200:
+            return FakeResponse(self.status_code)
+        range_header = headers.get('Range')
+        if range_header and self.honour_range:
+            start, _, end = range_header.replace('bytes=', '').partition('-')
+            start, end = int(start), int(end) + 1 if end else len(CONTENT)
+            return FakeResponse(206, {
+                'Content-Range': f'bytes {start}-{end - 1}/{len(CONTENT)}',
+                'Content-Length': str(end - start)}, CONTENT[start:end], fail_after)
+        return FakeResponse(200, {'Content-Length': str(len(CONTENT))}, CONTENT, fail_after)
+
+
+class DownloadToFileTestCase(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+
+    def _download(self, session, **kwargs):
+        return download_to_file(
+            session=session, uri='https://www.googleapis.com/drive/v3/files/1?alt=media',
+            path=self.path, chunk_size=1024, retry_seconds=0, **kwargs)
+
+    def _content(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_streams_in_chunks(self):
+        progress = []
+        self.assertEqual(len(CONTENT), self._download(
+            FakeSession(), on_progress=lambda received, total: progress.append((received, total))))
+        self.assertEqual(CONTENT, self._content())
+        self.assertEqual((1024, len(CONTENT)), progress[0])
+        self.assertEqual(10, len(progress))
+
+    def test_interrupted_download_resumes_from_offset(self):
+        session = FakeSession(fail_after=4096)
+        self.assertEqual(len(CONTENT), self._download(session))
+        self.assertEqual(CONTENT, self._content())
+        self.assertEqual([None, 'bytes=4096-'], [r.get('Range') for r in session.requests])
+
+    def test_restarts_if_server_ignores_range(self):
+        session = FakeSession(honour_range=False, fail_after=4096)
+        self.assertEqual(len(CONTENT), self._download(session))
+        self.assertEqual(CONTENT, self._content())
+        self.assertEqual(2, len(session.requests))
+
+    def test_failed_download_removes_partial_file(self):
+        with self.assertRaises(requests.HTTPError):
+            self._download(FakeSession(status_code=404))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_rate_limited_download_is_retried(self):
+        session = FakeSession(fail_after=4096, errors={1: (403, 'userRateLimitExceeded'), 2: (403, 'rateLimitExceeded')})
+        self.assertEqual(len(CONTENT), self._download(session))
+        self.assertEqual(CONTENT, self._content())
+        # resumed from the bytes written before the throttling
+        self.assertEqual('bytes=4096-', session.requests[-1].get('Range'))
+        with self.assertRaises(requests.HTTPError):
+            self._download(FakeSession(errors={0: (403, 'insufficientFilePermissions')}))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_segmented_download_fetches_ranges_into_place(self):
+        session = FakeSession(fail_after=1024)
+        size = download_segments_to_file(
+            session=session, uri='https://www.googleapis.com/drive/v3/files/1?alt=media', path=self.path,
+            size=len(CONTENT), md5_checksum=hashlib.md5(CONTENT).hexdigest(), num_segments=4,
+            chunk_size=1024, retry_seconds=0)
+        self.assertEqual(len(CONTENT), size)
+        self.assertEqual(CONTENT, self._content())
+        ranges = sorted(r['Range'] for r in session.requests)
+        # four segments, one of which was cut off and resumed
+        self.assertEqual(5, len(ranges))
+        self.assertIn('bytes=7680-10239', ranges)
+
+    def test_segmented_download_is_checked_against_md5(self):
+        with self.assertRaises(ValueError):
+            download_segments_to_file(
+                session=FakeSession(), uri='https://www.googleapis.com/drive/v3/files/1?alt=media',
+                path=self.path, size=len(CONTENT), md5_checksum='0' * 32, num_segments=4, retry_seconds=0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_content_is_hashed_as_it_is_written(self):
+        # resumed, and restarted from scratch when Range is ignored
+        for session in [FakeSession(fail_after=4096), FakeSession(honour_range=False, fail_after=4096)]:
+            hasher = ContentHasher()
+            self._download(session, hasher=hasher, md5_checksum=hashlib.md5(CONTENT).hexdigest())
+            self.assertEqual(
+                {'md5Checksum': hashlib.md5(CONTENT).hexdigest(), 'quickXorHash': QuickXorHash(CONTENT).b64digest()},
+                hasher.hashes())
+        with self.assertRaises(ValueError):
+            self._download(FakeSession(), md5_checksum='0' * 32)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_segmented_download_merges_segment_hashes(self):
+        quick_xor = QuickXorHash()
+        download_segments_to_file(
+            session=FakeSession(fail_after=1000), uri='https://www.googleapis.com/drive/v3/files/1?alt=media',
+            path=self.path, size=len(CONTENT), num_segments=3, chunk_size=1000, retry_seconds=0,
+            quick_xor=quick_xor)
+        self.assertEqual(QuickXorHash(CONTENT).b64digest(), quick_xor.b64digest())
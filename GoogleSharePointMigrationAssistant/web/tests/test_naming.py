@@ -0,0 +1,65 @@
+import os
+from django.test import SimpleTestCase
+from ..plumbing.manifest import FileManifest
+from ..plumbing.naming import NamePlan, get_name_key, normalize_name, shorten_name
+
+BASE = os.path.join('tmp', 'migration')
+SUB = os.path.join(BASE, 'sub')
+
+
+def file(file_id, name, parent=BASE):
+    return {'id': file_id, 'name': name, 'mimeType': 'text/plain', 'parent_folder_local_path': parent}
+
+
+class NamingTestCase(SimpleTestCase):
+    def test_normalized_names_and_keys(self):
+        self.assertEqual('notes.txt', normalize_name('no:tes?.txt'))
+        self.assertEqual(get_name_key('Notes.TXT'), get_name_key('no|tes.txt'))
+        self.assertEqual('abc.txt', shorten_name('abcdef.txt', 7))
+        self.assertIsNone(shorten_name('a.docx', 5))
+
+    def test_collisions_get_a_suffix_in_id_order(self):
+        files = [
+            file('c', 'Notes.txt'),
+            file('a', 'notes.txt'),
+            file('b', 'notes.txt'),
+            # already used by another file: skipped
+            file('d', 'notes (1).txt'),
+            # other folders are separate
+            file('e', 'notes.txt', parent=SUB),
+        ]
+        plan = NamePlan(files, base_path=BASE)
+        # 'a' keeps the name
+        self.assertEqual({2: 'notes (2).txt', 0: 'Notes (3).txt'}, plan.renamed)
+        self.assertEqual([], plan.too_long)
+
+    def test_file_named_like_a_subfolder_is_renamed(self):
+        files = [file('a', 'sub'), file('b', 'x.txt', parent=SUB)]
+        plan = NamePlan(files, base_path=BASE)
+        self.assertEqual({0: 'sub (1)'}, plan.renamed)
+
+    def test_long_names_are_shortened_and_long_folders_reported(self):
+        deep = os.path.join(BASE, 'f' * 30)
+        files = [file('a', 'n' * 30 + '.txt'), file('b', 'long.txt', parent=deep),
+                 file('c', 'm' * 30 + '.txt'), file('d', 'm' * 31 + '.txt')]
+        # 'migration/' leaves 30 characters for a name in BASE, none in deep
+        plan = NamePlan(files, base_path=BASE, max_path_length=40)
+        self.assertEqual('n' * 26 + '.txt', plan.renamed[0])
+        self.assertEqual([1], plan.too_long)
+        # shortened into the name of another file
+        self.assertEqual('m' * 22 + ' (1).txt', plan.renamed[3])
+
+    def test_folders_planned_one_at_a_time(self):
+        names_taken = {}
+        NamePlan([file('a', 'x.txt')], base_path=BASE, names_taken=names_taken)
+        # another Drive folder of the same name, and a subfolder listed with the files
+        plan = NamePlan([file('b', 'x.txt'), file('c', 'sub')], base_path=BASE,
+                        folder_paths=[SUB], names_taken=names_taken)
+        self.assertEqual({0: 'x (1).txt', 1: 'sub (1)'}, plan.renamed)
+
+    def test_apply_to_manifest(self):
+        files = FileManifest([file('a', 'x.txt'), file('b', 'X.txt')])
+        plan = NamePlan(files, base_path=BASE)
+        plan.apply(files)
+        self.assertEqual(['x.txt', 'X (1).txt'], [f['name'] for f in files])
+        self.assertEqual({'renamed': 1, 'path_too_long': 0}, plan.summary())
@@ -0,0 +1,95 @@
+import os
+from django.test import SimpleTestCase
+from ..plumbing.pathindex import PathIndex
+from ..plumbing.remotefolders import RemoteFolderCache
+
+BASE = os.path.join('tmp', 'migration')
+
+
+class FakeUploader(RemoteFolderCache):
+    """ Destination tree in memory: {folder id: children} """
+
+    def __init__(self, children: dict = {}):
+        self.children = children
+        self.listed = []
+
+    def get_children_from_folder_id(self, folder_id: str = ''):
+        self.listed.append(folder_id)
+        return self.children.get(folder_id, [])
+
+
+class PagedUploader(RemoteFolderCache):
+    """ Graph children pages of 2 items: {folder id: children} """
+
+    def __init__(self, children: dict = {}):
+        self.children = children
+        self.urls = []
+        self.errors = []
+
+    def get_drive_url(self):
+        return 'https://graph/drive'
+
+    def graph_get(self, url: str = ''):
+        self.urls.append(url)
+        folder_id = url.split('/')[-2]
+        if folder_id not in self.children:
+            return None
+        start = int(url.split('&start=')[1]) if '&start=' in url else 0
+        page = {'value': self.children[folder_id][start:start + 2]}
+        if start + 2 < len(self.children[folder_id]):
+            page['@odata.nextLink'] = f'{url.split("&start=")[0]}&start={start + 2}'
+        return page
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class PathIndexTestCase(SimpleTestCase):
+    def test_build_remote_path_index_lists_each_folder_once(self):
+        uploader = FakeUploader({
+            'base': [{'id': 'a', 'name': 'a.txt', 'file': {}}, {'id': 'sub', 'name': 'sub', 'folder': {}}],
+            'sub': [{'id': 'b', 'name': 'b.txt', 'file': {}}, {'id': 'deep', 'name': 'deep', 'folder': {}}],
+            'deep': [{'id': 'c', 'name': 'c.txt', 'file': {}}],
+        })
+        index = uploader.build_remote_path_index(BASE, 'base')
+        self.assertEqual(['base', 'sub', 'deep'], uploader.listed)
+        self.assertEqual(3, len(index))
+        self.assertEqual(['a', 'b', 'c'], sorted(item['id'] for item in index))
+        self.assertEqual('c', index.get(os.path.join(BASE, 'sub', 'deep'), 'c.txt')['id'])
+        self.assertEqual(os.path.join(BASE, 'sub'), index.get(os.path.join(BASE, 'sub'), 'b.txt')['parent_folder_local_path'])
+
+    def test_every_page_is_listed(self):
+        uploader = PagedUploader({
+            'base': [{'id': f'f{i}', 'name': f'{i}.txt', 'file': {}} for i in range(5)] + [
+                {'id': 'sub', 'name': 'sub', 'folder': {}}, {'id': 'gone', 'name': 'gone', 'folder': {}}],
+            'sub': [{'id': 'g', 'name': 'g.txt', 'file': {}}],
+        })
+        index = uploader.build_remote_path_index(BASE, 'base')
+        self.assertEqual(6, len(index))
+        self.assertEqual('g', index.get(os.path.join(BASE, 'sub'), 'g.txt')['id'])
+        # 4 pages of base, one of sub and the failed listing of gone
+        self.assertEqual(6, len(uploader.urls))
+        self.assertTrue(uploader.urls[0].startswith(
+            'https://graph/drive/items/base/children?$top=999&$select=id,name,size,file,folder,lastModifiedDateTime'))
+        self.assertEqual(1, len(uploader.errors))
+        self.assertEqual(6, uploader.count_remote_files_recursively('base'))
+
+    def test_lookups_use_normalized_names(self):
+        index = PathIndex(BASE)
+        index.add_file(index.add_folder(index.root, 'Q1: plans'), {'id': 'x', 'name': 'notes?.txt'})
+        # scanned files are named as written to the temp folder
+        self.assertEqual('x', index.get(os.path.join(BASE, 'Q1 plans'), 'notes?.txt')['id'])
+        self.assertEqual('x', index.get(os.path.join(BASE, 'Q1 plans'), 'notes.txt')['id'])
+        # destination names are case-insensitive
+        self.assertEqual('x', index.get(os.path.join(BASE, 'q1 PLANS'), 'Notes.TXT')['id'])
+        self.assertIsNone(index.get(os.path.join(BASE, 'Q1 plans'), 'other.txt'))
+        self.assertIsNone(index.get(os.path.join(BASE, 'missing'), 'notes.txt'))
+        self.assertIsNone(index.get(os.path.join('tmp', 'elsewhere'), 'notes.txt'))
+
+    def test_folder_missed_before_it_is_added_is_found_after(self):
+        index = PathIndex(BASE)
+        path = os.path.join(BASE, 'later')
+        self.assertIsNone(index.get_folder(path))
+        node = index.get_folder(path, create=True)
+        self.assertIs(node, index.get_folder(path))
+        self.assertEqual(path, node.path)
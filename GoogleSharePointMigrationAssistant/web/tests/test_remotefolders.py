@@ -0,0 +1,68 @@
+import os
+import threading
+from django.test import SimpleTestCase
+from ..plumbing.remotefolders import RemoteFolderCache
+
+BASE = os.path.join('tmp', 'migration')
+
+
+class FakeUploader(RemoteFolderCache):
+    """ Destination folders in memory: {(parent id, name): folder} """
+
+    def __init__(self, existing: dict = {}, create_conflicts: set = set()):
+        self.folders = dict(existing)
+        self.create_conflicts = set(create_conflicts)
+        self.created = []
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self.reset_remote_folder_cache()
+
+    def get_name_of_folder_or_file_from_path(self, path):
+        return os.path.basename(path)
+
+    def _child_exists(self, child_name: str = '', parent_folder_id: str = ''):
+        with self._lock:
+            self.lookups += 1
+            folder = self.folders.get((parent_folder_id, child_name))
+        return folder is not None, folder
+
+    def _create_remote_folder(self, folder_name: str = '', parent_id: str = ''):
+        with self._lock:
+            if parent_id not in ['root'] + [f['id'] for f in self.folders.values()]:
+                raise AssertionError(f'parent {parent_id} of {folder_name} does not exist yet')
+            folder = {'id': f'{parent_id}/{folder_name}', 'name': folder_name}
+            self.folders[(parent_id, folder_name)] = folder
+            if folder_name in self.create_conflicts:
+                # created by someone else between the lookup and the create
+                return {'error': {'code': 'nameAlreadyExists'}}
+            self.created.append(folder['id'])
+            return folder
+
+    def info(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+class RemoteFolderCacheTestCase(SimpleTestCase):
+    def test_tree_is_created_once_parents_first(self):
+        uploader = FakeUploader()
+        uploader.create_remote_folder_tree(
+            folder_paths={os.path.join(BASE, 'a', 'b', 'c'), os.path.join(BASE, 'a', 'd'), BASE},
+            base_path=BASE, base_parent_id='root')
+        self.assertEqual(
+            sorted(['root/migration', 'root/migration/a', 'root/migration/a/b',
+                    'root/migration/a/b/c', 'root/migration/a/d']),
+            sorted(uploader.created))
+        lookups = uploader.lookups
+        self.assertEqual('root/migration/a/d', uploader.get_remote_folder_id(os.path.join(BASE, 'a', 'd'), 'unused'))
+        self.assertEqual(lookups, uploader.lookups)
+
+    def test_existing_and_conflicting_folders_are_reused(self):
+        uploader = FakeUploader(
+            existing={('root', 'migration'): {'id': 'existing-id', 'name': 'migration'}},
+            create_conflicts={'a'})
+        self.assertEqual('existing-id', uploader.get_remote_folder_id(BASE, 'root'))
+        self.assertEqual('existing-id/a', uploader.get_remote_folder_id(os.path.join(BASE, 'a'), 'existing-id'))
+        self.assertEqual([], uploader.created)
@@ -0,0 +1,35 @@
+from django.test import SimpleTestCase
+from ..plumbing.scheduling import TransferScheduler
+
+FILES = [
+    {'id': 'a', 'size': '10'}, {'id': 'b', 'size': '500'}, {'id': 'doc'},
+    {'id': 'c', 'size': '40'}, {'id': 'd', 'size': '300'}, {'id': 'e', 'size': '20'},
+]
+
+
+def ids(files):
+    return [f['id'] for f in files]
+
+
+class TransferSchedulerTestCase(SimpleTestCase):
+    def test_policies_order_files(self):
+        self.assertEqual(['a', 'b', 'doc', 'c', 'd', 'e'], ids(TransferScheduler(FILES, policy='listing')))
+        self.assertEqual(['b', 'd', 'c', 'e', 'a', 'doc'], ids(TransferScheduler(FILES, policy='largest-first')))
+        self.assertEqual(['doc', 'a', 'e', 'c', 'd', 'b'], ids(TransferScheduler(FILES, policy='smallest-first')))
+
+    def test_batches_are_capped_by_count(self):
+        scheduler = TransferScheduler(FILES, policy='largest-first', batch_size=4)
+        self.assertEqual([['b', 'd', 'c', 'e'], ['a', 'doc']], [ids(scheduler.next_batch()) for _ in range(2)])
+        self.assertEqual(0, len(scheduler))
+
+    def test_bin_pack_caps_batches_by_bytes(self):
+        scheduler = TransferScheduler(FILES, policy='bin-pack', batch_size=4, batch_bytes=350)
+        batches = []
+        while len(scheduler):
+            batches.append(ids(scheduler.next_batch()))
+        # a file over the budget still gets a batch of its own
+        self.assertEqual([['b'], ['d', 'c'], ['e', 'a', 'doc']], batches)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            TransferScheduler(FILES, policy='random')
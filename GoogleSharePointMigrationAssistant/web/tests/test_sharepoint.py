@@ -0,0 +1,80 @@
+import os
+import shutil
+from unittest import mock
+from django.test import TestCase, override_settings
+from ..models import Migration, User, AdministrationSettings
+from ..plumbing.remotefolders import UploadRecord
+from ..plumbing.sharepoint import SharePointUploader
+from .conf import *
+
+BASE = os.path.join('tmp', 'migration')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class SharePointUploadFilesTestCase(TestCase):
+    def setUp(self):
+        AdministrationSettings(require_idp_login=False).save()
+        user = User.objects.create_user(
+            username='testuser', email='testuser@go365migrator.com', password='fakepass')
+        migration = Migration.objects.create(
+            user=user, google_source=GOOGLE_FOLDER_SOURCE, target=TARGET_EXAMPLE)
+        self.uploader = SharePointUploader(migration=migration, use_multithreading=True)
+        self.uploader.set_todo_count(total_files_to_upload=3)
+        self.addCleanup(shutil.rmtree, self.uploader.log_folder_path, ignore_errors=True)
+
+    def test_upload_files_uses_records_and_cached_folders(self):
+        records = [
+            UploadRecord(os.path.join(BASE, 'a.txt'), BASE, 1),
+            UploadRecord(os.path.join(BASE, 'sub', 'b.txt'), os.path.join(BASE, 'sub'), 2),
+            UploadRecord(os.path.join(BASE, 'sub', 'c.txt'), os.path.join(BASE, 'sub'), 3),
+        ]
+        created = []
+
+        def create_folder(folder_path='', parent_id=None):
+            created.append(folder_path)
+            return {'id': f'{parent_id}/{folder_path}'}
+
+        with mock.patch.object(self.uploader, '_child_exists', return_value=(False, None)), \
+                mock.patch.object(self.uploader, '_create_sharepoint_folder', side_effect=create_folder), \
+                mock.patch.object(self.uploader, '_upload_file') as upload_file, \
+                mock.patch('os.listdir', side_effect=AssertionError('walked the temp folder')):
+            self.uploader.upload_files(files=records, base_path=BASE, base_parent_id='target')
+            # a second batch into the same folders creates none
+            self.uploader.upload_files(files=records[1:], base_path=BASE, base_parent_id='target')
+        self.assertEqual(['migration', 'sub'], created)
+        self.assertEqual(
+            sorted([
+                (os.path.join(BASE, 'a.txt'), 'target/migration', 1),
+                (os.path.join(BASE, 'sub', 'b.txt'), 'target/migration/sub', 2),
+                (os.path.join(BASE, 'sub', 'c.txt'), 'target/migration/sub', 3),
+                (os.path.join(BASE, 'sub', 'b.txt'), 'target/migration/sub', 2),
+                (os.path.join(BASE, 'sub', 'c.txt'), 'target/migration/sub', 3),
+            ]),
+            sorted((c.kwargs['file_path'], c.kwargs['parent_id'], c.kwargs['total_file_size'])
+                   for c in upload_file.call_args_list))
+
+    def test_changed_file_replaces_its_destination_copy(self):
+        os.makedirs(BASE, exist_ok=True)
+        self.addCleanup(shutil.rmtree, 'tmp', ignore_errors=True)
+        path = os.path.join(BASE, 'a.txt')
+        with open(path, 'wb') as f:
+            f.write(b'changed')
+        record = UploadRecord(path, BASE, 7, replaces_item_id='old-a')
+
+        def child_exists(child_name='', parent_folder_id=''):
+            # folders are looked up; the replaced file is not
+            self.assertNotEqual('a.txt', child_name)
+            return False, None
+
+        with mock.patch.object(self.uploader, '_create_sharepoint_folder', return_value={'id': 'folder'}), \
+                mock.patch.object(self.uploader, '_child_exists', side_effect=child_exists), \
+                mock.patch.object(self.uploader, 'graph_delete', side_effect=AssertionError('deleted')), \
+                mock.patch.object(self.uploader, 'graph_put', return_value={'id': 'old-a'}) as graph_put, \
+                mock.patch('web.plumbing.sharepoint.get_token_from_cache', return_value={'access_token': 'token'}):
+            self.uploader.upload_files(files=[record], base_path=BASE, base_parent_id='target')
+        self.assertEqual(1, graph_put.call_count)
+        self.assertTrue(graph_put.call_args.kwargs['url'].endswith(
+            'items/folder:/a.txt:/content?@microsoft.graph.conflictBehavior=replace'))
+        self.assertEqual(1, self.uploader.num_completed_uploads)
@@ -0,0 +1,75 @@
+import os
+from django.test import SimpleTestCase
+from ..plumbing.contenthash import QuickXorHash
+from ..plumbing.pathindex import PathIndex
+from ..plumbing.transferplan import TransferPlan, compare_to_destination, parse_timestamp, CHANGED, NEW, UNCHANGED
+
+BASE = os.path.join('tmp', 'migration')
+HASH = QuickXorHash(b'content').b64digest()
+
+
+def item(size=7, modified='2023-05-01T10:00:00Z', quick_xor_hash=HASH, **kwargs):
+    return {'id': 'item', 'size': size, 'lastModifiedDateTime': modified,
+            'file': {'hashes': {'quickXorHash': quick_xor_hash}}, **kwargs}
+
+
+class CompareToDestinationTestCase(SimpleTestCase):
+    def setUp(self):
+        self.file = {'id': 'f', 'name': 'a.txt', 'size': '7', 'md5Checksum': 'md5',
+                     'modifiedTime': '2023-04-01T10:00:00.000Z', 'parent_folder_local_path': BASE}
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('2023-05-01T10:20:30.1234567Z'), parse_timestamp('2023-05-01T10:20:30.123456Z'))
+        self.assertIsNone(parse_timestamp(''))
+        self.assertIsNone(parse_timestamp('yesterday'))
+
+    def test_missing_is_new_and_size_change_is_changed(self):
+        self.assertEqual(NEW, compare_to_destination(self.file, None))
+        self.assertEqual(CHANGED, compare_to_destination(self.file, item(size=8)))
+
+    def test_timestamps_without_a_recorded_transfer(self):
+        self.assertEqual(UNCHANGED, compare_to_destination(self.file, item()))
+        self.file['modifiedTime'] = '2023-06-01T10:00:00.000Z'
+        self.assertEqual(CHANGED, compare_to_destination(self.file, item()))
+
+    def test_recorded_transfer_decides_over_timestamps(self):
+        self.file['modifiedTime'] = '2023-06-01T10:00:00.000Z'
+        # touched at the source, same content as transferred
+        self.assertEqual(UNCHANGED, compare_to_destination(self.file, item(), ('md5', HASH)))
+        # edited at the source since the transfer, same size
+        self.assertEqual(CHANGED, compare_to_destination(self.file, item(), ('other md5', HASH)))
+        # edited in the destination since the transfer
+        self.assertEqual(CHANGED, compare_to_destination(
+            self.file, item(quick_xor_hash=QuickXorHash(b'edited').b64digest()), ('md5', HASH)))
+
+
+class TransferPlanTestCase(SimpleTestCase):
+    def test_plan(self):
+        files = [
+            {'id': 'new', 'name': 'new.txt', 'size': '1', 'parent_folder_local_path': BASE},
+            {'id': 'same', 'name': 'same.txt', 'size': '7', 'parent_folder_local_path': BASE},
+            {'id': 'edited', 'name': 'edited.txt', 'size': '9', 'parent_folder_local_path': BASE},
+        ]
+        destination = PathIndex(BASE)
+        destination.add_file(destination.root, item(id='same-item', name='same.txt'))
+        destination.add_file(destination.root, item(id='edited-item', name='edited.txt'))
+        destination.add_file(destination.root, item(id='gone-item', name='gone.txt'))
+        logs = destination.add_folder(destination.root, 'migration-logs-user')
+        destination.add_file(logs, item(id='log-item', name='log.txt'))
+        plan = TransferPlan(files_list=files, destination_files=destination)
+        self.assertEqual({NEW: 1, CHANGED: 1, UNCHANGED: 1, 'deleted_at_source': 1}, plan.summary())
+        self.assertEqual(['new', 'edited'], [f['id'] for f in plan.files_to_transfer])
+        self.assertEqual('edited-item', files[2]['destination_item_id'])
+        self.assertNotIn('destination_item_id', files[1])
+        self.assertEqual(['gone-item'], [i['id'] for i in plan.deleted_at_source])
+
+    def test_files_added_as_they_are_scanned(self):
+        destination = PathIndex(BASE)
+        destination.add_file(destination.root, item(id='same-item', name='same.txt'))
+        destination.add_file(destination.root, item(id='gone-item', name='gone.txt'))
+        plan = TransferPlan(destination_files=destination)
+        self.assertEqual(['gone-item', 'same-item'], sorted(i['id'] for i in plan.deleted_at_source))
+        self.assertEqual([], plan.add([{'id': 'same', 'name': 'same.txt', 'size': '7', 'parent_folder_local_path': BASE}]))
+        files = plan.add([{'id': 'new', 'name': 'new.txt', 'size': '1', 'parent_folder_local_path': BASE}])
+        self.assertEqual(['new'], [f['id'] for f in files])
+        self.assertEqual({NEW: 1, CHANGED: 0, UNCHANGED: 1, 'deleted_at_source': 1}, plan.summary())
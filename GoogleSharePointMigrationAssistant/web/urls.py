@@ -12,6 +12,7 @@ urlpatterns = [
     # SSO - Microsoft Log In 
     path('init-m365-auth', MicrosoftSingleSignOnView.as_view(), name='init-m365-auth'),
     path('m365-redirect-uri', MicrosoftSingleSignOnCallbackView.as_view(), name='m365-redirect-uri'),
+    path('graph-lookup-cache-stats', GraphLookupCacheStatsView.as_view(), name='graph-lookup-cache-stats'),
 
     path('setup', SetupView.as_view(), name='setup'),
     path('list-migrations', ListMigrationsView.as_view(), name='list-migrations'),
@@ -21,6 +22,7 @@ urlpatterns = [
     path('google-oauth-redirect-uri', GoogleOAuthRedirectUri.as_view(), name='google-oauth-redirect-uri'),
 
     # migration source selection
+    path('google-drive-browse', GoogleDriveBrowseView.as_view(), name='google-drive-browse'),
     path('use-google-drive-folder-source/<str:item_id>', UseGoogleDriveFolderSourceView.as_view(), name='use-google-drive-folder-source'),
     path('use-google-drive-shared-drive-source/<str:item_id>', UseGoogleDriveSharedDriveSourceView.as_view(), name='use-google-drive-shared-drive-source'),
     path('change-source', ChangeSourceView.as_view(), name='change-source'),
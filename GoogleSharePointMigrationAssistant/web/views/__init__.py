@@ -1,6 +1,6 @@
 """ Views for web application"""
 from .auth import SignUpView, CustomLoginView, LogoutView
-from .m365 import MicrosoftSingleSignOnView, MicrosoftSingleSignOnCallbackView
+from .m365 import MicrosoftSingleSignOnView, MicrosoftSingleSignOnCallbackView, GraphLookupCacheStatsView
 from .base import HomeView
 from .migrations import (
     ListMigrationsView,
@@ -15,5 +15,5 @@ from .migrations import (
     MigrationStatePollView
 )
 from .setup import SetupView
-from .google import InitializeGoogleOAuthView, GoogleOAuthRedirectUri
+from .google import InitializeGoogleOAuthView, GoogleOAuthRedirectUri, GoogleDriveBrowseView
 from .scan import ScanSourceDataView, ScanSourceReportView, ScanSourceReportListenView
@@ -1,12 +1,15 @@
+import re
 from django.views.generic import View
 from django.shortcuts import redirect, render
-from googleapiclient.discovery import build
+from django.http import JsonResponse
+from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
 import google_auth_oauthlib.flow
 from django.core.cache import cache as django_cache
 from django.conf import settings
 import logging
 from ..models import AdministrationSettings
+from ..plumbing.googleservice import get_drive_service
 logger = logging.getLogger(__name__)
 
 
@@ -61,72 +64,122 @@ def get_google_credentials_from_session(request):
     return Credentials(**request.session.get('google_credentials'))
 
 
-def get_shared_drives(request, query=''):
-    with build('drive', 'v3', credentials=get_google_credentials_from_session(request)) as drive:
-        data = drive.drives().list(q=query).execute()
-        if 'drives' in data:
-            for f in data['drives']:
-                f['mimeTypeFriendly'] = 'Shared Drive'
-                request.session[f'google_shared_drive_{f["id"]}'] = f
-            return data['drives']
-        else:
-            logger.error({
-                'google_get_drives': {
-                    'error': data
-                }
-            })
-            return None
-
-
-def get_files(request, query=''):
-    with build('drive', 'v3',
-               credentials=get_google_credentials_from_session(request)) as drive:
-        data = drive.files().list(q=query, supportsAllDrives=True,
-                                  supportsTeamDrives=True, includeItemsFromAllDrives=True).execute()
-        if 'files' in data:
-            for f in data['files']:
-                if f['mimeType'] in MIMETYPES:
-                    f['mimeTypeFriendly'] = MIMETYPES[f['mimeType']]
-                else:
-                    f['mimeTypeFriendly'] = f['mimeType'].replace(
-                        'application/', '')
-                if f['mimeType'] == 'application/vnd.google-apps.folder':
-                    request.session[f'google_folder_{f["id"]}'] = f
-            return data['files']
-        else:
-            logger.error({
-                'google_get_files': {
-                    'error': data
-                }
-            })
-            return None
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+# Top-level nodes of the source picker; anything else is a folder or shared drive id
+BROWSE_ROOT_QUERIES = {
+    'root': "'root' in parents",
+    'shared-with-me': 'sharedWithMe',
+}
+SHARED_DRIVES_NODE = 'shared-drives'
+GOOGLE_DRIVE_ROOT_NODES = [
+    ('root', 'My Drive'), ('shared-with-me', 'Shared with me'), (SHARED_DRIVES_NODE, 'Shared Drives')
+]
+BROWSE_FILES_FIELDS = 'nextPageToken, files(id, name, mimeType, driveId)'
+BROWSE_DRIVES_FIELDS = 'nextPageToken, drives(id, name)'
+DRIVE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def is_browse_node(parent=''):
+    """ Whether parent is a picker node or could be a Drive id, i.e. is safe
+    to put in a files().list query """
+    return parent in BROWSE_ROOT_QUERIES or parent == SHARED_DRIVES_NODE or bool(DRIVE_ID_PATTERN.fullmatch(parent))
+
 
+def escape_query_value(value=''):
+    """ Escape a value for use in a single-quoted Drive query string """
+    return value.replace('\\', '\\\\').replace("'", "\\'")
 
-def get_google_drive_content(request):
-    """ return a unioned list of both folders and shared drives """
-    
-    if 'google_drive_content2' in request.session:
-        google_drive_content = request.session.get('google_drive_content')
+
+def set_friendly_mimetype(f):
+    if f['mimeType'] in MIMETYPES:
+        f['mimeTypeFriendly'] = MIMETYPES[f['mimeType']]
     else:
-        google_drive_content = get_files(
-            request, query="mimeType='application/vnd.google-apps.folder'")
-        google_drive_content += get_shared_drives(request)
-        request.session['google_drive_content'] = google_drive_content
-    return google_drive_content
+        f['mimeTypeFriendly'] = f['mimeType'].replace('application/', '')
+    return f
 
 
-def get_google_user_data(request):
-    with build('drive', 'v3',  credentials=get_google_credentials_from_session(request)) as drive:
-        data = drive.about().get(fields='user').execute()
-        logger.debug({'get_google_user_data_response': data})
-        if 'user' in data:
-            return data
+def get_google_drive_browse_cache_key(request, parent='', drive_id='', page_token=''):
+    google_user = request.session.get('google_user', {}).get('email_address', '')
+    return f'google-drive-browse:{request.user.pk}:{google_user}:{parent}:{drive_id}:{page_token}'
+
+
+def browse_google_drive(request, parent='root', drive_id='', page_token=''):
+    """ One page of the folders directly under parent (a BROWSE_ROOT_QUERIES
+    node, a folder id or, with drive_id, a shared drive), or of the user's
+    shared drives if parent is SHARED_DRIVES_NODE. Returns
+    {'items': [...], 'next_page_token': str or None}. Pages are cached for
+    GOOGLE_DRIVE_BROWSE_CACHE_TTL seconds. """
+    cache_key = get_google_drive_browse_cache_key(
+        request, parent=parent, drive_id=drive_id, page_token=page_token)
+    page = django_cache.get(cache_key)
+    if page is not None:
+        return page
+    try:
+        drive = get_drive_service(get_google_credentials_from_session(request))
+        if parent == SHARED_DRIVES_NODE:
+            data = drive.drives().list(
+                pageSize=settings.GOOGLE_DRIVE_BROWSE_PAGE_SIZE, pageToken=page_token or None,
+                fields=BROWSE_DRIVES_FIELDS).execute()
+            items = [
+                {**d, 'mimeTypeFriendly': 'Shared Drive'} for d in data.get('drives', [])]
         else:
-            logger.error({
-                'get_google_user_data_response': data,
-                'error': 'user_data_missing'
-            })
-            return None
+            query = BROWSE_ROOT_QUERIES.get(parent, f"'{escape_query_value(parent)}' in parents")
+            drive_kwargs = {'corpora': 'drive', 'driveId': drive_id} if drive_id else {}
+            data = drive.files().list(
+                q=f"{query} and mimeType = '{FOLDER_MIMETYPE}' and trashed = false",
+                pageSize=settings.GOOGLE_DRIVE_BROWSE_PAGE_SIZE, pageToken=page_token or None,
+                fields=BROWSE_FILES_FIELDS, orderBy='name', supportsAllDrives=True,
+                includeItemsFromAllDrives=True, **drive_kwargs).execute()
+            items = [set_friendly_mimetype(f) for f in data.get('files', [])]
+    except HttpError as e:
+        logger.error({
+            'browse_google_drive': {
+                'parent': parent,
+                'error': str(e)
+            }
+        })
+        return None
+    page = {'items': items, 'next_page_token': data.get('nextPageToken')}
+    django_cache.set(cache_key, page, settings.GOOGLE_DRIVE_BROWSE_CACHE_TTL)
+    return page
+
+
+def get_google_drive_folder(request, folder_id=''):
+    """ Metadata of one folder, for use as a migration source """
+    try:
+        drive = get_drive_service(get_google_credentials_from_session(request))
+        folder = drive.files().get(
+            fileId=folder_id, fields='id, name, mimeType, driveId', supportsAllDrives=True).execute()
+    except HttpError as e:
+        logger.error({'get_google_drive_folder': {'folder_id': folder_id, 'error': str(e)}})
+        return None
+    return set_friendly_mimetype(folder)
+
+
+def get_shared_drive(request, drive_id=''):
+    """ Metadata of one shared drive, for use as a migration source """
+    try:
+        drive = get_drive_service(get_google_credentials_from_session(request))
+        shared_drive = drive.drives().get(driveId=drive_id, fields='id, name').execute()
+    except HttpError as e:
+        logger.error({'get_shared_drive': {'drive_id': drive_id, 'error': str(e)}})
+        return None
+    shared_drive['mimeTypeFriendly'] = 'Shared Drive'
+    return shared_drive
+
+
+def get_google_user_data(request):
+    drive = get_drive_service(get_google_credentials_from_session(request))
+    data = drive.about().get(fields='user').execute()
+    logger.debug({'get_google_user_data_response': data})
+    if 'user' in data:
+        return data
+    else:
+        logger.error({
+            'get_google_user_data_response': data,
+            'error': 'user_data_missing'
+        })
+        return None
 
 
 def start_oauth_flow(request, config):
@@ -206,3 +259,24 @@ class InitializeGoogleOAuthView(View):
         django_cache.set('config', config)
 
         return start_oauth_flow(request=request, config=config)
+
+
+class GoogleDriveBrowseView(View):
+    """ JSON page of source picker children: ?parent=<node or id>[&drive_id=][&page_token=] """
+
+    def get(self, request):
+        if not request.user.is_authenticated or 'google_credentials' not in request.session:
+            return JsonResponse({'error': 'unauthorized'}, status=403)
+        parent = request.GET.get('parent', 'root')
+        drive_id = request.GET.get('drive_id', '')
+        if not is_browse_node(parent) or (drive_id and not DRIVE_ID_PATTERN.fullmatch(drive_id)):
+            return JsonResponse({'error': 'invalid parent or drive_id'}, status=400)
+        page = browse_google_drive(
+            request,
+            parent=parent,
+            drive_id=drive_id,
+            page_token=request.GET.get('page_token', '')
+        )
+        if page is None:
+            return JsonResponse({'error': 'failed to list Google Drive folders'}, status=502)
+        return JsonResponse({'success': page})
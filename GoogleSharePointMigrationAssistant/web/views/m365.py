@@ -3,8 +3,10 @@ from django.contrib.auth.models import User
 from django.contrib.auth import login
 from ..plumbing.m365_util import (
     get_random_value, get_sign_in_flow,
-    get_user_profile, get_token_from_code
+    get_user_profile, get_token_from_code,
+    get_graph_lookup_cache_stats
 )
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.views.generic import View
 import logging
@@ -60,3 +62,12 @@ class MicrosoftSingleSignOnCallbackView(View):
                 template_name='error.html',
                 context={'error': graph_user_data['error']}
             )
+
+
+class GraphLookupCacheStatsView(View):
+    """ Hit/miss counts and hit rate of the Graph browse lookup cache, for staff """
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({'error': 'unauthorized'}, status=403)
+        return JsonResponse({'success': get_graph_lookup_cache_stats()})
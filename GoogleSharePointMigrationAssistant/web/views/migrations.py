@@ -14,6 +14,7 @@ from ..plumbing.m365_util import (
     get_sharepoint_doclib_item_by_id, get_user_onedrive_item_by_id
 )
 from ..plumbing.migrationassistant import get_migration_from_cache
+from .google import get_google_drive_folder, get_shared_drive
 from ..plumbing.migrationassistant import migrate_data
 logger = logging.getLogger(__name__)
 
@@ -53,7 +54,13 @@ class UseGoogleDriveFolderSourceView(View, LoginRequiredMixin):
     """ Called when you select a specific Google Drive item as a source"""
 
     def get(self, request, item_id):
-        data = request.session.get(f'google_folder_{item_id}')
+        data = get_google_drive_folder(request, folder_id=item_id)
+        if data is None:
+            return render(
+                request=request,
+                template_name='error.html',
+                context={'error': 'Could not get that folder from Google Drive'}
+            )
         data['source_type'] = 'folder'
         request.session['source_selected'] = data
         return redirect('setup')
@@ -63,7 +70,13 @@ class UseGoogleDriveSharedDriveSourceView(View, LoginRequiredMixin):
     """ Called when you select a specific Google Drive item as a source"""
 
     def get(self, request, item_id):
-        data = request.session.get(f'google_shared_drive_{item_id}')
+        data = get_shared_drive(request, drive_id=item_id)
+        if data is None:
+            return render(
+                request=request,
+                template_name='error.html',
+                context={'error': 'Could not get that shared drive from Google Drive'}
+            )
         data['source_type'] = 'shared_drive'
         request.session['source_selected'] = data
 
@@ -3,8 +3,9 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import redirect, render
 from django.http import JsonResponse
 from ..models import Migration
+from ..plumbing.constants import SCAN_AND_MIGRATE
 from ..plumbing.migrationassistant import (
-    scan_data_source, get_migration_from_cache 
+    scan_data_source, scan_and_migrate_data, get_migration_from_cache 
 )
 
 class ScanSourceDataView(View, LoginRequiredMixin):
@@ -29,11 +30,19 @@ class ScanSourceDataView(View, LoginRequiredMixin):
         )
         migration.save()
         # async invocation of celery task
-        scan_data_source.delay(
-            migration_id=migration.id, 
-            google_credentials=request.session.get('google_credentials'), 
-            user_id=request.user.id
-        )
+        if SCAN_AND_MIGRATE:
+            scan_and_migrate_data.delay(
+                migration_id=migration.id, 
+                google_credentials=request.session.get('google_credentials'), 
+                user_id=request.user.id,
+                m365_token_cache=request.session.get('m365_token_cache')
+            )
+        else:
+            scan_data_source.delay(
+                migration_id=migration.id, 
+                google_credentials=request.session.get('google_credentials'), 
+                user_id=request.user.id
+            )
         return redirect('list-migrations')
 
 
@@ -2,7 +2,7 @@ from django.views.generic import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render
 import logging 
-from .google import get_google_drive_content
+from .google import GOOGLE_DRIVE_ROOT_NODES
 logger = logging.getLogger(__name__)
 
 
@@ -10,7 +10,6 @@ class SetupView(LoginRequiredMixin, View):
     login_url = 'login'
 
     def get(self, request):
-        google_drive_content = None
         context = {}
 
         if not 'google_user' in request.session:
@@ -20,10 +19,9 @@ class SetupView(LoginRequiredMixin, View):
             step = 'm365_login'
 
         elif not 'source_selected' in request.session or not request.session['source_selected']:
+            # folders are fetched a page at a time by the picker; see GoogleDriveBrowseView
             step = 'select_source'
-            google_drive_content = get_google_drive_content(request)
-            request.session['google_drive_content'] = google_drive_content
-            context['google_drive_content'] = google_drive_content
+            context['google_drive_root_nodes'] = GOOGLE_DRIVE_ROOT_NODES
 
         elif not 'destination_selected' in request.session or not request.session['destination_selected']:
             step = 'select_destination'